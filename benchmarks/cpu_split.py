@@ -0,0 +1,123 @@
+"""Throughput sweep over workers x threads-per-worker.
+
+    python benchmarks/cpu_split.py --workers 1,2,3,4 --threads 4,8,16 --jobs 3
+
+Every combination that fits on the host's physical cores is run with the
+same core partitioning and thread budgets the worker supervisor uses
+(disjoint cores, NUMA node by node). Model loading is excluded from the
+timing: all generators load first, then start together. Results are printed
+and appended as JSON lines to ``--output`` so hosts can be compared later.
+
+The default backend is the real diffusers pipeline; ``--backend fake`` is a
+quick dry run of the harness.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cpu_topology import partition, physical_cores
+from generator import GeneratorProcess
+
+
+def run_worker(index, cpu_set, args, barrier, results):
+    cpu_set.apply()
+    generator = GeneratorProcess("txt2img", args.python, args.model_path, backend=args.backend)
+    generator.start()
+    out_dir = tempfile.mkdtemp(prefix=f"flux_cpu_split_{index}_")
+    try:
+        barrier.wait()
+        started = time.perf_counter()
+        for i in range(args.jobs):
+            generator.generate({
+                "prompt": args.prompt,
+                "output_path": os.path.join(out_dir, f"{i}.png"),
+                "steps": args.steps,
+                "guidance_scale": 3.5,
+                "height": args.size,
+                "width": args.size,
+                "seed": i,
+            })
+        results.put((index, time.perf_counter() - started))
+    finally:
+        generator.close()
+
+
+def run_config(workers, threads, args):
+    sets = partition(workers, threads, use_smt=args.smt)
+    barrier = multiprocessing.Barrier(workers + 1)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=run_worker, args=(i, s, args, barrier, results)) for i, s in enumerate(sets)]
+    for p in procs:
+        p.start()
+    barrier.wait()  # every generator has loaded its model
+    started = time.perf_counter()
+    per_worker = [results.get() for _ in procs]
+    wall = time.perf_counter() - started
+    for p in procs:
+        p.join()
+
+    images = workers * args.jobs
+    return {
+        "host": socket.gethostname(),
+        "physical_cores": len(physical_cores()),
+        "workers": workers,
+        "cores_per_worker": threads,
+        "threads_per_worker": sets[0].threads,
+        "nodes": [s.nodes for s in sets],
+        "backend": args.backend,
+        "steps": args.steps,
+        "size": args.size,
+        "images": images,
+        "wall_seconds": round(wall, 2),
+        "seconds_per_image": round(max(t for _, t in per_worker) / args.jobs, 2),
+        "images_per_hour": round(images / wall * 3600, 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--workers", default="1,2,3,4")
+    ap.add_argument("--threads", default="", help="physical cores per worker (default: every split of the host)")
+    ap.add_argument("--jobs", type=int, default=3, help="images per worker per configuration")
+    ap.add_argument("--steps", type=int, default=4)
+    ap.add_argument("--size", type=int, default=1024)
+    ap.add_argument("--prompt", default="a lighthouse on a cliff at dusk")
+    ap.add_argument("--backend", default=os.getenv("FLUX_GENERATOR_BACKEND", "diffusers"))
+    ap.add_argument("--python", default=sys.executable)
+    ap.add_argument("--model-path", default="/home/smithkt/flux_schnell_cpu/flux_schnell_local")
+    ap.add_argument("--smt", action="store_true", help="also use hyperthread siblings")
+    ap.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpu_split_results.jsonl"))
+    args = ap.parse_args()
+
+    cores = len(physical_cores())
+    workers_list = [int(w) for w in args.workers.split(",") if w]
+    rows = []
+    for workers in workers_list:
+        threads_list = [int(t) for t in args.threads.split(",") if t] or [cores // workers]
+        for threads in threads_list:
+            if threads < 1 or workers * threads > cores:
+                print(f"skip {workers} x {threads}: needs {workers * threads} of {cores} physical cores")
+                continue
+            row = run_config(workers, threads, args)
+            rows.append(row)
+            print(f"{workers} workers x {row['threads_per_worker']:>2} threads: "
+                  f"{row['images_per_hour']:8.1f} images/hour ({row['seconds_per_image']} s/image)")
+            with open(args.output, "a") as f:
+                f.write(json.dumps(row) + "\n")
+
+    if rows:
+        best = max(rows, key=lambda r: r["images_per_hour"])
+        print(f"\nBest on {best['host']}: FLUX_MAX_WORKERS={best['workers']} "
+              f"FLUX_CORES_PER_WORKER={best['cores_per_worker']}"
+              f"{' FLUX_USE_SMT=1' if args.smt else ''}")
+
+
+if __name__ == "__main__":
+    main()
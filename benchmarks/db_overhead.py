@@ -0,0 +1,87 @@
+"""Per-call overhead of the DB layer: connection-per-call vs pooled connection.
+
+    python benchmarks/db_overhead.py --rows 20000 --calls 5000
+
+Runs against a throwaway database, never ~/flux_api/flux_jobs.db.
+"""
+import os
+import sys
+import time
+import uuid
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_get_job(path, job_id):
+    # What every db.py function used to do
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def legacy_update_status(path, job_id, status):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+    conn.commit()
+    conn.close()
+
+
+def timed(label, calls, fn):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed / calls * 1e6:9.1f} µs/call")
+    return elapsed / calls
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--calls", type=int, default=5000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="flux_db_bench_")
+    legacy_path = os.path.join(tmp, "legacy.db")
+    pooled_path = os.path.join(tmp, "pooled.db")
+    os.environ["FLUX_DB_PATH"] = pooled_path
+
+    import db
+
+    db.init_db()
+    ids = [uuid.uuid4().hex[:8] for _ in range(args.rows)]
+    with db.transaction():
+        for job_id in ids:
+            db.add_job(job_id, "benchmark prompt", 4, 3.5, 1024, 1024, True, f"{job_id}.png", tmp)
+    db.close_conn()
+
+    # Same data, default rollback journal, for the legacy pattern
+    src = sqlite3.connect(pooled_path)
+    dst = sqlite3.connect(legacy_path)
+    src.backup(dst)
+    dst.execute("PRAGMA journal_mode = DELETE")
+    dst.close()
+    src.close()
+
+    pick = lambda i: ids[(i * 7919) % len(ids)]
+    print(f"{args.rows} rows, {args.calls} calls each\n")
+
+    before = timed("get_job (connect per call)", args.calls, lambda i: legacy_get_job(legacy_path, pick(i)))
+    after = timed("get_job (pooled, WAL)", args.calls, lambda i: db.get_job(pick(i)))
+    print(f"{'':<40} {before / after:9.1f}x faster\n")
+
+    before = timed("update status (connect per call)", args.calls, lambda i: legacy_update_status(legacy_path, pick(i), "done"))
+    after = timed("update status (pooled, WAL)", args.calls, lambda i: db.update_job_status(pick(i), "done"))
+    print(f"{'':<40} {before / after:9.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""End-to-end load test: API + worker pool + fake generator on synthetic history.
+
+    python benchmarks/end_to_end.py --jobs 500000 --images 100000 --workers 2 \\
+        --rate generate=2 --rate status=50 --rate jobs=5 --rate gallery=5 --seconds 60
+
+Seeds a throwaway HOME (``flux_jobs.db`` with ``--jobs`` rows of history and
+``--images`` catalogued PNGs in ``FluxImages``), starts the API under uvicorn
+and the worker supervisor with the ``fake`` generator backend (flat-colour
+PNGs after ``--latency`` seconds, no model weights), then drives every
+endpoint in ``ENDPOINTS`` open-loop at its ``--rate`` in requests per second.
+Latency is measured from each request's scheduled start, so a server that
+falls behind shows it instead of silently slowing the client down.
+
+A probe thread takes and releases the SQLite write lock every
+``--lock-probe-ms`` to measure how long writers wait for each other. After
+the load stops, submitted jobs get ``--drain`` seconds to finish, and queue
+wait and run times are read back from the database. The report (with the
+git commit) is printed and, with ``--output``, appended as a JSON line so
+runs can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from status_under_load import PASSWORD, free_port, logged_in_opener, summary
+
+TOKEN = "benchmark-token"
+WORDS = ("castle", "dragon", "forest", "city", "portrait", "ocean", "robot", "sunset", "neon", "misty")
+
+# name: (method, path, needs a browser session)
+ENDPOINTS = {
+    "generate": ("POST", "/generate/json", False),
+    "status": ("GET", "/status/{job_id}", False),
+    "jobs": ("GET", "/jobs/json?limit=50", False),
+    "gallery": ("GET", "/gallery/json?limit=20&sort=random", False),
+    "job_table": ("GET", "/partials/job_table?status=all", True),
+    "queue": ("GET", "/partials/queue", True),
+    "metrics": ("GET", "/partials/metrics", True),
+}
+DEFAULT_RATES = {"generate": 2, "status": 50, "jobs": 5, "gallery": 5, "job_table": 0.5, "queue": 0.5, "metrics": 1}
+
+
+# ==========================
+# ✅ SYNTHETIC HISTORY
+# ==========================
+def seed(home, jobs, images, batch=20000):
+    """Fill the throwaway database and image directory; return the job ids."""
+    os.environ["HOME"] = home
+    os.environ["FLUX_DB_PATH"] = os.path.join(home, "flux_api", "flux_jobs.db")
+    os.makedirs(os.path.join(home, "flux_api"), exist_ok=True)
+    image_dir = os.path.join(home, "FluxImages")
+    os.makedirs(image_dir, exist_ok=True)
+
+    import db
+    from generator import write_png
+
+    db.init_db()
+    statuses = ("done",) * 17 + ("failed", "failed", "cancelled")
+    ids = [f"{i:08x}" for i in range(jobs)]
+    for start in range(0, jobs, batch):
+        rows = []
+        for i in range(start, min(start + batch, jobs)):
+            status = statuses[i % len(statuses)]
+            # Spread over roughly the last year, oldest first
+            stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() - (jobs - i) * 60))
+            rows.append(dict(
+                job_id=ids[i], prompt=" ".join(random.choices(WORDS, k=8)), steps=4, guidance_scale=3.5,
+                height=1024, width=1024, autotune=True, filename=f"{ids[i]}.png", output_dir=image_dir,
+                seed=i, status=status, start_time=stamp, end_time=stamp, queued_at=stamp,
+            ))
+        db.add_jobs(rows)
+
+    done = [job_id for i, job_id in enumerate(ids) if statuses[i % len(statuses)] == "done"][-images:]
+    for start in range(0, len(done), batch):
+        entries = []
+        for job_id in done[start:start + batch]:
+            path = os.path.join(image_dir, f"{job_id}.png")
+            write_png(path, 8, 8, (random.randrange(256), 64, 128))
+            st = os.stat(path)
+            entries.append({"filename": f"{job_id}.png", "job_id": job_id, "width": 8, "height": 8,
+                            "mtime": st.st_mtime, "size_bytes": st.st_size})
+        db.upsert_images(entries)
+        # History is already thumbnailed; the thumbnailer only sees new output
+        db.set_thumbnail_state([e["filename"] for e in entries], 1)
+    db.close_conn()
+    return ids
+
+
+# ==========================
+# ✅ PROCESSES
+# ==========================
+def service_env(home, args):
+    import bcrypt
+
+    return dict(
+        os.environ,
+        HOME=home,
+        FLUX_DB_PATH=os.path.join(home, "flux_api", "flux_jobs.db"),
+        FLUX_RUN_DIR=os.path.join(home, "run"),
+        SECRET_KEY="benchmark",
+        ADMIN_PASSWORD_HASH=bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode(),
+        N8N_API_TOKEN=TOKEN,
+        FLUX_GENERATOR_BACKEND="fake",
+        FLUX_FAKE_LATENCY=str(args.latency),
+        FLUX_MIN_WORKERS=str(args.workers),
+        FLUX_MAX_WORKERS=str(args.workers),
+        FLUX_CPU_PINNING="0",
+        FLUX_THUMBNAILER="1" if args.thumbnailer else "0",
+    )
+
+
+def start_services(home, port, args):
+    env = service_env(home, args)
+    log = open(os.path.join(home, "services.log"), "w")
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "flux_api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    workers = subprocess.Popen([sys.executable, "start_workers.py"], cwd=ROOT, env=env, stdout=log,
+                               stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/flux/metrics/json", timeout=1).read()
+            return api, workers
+        except OSError:
+            time.sleep(0.2)
+    stop_services(api, workers)
+    raise SystemExit(f"API did not start, see {log.name}")
+
+
+def stop_services(*procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ==========================
+# ✅ LOAD
+# ==========================
+class Endpoint:
+    """Fires one endpoint open-loop at ``rate`` requests per second."""
+
+    def __init__(self, name, base, rate, ids, submitted, threads):
+        self.name = name
+        self.method, self.path, needs_session = ENDPOINTS[name]
+        self.base = base
+        self.rate = rate
+        self.ids = ids
+        self.submitted = submitted
+        self.threads = threads
+        self.opener = logged_in_opener(base) if needs_session else urllib.request.build_opener()
+        self.latencies, self.errors, self.dropped = [], 0, 0
+        self.lock = threading.Lock()
+        self.ticks = queue.Queue()
+
+    def request(self):
+        if self.name == "generate":
+            body = json.dumps({"prompt": " ".join(random.choices(WORDS, k=8)), "width": 256, "height": 256}).encode()
+            req = urllib.request.Request(f"{self.base}{self.path}", data=body, method="POST", headers={
+                "Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"})
+            job = json.loads(self.opener.open(req, timeout=30).read())
+            self.submitted.append(job["job_id"])
+            return
+        path = self.path
+        if "{job_id}" in path:
+            # Mostly recent submissions, as pollers would; some history
+            recent = self.submitted[-200:]
+            pool = recent if recent and random.random() < 0.8 else self.ids
+            path = path.format(job_id=random.choice(pool))
+        self.opener.open(f"{self.base}{path}", timeout=30).read()
+
+    def _worker(self):
+        while True:
+            scheduled = self.ticks.get()
+            if scheduled is None:
+                return
+            try:
+                self.request()
+                failed = False
+            except (urllib.error.URLError, OSError, ValueError):
+                failed = True
+            latency = (time.perf_counter() - scheduled) * 1000
+            with self.lock:
+                if failed:
+                    self.errors += 1
+                else:
+                    self.latencies.append(latency)
+
+    def run(self, seconds):
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.threads)]
+        for t in workers:
+            t.start()
+        interval = 1 / self.rate
+        started = time.perf_counter()
+        n = 0
+        while True:
+            scheduled = started + n * interval
+            if scheduled - started >= seconds:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if self.ticks.qsize() > self.threads * 50:
+                # Hopelessly behind: count it instead of queueing forever
+                self.dropped += 1
+            else:
+                self.ticks.put(scheduled)
+            n += 1
+        for _ in workers:
+            self.ticks.put(None)
+        for t in workers:
+            t.join()
+        return n
+
+    def report(self, seconds, scheduled):
+        result = {"target_rps": self.rate, "scheduled": scheduled, "ok": len(self.latencies),
+                  "errors": self.errors, "dropped": self.dropped,
+                  "throughput_rps": round(len(self.latencies) / seconds, 2)}
+        if self.latencies:
+            result.update(summary(self.latencies))
+        return result
+
+
+class LockProbe:
+    """Measures how long it takes to get the SQLite write lock."""
+
+    def __init__(self, db_path, interval):
+        self.db_path = db_path
+        self.interval = interval
+        self.waits, self.timeouts = [], 0
+        self.stop = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        while not self.stop.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("ROLLBACK")
+                self.waits.append((time.perf_counter() - started) * 1000)
+            except sqlite3.OperationalError:
+                self.timeouts += 1
+        conn.close()
+
+    def report(self):
+        result = {"probes": len(self.waits), "timeouts": self.timeouts}
+        if self.waits:
+            result.update({f"write_lock_wait_{k}": v for k, v in summary(self.waits).items() if k != "requests"})
+        return result
+
+
+# ==========================
+# ✅ QUEUE STATS
+# ==========================
+def queue_report(db_path, job_ids, drain):
+    """Wait up to ``drain`` seconds for ``job_ids`` to finish; summarise their timings."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    deadline = time.monotonic() + drain
+    rows = []
+    while True:
+        rows = []
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows += conn.execute(
+                f"SELECT status, queued_at, start_time, end_time FROM jobs WHERE job_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+        unfinished = sum(r["status"] in ("queued", "in_progress") for r in rows)
+        if not unfinished or time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+    conn.close()
+
+    def seconds(a, b):
+        return (datetime.fromisoformat(b) - datetime.fromisoformat(a)).total_seconds() * 1000
+
+    done = [r for r in rows if r["status"] == "done" and r["queued_at"] and r["start_time"] and r["end_time"]]
+    result = {
+        "submitted": len(job_ids),
+        "done": len(done),
+        "failed": sum(r["status"] == "failed" for r in rows),
+        "unfinished": unfinished,
+    }
+    if done:
+        result["queue_wait_ms"] = summary([seconds(r["queued_at"], r["start_time"]) for r in done])
+        result["run_ms"] = summary([seconds(r["start_time"], r["end_time"]) for r in done])
+        result["end_to_end_ms"] = summary([seconds(r["queued_at"], r["end_time"]) for r in done])
+        first = min(r["queued_at"] for r in done)
+        last = max(r["end_time"] for r in done)
+        span = seconds(first, last) / 1000
+        result["jobs_per_hour"] = round(len(done) / span * 3600, 1) if span > 0 else None
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_rates(pairs):
+    rates = dict(DEFAULT_RATES)
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' (expected one of {', '.join(ENDPOINTS)})")
+        rates[name] = float(value)
+    return {name: rate for name, rate in rates.items() if rate > 0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--jobs", type=int, default=500000, help="synthetic history rows")
+    ap.add_argument("--images", type=int, default=100000, help="catalogued images (at most the done jobs)")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--latency", type=float, default=0.5, help="fake generator seconds per call")
+    ap.add_argument("--rate", action="append", default=[], metavar="ENDPOINT=RPS",
+                    help=f"requests per second, repeatable; endpoints: {', '.join(ENDPOINTS)} (0 disables)")
+    ap.add_argument("--seconds", type=float, default=60)
+    ap.add_argument("--threads", type=int, default=8, help="client threads per endpoint")
+    ap.add_argument("--drain", type=float, default=120, help="seconds to wait for submitted jobs to finish")
+    ap.add_argument("--lock-probe-ms", type=float, default=100)
+    ap.add_argument("--thumbnailer", action="store_true", help="also run the background thumbnailer")
+    ap.add_argument("--home", help="reuse an already seeded HOME instead of seeding a new one")
+    ap.add_argument("--output", help="append the result as a JSON line (compare runs across commits)")
+    args = ap.parse_args()
+    rates = parse_rates(args.rate)
+
+    if args.home:
+        home = args.home
+        ids = [r[0] for r in sqlite3.connect(os.path.join(home, "flux_api", "flux_jobs.db")).execute(
+            "SELECT job_id FROM jobs ORDER BY rowid DESC LIMIT 100000")]
+    else:
+        home = tempfile.mkdtemp(prefix="flux_e2e_")
+        started = time.perf_counter()
+        ids = seed(home, args.jobs, args.images)
+        print(f"Seeded {args.jobs} jobs and {min(args.images, len(ids))} images in {home} "
+              f"({time.perf_counter() - started:.0f}s)")
+    db_path = os.path.join(home, "flux_api", "flux_jobs.db")
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/flux"
+    api, workers = start_services(home, port, args)
+    submitted = []
+    try:
+        endpoints = [Endpoint(name, base, rate, ids, submitted, args.threads) for name, rate in rates.items()]
+        probe = LockProbe(db_path, args.lock_probe_ms / 1000)
+        probe_thread = threading.Thread(target=probe.run, daemon=True)
+        probe_thread.start()
+
+        scheduled = {}
+        runners = [threading.Thread(target=lambda e=e: scheduled.__setitem__(e.name, e.run(args.seconds)))
+                   for e in endpoints]
+        for t in runners:
+            t.start()
+        for t in runners:
+            t.join()
+        probe.stop.set()
+        probe_thread.join()
+        jobs = queue_report(db_path, list(submitted), args.drain)
+    finally:
+        stop_services(api, workers)
+
+    result = {
+        "commit": git_commit(),
+        "host": os.uname().nodename,
+        "config": {"jobs": args.jobs, "images": args.images, "workers": args.workers, "latency": args.latency,
+                   "seconds": args.seconds, "rates": rates},
+        "endpoints": {e.name: e.report(args.seconds, scheduled.get(e.name, 0)) for e in endpoints},
+        "queue": jobs,
+        "db_lock": probe.report(),
+        "home": home,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    print(f"\n{'endpoint':<10} {'target':>7} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for name, r in result["endpoints"].items():
+        print(f"{name:<10} {r['target_rps']:>7} {r['throughput_rps']:>7} {r.get('p50_ms', '-'):>8} "
+              f"{r.get('p95_ms', '-'):>8} {r.get('p99_ms', '-'):>8} {r['errors'] + r['dropped']:>7}")
+    if "queue_wait_ms" in jobs:
+        print(f"queue wait p50 {jobs['queue_wait_ms']['p50_ms']} ms, p95 {jobs['queue_wait_ms']['p95_ms']} ms; "
+              f"{jobs['done']}/{jobs['submitted']} done")
+    print(f"write lock wait p95 {result['db_lock'].get('write_lock_wait_p95_ms', '-')} ms")
+
+
+if __name__ == "__main__":
+    main()
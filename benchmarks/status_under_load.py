@@ -0,0 +1,167 @@
+"""/status latency while heavy dashboard requests run at the same time.
+
+    python benchmarks/status_under_load.py --jobs 50000 --images 20000 --heavy-clients 8
+
+Starts the API under uvicorn against a throwaway HOME (database, FluxImages),
+measures ``/status/{job_id}`` alone, then again while ``--heavy-clients``
+threads hammer ``/jobs``, ``/partials/job_table`` and ``/admin``. If heavy
+routes block the event loop or take every threadpool slot, the loaded p95
+climbs far above the idle one; it should stay roughly flat.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.cookiejar
+import urllib.request
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "benchmark"
+HEAVY_PATHS = ("/jobs?status=all&q=castle", "/partials/job_table?status=all", "/admin")
+
+
+def seed(home, jobs, images):
+    os.environ["HOME"] = home
+    os.environ["FLUX_DB_PATH"] = os.path.join(home, "flux_api", "flux_jobs.db")
+    os.makedirs(os.path.join(home, "flux_api"), exist_ok=True)
+    image_dir = os.path.join(home, "FluxImages")
+    os.makedirs(image_dir, exist_ok=True)
+
+    import db
+
+    db.init_db()
+    words = ("castle", "dragon", "forest", "city", "portrait", "ocean", "robot", "sunset")
+    statuses = ("done",) * 8 + ("failed", "queued")
+    ids = []
+    with db.transaction():
+        for i in range(jobs):
+            job_id = f"{i:08x}"
+            ids.append(job_id)
+            status = statuses[i % len(statuses)]
+            start = f"2025-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}"
+            db.add_job(job_id, " ".join(random.choices(words, k=6)), 4, 3.5, 1024, 1024, True, f"{job_id}.png",
+                       image_dir, status=status, start_time=None if status == "queued" else start,
+                       end_time=start if status != "queued" else None)
+    for i in range(images):
+        open(os.path.join(image_dir, f"{i:08x}.png"), "wb").close()
+    db.close_conn()
+    return ids
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(home, port):
+    import bcrypt
+
+    env = dict(
+        os.environ,
+        HOME=home,
+        SECRET_KEY="benchmark",
+        ADMIN_PASSWORD_HASH=bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode(),
+        FLUX_RUN_DIR=os.path.join(home, "run"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "flux_api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/flux/metrics/json", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("API did not start")
+
+
+def logged_in_opener(base):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    opener.open(f"{base}/login", data=urllib.parse.urlencode({"password": PASSWORD}).encode()).read()
+    return opener
+
+
+def measure_status(base, ids, seconds):
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        urllib.request.urlopen(f"{base}/status/{random.choice(ids)}").read()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def heavy_client(base, stop, counts):
+    opener = logged_in_opener(base)
+    while not stop.is_set():
+        for path in HEAVY_PATHS:
+            opener.open(f"{base}{path}").read()
+            counts[path] = counts.get(path, 0) + 1
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    pick = lambda pct: round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))], 2)
+    return {"requests": len(latencies), "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99), "max_ms": round(latencies[-1], 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--jobs", type=int, default=50000)
+    ap.add_argument("--images", type=int, default=20000)
+    ap.add_argument("--heavy-clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--output", help="append the result as a JSON line")
+    args = ap.parse_args()
+
+    home = tempfile.mkdtemp(prefix="flux_load_")
+    ids = seed(home, args.jobs, args.images)
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/flux"
+    server = start_server(home, port)
+    try:
+        idle = summary(measure_status(base, ids, args.seconds))
+
+        stop, counts = threading.Event(), {}
+        clients = [threading.Thread(target=heavy_client, args=(base, stop, counts), daemon=True)
+                   for _ in range(args.heavy_clients)]
+        for t in clients:
+            t.start()
+        time.sleep(1)  # let the heavy load build up
+        loaded = summary(measure_status(base, ids, args.seconds))
+        stop.set()
+        for t in clients:
+            t.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        "jobs": args.jobs,
+        "images": args.images,
+        "heavy_clients": args.heavy_clients,
+        "status_idle": idle,
+        "status_under_load": loaded,
+        "heavy_requests": counts,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
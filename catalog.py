@@ -0,0 +1,83 @@
+import os
+from PIL import Image
+
+from db import upsert_images, remove_images, get_catalog_mtimes, get_jobs_by_filenames
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+RECONCILE_BATCH = 1000
+
+# {image_dir: (directory mtime_ns, sorted PNG names)}
+_listing_cache = {}
+
+
+def _entry(path, job, stat):
+    try:
+        # Only the header is read here, not the pixel data
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        width, height = job.get("width"), job.get("height")
+    return {
+        "filename": os.path.basename(path),
+        "job_id": job["job_id"],
+        "width": width,
+        "height": height,
+        "mtime": stat.st_mtime,
+        "size_bytes": stat.st_size,
+    }
+
+
+def add_image(job, path):
+    """Record a finished job's output in the gallery catalog."""
+    upsert_images([_entry(path, job, os.stat(path))])
+
+
+def reconcile(image_dir=OUTPUT_DIR):
+    """Bring the catalog in line with the PNGs actually in ``image_dir``.
+
+    Only new or modified files are opened; images with no matching job
+    (uploads, init images) stay out of the gallery as before.
+    """
+    known = get_catalog_mtimes()
+    on_disk = {}
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if entry.name.lower().endswith(".png") and entry.is_file():
+                on_disk[entry.name] = entry.stat()
+
+    missing = [f for f in known if f not in on_disk]
+    changed = [f for f, st in on_disk.items() if known.get(f) != st.st_mtime]
+    jobs = get_jobs_by_filenames(changed)
+
+    batch, added = [], 0
+    for fname in changed:
+        job = jobs.get(fname)
+        if not job:
+            continue
+        batch.append(_entry(os.path.join(image_dir, fname), job, on_disk[fname]))
+        if len(batch) >= RECONCILE_BATCH:
+            upsert_images(batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        upsert_images(batch)
+        added += len(batch)
+
+    remove_images(missing)
+    return {"added": added, "removed": len(missing), "total_on_disk": len(on_disk)}
+
+
+def list_pngs(image_dir=OUTPUT_DIR):
+    """Sorted PNG filenames in ``image_dir`` (uploads and init images included).
+
+    The scan is redone only when the directory itself has changed, i.e. a
+    file was added, removed or renamed.
+    """
+    mtime = os.stat(image_dir).st_mtime_ns
+    cached = _listing_cache.get(image_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with os.scandir(image_dir) as it:
+        names = sorted(e.name for e in it if e.name.lower().endswith(".png") and e.is_file())
+    _listing_cache[image_dir] = (mtime, names)
+    return names
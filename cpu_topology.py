@@ -0,0 +1,126 @@
+"""CPU topology and per-worker core partitioning.
+
+Workers are given disjoint sets of physical cores, filled node by node so a
+worker's cores (and, through first-touch allocation, its memory) stay on one
+NUMA node whenever the core budget allows. Each worker also gets a matching
+thread budget for torch/OpenMP/MKL so the pools don't oversubscribe the host.
+"""
+import os
+import glob
+import shutil
+
+SYS_CPU = "/sys/devices/system/cpu"
+SYS_NODE = "/sys/devices/system/node"
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "FLUX_TORCH_THREADS")
+
+
+def parse_cpulist(text):
+    """Parse a kernel cpulist such as ``0-3,8,10-11``."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def numa_nodes(allowed):
+    """{node: [cpu, ...]} restricted to ``allowed``; one node 0 without NUMA info."""
+    nodes = {}
+    for path in sorted(glob.glob(os.path.join(SYS_NODE, "node[0-9]*"))):
+        cpulist = _read(os.path.join(path, "cpulist"))
+        cpus = [c for c in parse_cpulist(cpulist or "") if c in allowed]
+        if cpus:
+            nodes[int(os.path.basename(path)[4:])] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def physical_cores(allowed=None):
+    """Physical cores as ``(node, [logical cpus...])``, in node-then-core order.
+
+    SMT siblings of one core are grouped together; the first one listed is
+    the core's primary thread.
+    """
+    allowed = set(allowed if allowed is not None else os.sched_getaffinity(0))
+    cores = {}
+    for node, cpus in numa_nodes(allowed).items():
+        for cpu in cpus:
+            base = os.path.join(SYS_CPU, f"cpu{cpu}", "topology")
+            siblings = _read(os.path.join(base, "thread_siblings_list")) or _read(os.path.join(base, "core_cpus_list"))
+            key = tuple(sorted(c for c in parse_cpulist(siblings) if c in allowed)) if siblings else (cpu,)
+            cores.setdefault(key, node)
+    return [(node, list(key)) for key, node in sorted(cores.items(), key=lambda kv: (kv[1], kv[0]))]
+
+
+class CpuSet:
+    def __init__(self, cpus, nodes, threads):
+        self.cpus = cpus
+        self.nodes = nodes
+        self.threads = threads
+
+    def env(self):
+        env = {name: str(self.threads) for name in THREAD_ENV_VARS}
+        if len(self.nodes) == 1:
+            env["FLUX_NUMA_NODE"] = str(self.nodes[0])
+        return env
+
+    def apply(self):
+        """Pin the calling process (and everything it starts later)."""
+        os.sched_setaffinity(0, self.cpus)
+        os.environ.update(self.env())
+
+    def __repr__(self):
+        return f"CpuSet(cpus={self.cpus}, nodes={self.nodes}, threads={self.threads})"
+
+
+def partition(workers, cores_per_worker, use_smt=False, allowed=None):
+    """Split the host into ``workers`` disjoint CPU sets.
+
+    Each set has ``cores_per_worker`` physical cores (fewer if the host runs
+    out). Slot ``i`` always maps to the same cores, so resizing the pool never
+    moves a running worker. With ``use_smt`` the sibling hyperthreads are
+    included and count towards the thread budget.
+    """
+    cores = physical_cores(allowed)
+    by_node = {}
+    for node, cpus in cores:
+        by_node.setdefault(node, []).append(cpus)
+
+    # Whole workers per node first, then whatever is left across nodes
+    sets, leftovers = [], []
+    for node, node_cores in by_node.items():
+        while len(node_cores) >= cores_per_worker and len(sets) < workers:
+            sets.append((node_cores[:cores_per_worker], [node]))
+            node_cores = node_cores[cores_per_worker:]
+        leftovers += [(node, c) for c in node_cores]
+    while len(sets) < workers and leftovers:
+        chunk, leftovers = leftovers[:cores_per_worker], leftovers[cores_per_worker:]
+        sets.append(([c for _, c in chunk], sorted({n for n, _ in chunk})))
+
+    result = []
+    for chosen, nodes in sets:
+        cpus = sorted(c for core in chosen for c in (core if use_smt else core[:1]))
+        result.append(CpuSet(cpus, nodes, threads=len(cpus)))
+    return result
+
+
+def numa_prefix(env=os.environ):
+    """Command prefix binding memory to the worker's node, if numactl exists."""
+    node = env.get("FLUX_NUMA_NODE")
+    if node is None or len(glob.glob(os.path.join(SYS_NODE, "node[0-9]*"))) < 2:
+        return []
+    numactl = shutil.which("numactl")
+    return [numactl, f"--membind={node}"] if numactl else []
@@ -1,12 +1,96 @@
 import sqlite3
 import os
+import re
+import json
+import base64
+import hashlib
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 import pytz
 from dateutil import parser
 
-DB_PATH = os.path.expanduser("~/flux_api/flux_jobs.db")
+from metrics import timed, DB_OPERATION
+
+DB_PATH = os.path.expanduser(os.getenv("FLUX_DB_PATH", "~/flux_api/flux_jobs.db"))
 eastern = pytz.timezone("US/Eastern")
 
+# ==========================
+# ✅ CONNECTION MANAGEMENT
+# ==========================
+BUSY_TIMEOUT_MS = int(os.getenv("FLUX_DB_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.getenv("FLUX_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",       # readers never block the claiming writer
+    "PRAGMA synchronous = NORMAL",     # safe with WAL, one fsync per checkpoint
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+_local = threading.local()
+# Connections inherited across fork() must never be used (or closed) by the child
+_inherited = []
+
+
+def get_conn():
+    """Return this thread's connection, opening it on first use in this process.
+
+    Connections run in autocommit mode; use ``transaction()`` to group writes.
+    Prepared statements are cached per connection, so repeated queries skip
+    the parse/plan step.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    if conn is not None:
+        _inherited.append(conn)
+
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def close_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """Write transaction that takes the write lock up front (BEGIN IMMEDIATE).
+
+    Nested use joins the outer transaction.
+    """
+    conn = get_conn()
+    if conn.in_transaction:
+        yield conn
+        return
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    DB_OPERATION.labels("begin_immediate").observe(time.perf_counter() - started)
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
 def format_local_time(iso_str):
     try:
         utc_time = parser.isoparse(iso_str)
@@ -16,255 +100,677 @@ def format_local_time(iso_str):
         return iso_str
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS jobs (
-        job_id TEXT PRIMARY KEY,
-        prompt TEXT,
-        steps INTEGER,
-        guidance_scale REAL,
-        height INTEGER,
-        width INTEGER,
-        autotune INTEGER,
-        status TEXT,
-        filename TEXT,
-        custom_filename TEXT,
-        start_time TEXT,
-        end_time TEXT,
-        error_message TEXT,
-        output_dir TEXT,
-        init_image TEXT,
-        strength REAL
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def add_job(job_id, prompt, steps, guidance_scale, height, width, autotune, filename, output_dir, custom_filename=None, init_image=None, strength=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-    INSERT INTO jobs (job_id, prompt, steps, guidance_scale, height, width, autotune, status, filename, output_dir, custom_filename, init_image, strength)
-    VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
-    ''', (job_id, prompt, steps, guidance_scale, height, width, int(autotune), filename, output_dir, custom_filename, init_image, strength))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            prompt TEXT,
+            steps INTEGER,
+            guidance_scale REAL,
+            height INTEGER,
+            width INTEGER,
+            autotune INTEGER,
+            status TEXT,
+            filename TEXT,
+            custom_filename TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            error_message TEXT,
+            output_dir TEXT,
+            init_image TEXT,
+            strength REAL
+        )
+        ''')
+        _ensure_columns(conn, "jobs", {
+            "seed": "INTEGER",
+            "param_hash": "TEXT",    # canonical hash of the generation parameters
+            "cached_from": "TEXT",   # set when the result was served from the result cache
+            "lane": "TEXT NOT NULL DEFAULT 'bulk'",
+            "priority": "INTEGER NOT NULL DEFAULT 0",
+            "client": "TEXT",        # API token name or browser session that submitted it
+            "queued_at": "TEXT",
+            "worker": "TEXT",        # pid of the worker that claimed it
+            "peak_rss_bytes": "INTEGER",
+            "step_seconds": "REAL",  # wall seconds per denoising step of its generator call
+            "batch_size": "INTEGER", # jobs that shared that call
+        })
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_jobs_status_recent ON jobs(status, {RECENT_TS})")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_start_time ON jobs(start_time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_end_time ON jobs(end_time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs(filename)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(lane, priority, client) WHERE status = 'queued'")
+
+        # Fair-share state per submitting client (see claim_next_job)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS client_shares (
+            client TEXT PRIMARY KEY,
+            weight REAL NOT NULL DEFAULT 1,
+            vtime REAL NOT NULL DEFAULT 0
+        )
+        ''')
+
+        # Catalog of finished images shown in the gallery
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY,
+            filename TEXT UNIQUE NOT NULL,
+            job_id TEXT,
+            width INTEGER,
+            height INTEGER,
+            mtime REAL,
+            size_bytes INTEGER
+        )
+        ''')
+        _ensure_columns(conn, "images", {
+            "thumbs": "INTEGER NOT NULL DEFAULT 0",  # 0 pending, 1 rendered, -1 failed
+        })
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_newest ON images(mtime, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_thumbs_pending ON images(id) WHERE thumbs = 0")
+        # One stored permutation per seed slot; "random" order is an index walk
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_shuffle (
+            seed_slot INTEGER NOT NULL,
+            shuffle_key INTEGER NOT NULL,
+            image_id INTEGER NOT NULL,
+            PRIMARY KEY (seed_slot, shuffle_key, image_id)
+        ) WITHOUT ROWID
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_image_shuffle_image ON image_shuffle(image_id)")
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS images_drop_shuffle AFTER DELETE ON images BEGIN
+            DELETE FROM image_shuffle WHERE image_id = OLD.id;
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_drop_image AFTER DELETE ON jobs BEGIN
+            DELETE FROM images WHERE filename = OLD.filename;
+        END
+        ''')
+
+        _sync_shuffle_slots(conn)
+        _init_job_stats(conn)
+        _init_prompt_search(conn)
+
+        # Runtime settings changed from /admin (worker pool size, ...)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+
+        # Free-form monotonic counters (cache hits/misses, ...)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0
+        )
+        ''')
+
+        # Finished outputs by parameter hash, for identical seeded requests
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            param_hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            source_job_id TEXT,
+            created TEXT NOT NULL,
+            last_used TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_lru ON result_cache(last_used)")
+
+        # Background bulk operations started from /admin (see maintenance.py)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_tasks (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,      -- pending, running, done, failed
+            state TEXT,                -- resume point and running totals
+            processed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            runner TEXT,               -- pid of the process running it
+            created TEXT NOT NULL,
+            started TEXT,
+            finished TEXT,
+            updated TEXT
+        )
+        ''')
+
+        # Batch submissions already accepted, so retries don't enqueue twice
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT,
+            jobs TEXT NOT NULL,
+            created TEXT NOT NULL
+        )
+        ''')
+
+        # Live step progress of running jobs; one small row each, gone when they finish
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_progress (
+            job_id TEXT PRIMARY KEY,
+            step INTEGER NOT NULL,
+            steps INTEGER NOT NULL,
+            step_seconds REAL,
+            updated TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''')
+
+def _ensure_columns(conn, table, columns):
+    """Add any of ``columns`` ({name: declaration}) missing from ``table``."""
+    existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+JOB_INSERT = '''
+    INSERT INTO jobs (job_id, prompt, steps, guidance_scale, height, width, autotune, status, filename, output_dir, custom_filename, init_image, strength,
+                      seed, param_hash, cached_from, start_time, end_time, lane, priority, client, queued_at)
+    VALUES (:job_id, :prompt, :steps, :guidance_scale, :height, :width, :autotune, :status, :filename, :output_dir, :custom_filename, :init_image, :strength,
+            :seed, :param_hash, :cached_from, :start_time, :end_time, :lane, :priority, :client, :queued_at)
+'''
+
+def _job_row(job_id, prompt, steps, guidance_scale, height, width, autotune, filename, output_dir, custom_filename=None, init_image=None, strength=None,
+             seed=None, param_hash=None, status="queued", cached_from=None, start_time=None, end_time=None,
+             lane="bulk", priority=0, client=None, queued_at=None):
+    return {
+        "job_id": job_id, "prompt": prompt, "steps": steps, "guidance_scale": guidance_scale,
+        "height": height, "width": width, "autotune": int(autotune), "filename": filename,
+        "output_dir": output_dir, "custom_filename": custom_filename, "init_image": init_image,
+        "strength": strength, "seed": seed, "param_hash": param_hash, "status": status,
+        "cached_from": cached_from, "start_time": start_time, "end_time": end_time,
+        "lane": lane or "bulk", "priority": int(priority or 0), "client": client,
+        "queued_at": queued_at or datetime.utcnow().isoformat(),
+    }
+
+@timed
+def add_job(job_id, prompt, steps, guidance_scale, height, width, autotune, filename, output_dir, custom_filename=None, init_image=None, strength=None, **extra):
+    get_conn().execute(JOB_INSERT, _job_row(job_id, prompt, steps, guidance_scale, height, width, autotune,
+                                            filename, output_dir, custom_filename, init_image, strength, **extra))
+
+IDEMPOTENCY_TTL_DAYS = 7
+
+@timed
+def add_jobs(jobs, idempotency_key=None, request_hash=None):
+    """Insert many queued jobs in a single transaction.
+
+    ``jobs`` are dicts of ``add_job`` keyword arguments. Returns
+    ``(created, replay)``: ``created`` lists ``{"job_id", "filename"}``; if
+    ``idempotency_key`` was seen before nothing is inserted and ``replay`` is
+    the stored record (its jobs and request_hash) instead of None.
+    """
+    with transaction() as conn:
+        if idempotency_key:
+            row = conn.execute(
+                "SELECT jobs, request_hash FROM idempotency_keys WHERE key = ?", (idempotency_key,)
+            ).fetchone()
+            if row:
+                return json.loads(row["jobs"]), {"request_hash": row["request_hash"]}
+
+        conn.executemany(JOB_INSERT, [_job_row(**job) for job in jobs])
+        created = [{"job_id": job["job_id"], "filename": job["filename"]} for job in jobs]
+
+        if idempotency_key:
+            conn.execute("DELETE FROM idempotency_keys WHERE created < ?", (cutoff_iso(IDEMPOTENCY_TTL_DAYS),))
+            conn.execute(
+                "INSERT INTO idempotency_keys (key, request_hash, jobs, created) VALUES (?, ?, ?, ?)",
+                (idempotency_key, request_hash, json.dumps(created), datetime.utcnow().isoformat())
+            )
+    return created, None
 
 def count_jobs_by_status(status: str) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
-    count = c.fetchone()[0]
-    conn.close()
-    return count
-
-def delete_old_jobs(days=7):
-    cutoff = datetime.utcnow().timestamp() - (days * 86400)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    # Get jobs to delete
-    c.execute('''
-        SELECT job_id, filename FROM jobs
-        WHERE 
-            status IN ('done', 'failed') AND
-            COALESCE(strftime('%s', end_time), 0) < ?
-    ''', (cutoff,))
-    jobs = c.fetchall()
-
-    # Delete them
-    c.execute('''
-        DELETE FROM jobs
-        WHERE 
-            status IN ('done', 'failed') AND
-            COALESCE(strftime('%s', end_time), 0) < ?
-    ''', (cutoff,))
-    conn.commit()
-    conn.close()
-
-    return [dict(job) for job in jobs]
+    row = get_conn().execute("SELECT jobs FROM job_status_counts WHERE status = ?", (status,)).fetchone()
+    return row["jobs"] if row else 0
 
-def delete_job(job_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT filename FROM jobs WHERE job_id = ?", (job_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return None
-    filename = row[0]
+def get_status_counts():
+    """{status: jobs} from the trigger-maintained counters."""
+    return {r["status"]: r["jobs"] for r in get_conn().execute("SELECT status, jobs FROM job_status_counts")}
 
-    c.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
-    conn.commit()
-    conn.close()
-    return filename
+def cutoff_iso(days):
+    # Timestamps are stored as UTC isoformat strings, which sort chronologically
+    return datetime.utcfromtimestamp(datetime.utcnow().timestamp() - (days * 86400)).isoformat()
+
+def delete_job(job_id):
+    with transaction() as conn:
+        row = conn.execute("SELECT filename FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+    return row["filename"]
 
 def delete_queued_jobs():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM jobs WHERE status = 'queued'")
-    conn.commit()
-    conn.close()
+    get_conn().execute("DELETE FROM jobs WHERE status = 'queued'")
 
 def get_all_jobs():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM jobs ORDER BY start_time DESC")
-    rows = c.fetchall()
-    conn.close()
+    rows = get_conn().execute("SELECT * FROM jobs ORDER BY start_time DESC").fetchall()
     return [dict(row) for row in rows]
 
-def get_completed_jobs_for_archive(days=1):
-    cutoff = datetime.utcnow().timestamp() - (days * 86400)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
-        SELECT job_id, filename, end_time FROM jobs
-        WHERE status = 'done' AND COALESCE(strftime('%s', end_time), 0) < ?
-    ''', (cutoff,))
-    rows = c.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
-
+@timed
 def get_job(job_id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,))
-    row = c.fetchone()
-    conn.close()
+    row = get_conn().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
     return dict(row) if row else None
 
+@timed
 def get_job_by_filename(filename):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM jobs WHERE filename = ?", (filename,))
-    row = c.fetchone()
-    conn.close()
+    row = get_conn().execute("SELECT * FROM jobs WHERE filename = ?", (filename,)).fetchone()
     return dict(row) if row else None
 
 def get_job_for_retry(job_id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,))
-    row = c.fetchone()
-    conn.close()
-    return dict(row) if row and row["status"] == "failed" else None
+    job = get_job(job_id)
+    return job if job and job["status"] in ("failed", "cancelled") else None
 
-def get_job_metrics():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
 
-    c.execute("SELECT COUNT(*) as total FROM jobs")
-    total = c.fetchone()["total"]
+# ==========================
+# ✅ SCHEDULING
+# ==========================
+# Lanes in strict claim order: interactive work never waits behind bulk work
+LANES = ("interactive", "bulk")
+LANE_RANK = "CASE {r}.lane WHEN 'interactive' THEN 0 ELSE 1 END"
+VCLOCK = "queue.vclock"
 
-    c.execute("SELECT COUNT(*) as completed FROM jobs WHERE status = 'done'")
-    done = c.fetchone()["completed"]
+def set_client_weight(client, weight):
+    get_conn().execute('''
+        INSERT INTO client_shares (client, weight) VALUES (?, ?)
+        ON CONFLICT(client) DO UPDATE SET weight = excluded.weight
+    ''', (client, weight))
 
-    c.execute("SELECT COUNT(*) as failed FROM jobs WHERE status = 'failed'")
-    failed = c.fetchone()["failed"]
+@timed
+def claim_next_job(worker=None):
+    """Atomically move the next queued job to in_progress and return it.
 
-    # Duration in seconds
-    c.execute('''
-        SELECT AVG(strftime('%s', end_time) - strftime('%s', start_time)) as avg_duration
-        FROM jobs
-        WHERE status = 'done' AND start_time IS NOT NULL AND end_time IS NOT NULL
-    ''')
-    duration = c.fetchone()["avg_duration"]
+    Order: lane, then priority (higher first), then weighted fair share
+    between clients, then submission order. Fair share is start-time fair
+    queueing: each claim advances the client's virtual time by 1/weight and
+    the client with the lowest virtual time goes next. A client returning
+    from idle starts at the current virtual clock rather than its old value,
+    so it cannot bank credit while away.
+    """
+    now = datetime.utcnow().isoformat()
 
-    c.execute("SELECT MAX(start_time) as last_job FROM jobs")
-    last_job = c.fetchone()["last_job"]
+    # BEGIN IMMEDIATE: the pick and the update happen under one write lock,
+    # so two workers can never claim the same row.
+    with transaction() as conn:
+        return _claim_fair(conn, now, worker)
 
-    conn.close()
-    return {
-        "total_jobs": total,
-        "completed_jobs": done,
-        "failed_jobs": failed,
-        "average_duration_seconds": round(duration or 0, 2),
-        "most_recent_job_time": format_local_time(last_job) if last_job else "N/A"
-    }
+@timed
+def claim_compatible_jobs(first, limit, worker=None):
+    """Claim up to ``limit`` more queued txt2img jobs that can share a batch with ``first``.
 
-def get_oldest_queued_job():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-
-    # Begin a transaction to prevent race conditions
-    c.execute("BEGIN IMMEDIATE")
+    Companions must match steps, guidance scale and size and sit in the
+    same lane. They are picked one at a time by the same priority and fair
+    share rules as ``claim_next_job``, so a client with many compatible jobs
+    gets no more of a batch than its share.
+    """
+    if limit <= 0 or first.get("init_image"):
+        return []
+    now = datetime.utcnow().isoformat()
+    compatible = ("j.lane = ? AND j.init_image IS NULL AND j.steps IS ? AND j.guidance_scale IS ?"
+                  " AND j.height IS ? AND j.width IS ?")
+    params = (first["lane"], first["steps"], first["guidance_scale"], first["height"], first["width"])
+    rows = []
+    with transaction() as conn:
+        for _ in range(limit):
+            row = _claim_fair(conn, now, worker, compatible, params)
+            if not row:
+                break
+            rows.append(row)
+    return rows
 
-    # Find the next job with status 'queued'
-    c.execute("""
-        SELECT * FROM jobs
-        WHERE status = 'queued'
-        ORDER BY rowid ASC
+def _claim_fair(conn, now, worker, where="1", params=()):
+    # One claim under the caller's transaction: pick the fair-share winner
+    # among queued jobs matching ``where``, then charge its client
+    pick = conn.execute(f"""
+        WITH clock AS (SELECT COALESCE((SELECT value FROM counters WHERE name = ?), 0) AS v)
+        SELECT j.job_id, j.client, MAX(COALESCE(s.vtime, 0), clock.v) AS start_tag, COALESCE(s.weight, 1) AS weight
+        FROM jobs j CROSS JOIN clock
+        LEFT JOIN client_shares s ON s.client = j.client
+        WHERE j.status = 'queued' AND {where}
+        ORDER BY {LANE_RANK.format(r="j")}, j.priority DESC, start_tag ASC, j.rowid ASC
         LIMIT 1
-    """)
-    row = c.fetchone()
-
-    if row:
-        job_id = row["job_id"]
-        now = datetime.utcnow().isoformat()
-
-        # Update job to in_progress immediately
-        c.execute('''
-            UPDATE jobs
-            SET status = 'in_progress',
-                start_time = ?
-            WHERE job_id = ?
-        ''', (now, job_id))
-        conn.commit()
-        conn.close()
-        return dict(row)
-    else:
-        conn.commit()
-        conn.close()
+    """, (VCLOCK, *params)).fetchone()
+    if not pick:
         return None
 
-def get_recent_jobs(limit=50, status=None):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    row = conn.execute("""
+        UPDATE jobs
+        SET status = 'in_progress',
+            start_time = ?,
+            worker = ?
+        WHERE job_id = ? AND status = 'queued'
+        RETURNING *
+    """, (now, worker, pick["job_id"])).fetchone()
 
-    query = "SELECT * FROM jobs"
-    values = []
+    conn.execute('''
+        INSERT INTO counters (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    ''', (VCLOCK, pick["start_tag"]))
+    if pick["client"] is not None:
+        conn.execute('''
+            INSERT INTO client_shares (client, vtime) VALUES (?, ?)
+            ON CONFLICT(client) DO UPDATE SET vtime = excluded.vtime
+        ''', (pick["client"], pick["start_tag"] + 1.0 / max(pick["weight"], 0.01)))
+    return dict(row) if row else None
 
-    if status and status != "all":
-        query += " WHERE status = ?"
-        values.append(status)
+@timed
+def cancel_job(job_id):
+    """Mark a queued or running job cancelled; return its previous status.
 
-    c.execute(query, values)
-    rows = c.fetchall()
-    conn.close()
+    Returns None if the job doesn't exist. Finished jobs are left alone (the
+    previous status is returned unchanged).
+    """
+    now = datetime.utcnow().isoformat()
+    with transaction() as conn:
+        row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        if row["status"] in ("queued", "in_progress"):
+            conn.execute('''
+                UPDATE jobs SET status = 'cancelled', end_time = ?, error_message = 'Cancelled'
+                WHERE job_id = ?
+            ''', (now, job_id))
+    return row["status"]
 
-    status_priority = {
-        "in_progress": 0,
-        "processing": 0,
-        "failed": 1,
-        "queued": 2,
-        "done": 3
-    }
+@timed
+def requeue_jobs(job_ids):
+    """Put claimed-but-unfinished jobs back in the queue (e.g. a batch that was cut short)."""
+    if not job_ids:
+        return
+    get_conn().execute(f'''
+        UPDATE jobs SET status = 'queued', start_time = NULL, worker = NULL
+        WHERE status = 'in_progress' AND job_id IN ({",".join("?" * len(job_ids))})
+    ''', list(job_ids))
 
-    def sort_key(job):
-        prio = status_priority.get(job["status"], 99)
-        raw_ts = job.get("end_time") or job.get("start_time")
-        try:
-            ts = datetime.fromisoformat(raw_ts).timestamp()
-        except:
-            ts = 0
-        return (prio, -ts)
+def fail_orphaned_jobs(is_alive):
+    """Fail in-progress jobs whose worker is gone; return their ids.
+
+    ``is_alive(worker)`` decides for each distinct worker id.
+    """
+    conn = get_conn()
+    workers = [r["worker"] for r in conn.execute(
+        "SELECT DISTINCT worker FROM jobs WHERE status = 'in_progress'"
+    )]
+    dead = [w for w in workers if not is_alive(w)]
+    if not dead:
+        return []
+    now = datetime.utcnow().isoformat()
+    with transaction() as conn:
+        rows = conn.execute(f'''
+            UPDATE jobs SET status = 'failed', end_time = ?, error_message = 'Worker exited unexpectedly'
+            WHERE status = 'in_progress' AND worker IN ({",".join("?" * len(dead))})
+            RETURNING job_id
+        ''', [now, *dead]).fetchall()
+        clear_job_progress([r["job_id"] for r in rows])
+    return [r["job_id"] for r in rows]
+
+def get_recent_footprints(limit=50):
+    """Peak worker memory (bytes) of the most recently finished jobs."""
+    rows = get_conn().execute('''
+        SELECT peak_rss_bytes FROM jobs
+        WHERE status = 'done' AND peak_rss_bytes IS NOT NULL
+        ORDER BY end_time DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    return [r["peak_rss_bytes"] for r in rows]
 
-    return sorted([dict(r) for r in rows], key=sort_key)[:limit]
+QUEUE_PLAN_LIMIT = 5000
 
-def update_job_status(job_id, status, start_time=None, end_time=None, error_message=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    fields = []
+@timed
+def get_queue_plan(limit=QUEUE_PLAN_LIMIT):
+    """Queued jobs in the order ``claim_next_job`` would take them.
+
+    Replays the claim rules in memory against the current fair-share state
+    (assuming no new arrivals). Each job gets ``position`` (overall, 0 = next)
+    and ``lane_position`` (within its lane).
+    """
+    conn = get_conn()
+    rows = conn.execute('''
+        SELECT rowid AS row_id, job_id, prompt, lane, priority, client, queued_at, steps, width, height, init_image
+        FROM jobs WHERE status = 'queued' ORDER BY rowid LIMIT ?
+    ''', (limit,)).fetchall()
+    shares = {r["client"]: dict(r) for r in conn.execute("SELECT * FROM client_shares")}
+    clock = conn.execute("SELECT value FROM counters WHERE name = ?", (VCLOCK,)).fetchone()
+    clock = clock["value"] if clock else 0
+
+    # One FIFO per (lane, priority, client); only queue heads compete
+    queues = {}
+    for r in rows:
+        job = dict(r)
+        rank = LANES.index(job["lane"]) if job["lane"] in LANES else len(LANES) - 1
+        queues.setdefault((rank, -job["priority"], job["client"]), []).append(job)
+    vtime = {c: s["vtime"] for c, s in shares.items()}
+
+    plan, lane_counts = [], {}
+    while queues:
+        def sort_key(item):
+            (rank, neg_priority, client), jobs = item
+            return rank, neg_priority, max(vtime.get(client, 0), clock), jobs[0]["row_id"]
+        key, jobs = min(queues.items(), key=sort_key)
+        client = key[2]
+        start_tag = max(vtime.get(client, 0), clock)
+        clock = start_tag
+        if client is not None:
+            weight = shares.get(client, {}).get("weight", 1)
+            vtime[client] = start_tag + 1.0 / max(weight, 0.01)
+
+        job = jobs.pop(0)
+        if not jobs:
+            del queues[key]
+        job["position"] = len(plan)
+        job["lane_position"] = lane_counts.get(job["lane"], 0)
+        lane_counts[job["lane"]] = job["lane_position"] + 1
+        plan.append(job)
+    return plan
+
+# ==========================
+# ✅ RECENT JOBS (keyset pagination)
+# ==========================
+# Last activity; '' instead of NULL so queued rows compare and index cleanly
+RECENT_TS = "COALESCE(end_time, start_time, '')"
+
+# Status groups in display order. Statuses sharing a group share a rank.
+RECENT_ORDERS = {
+    # Home page: running, then failures, then the queue, then history
+    "dashboard": (("in_progress", "processing"), ("failed",), ("queued",), ("done", "cancelled")),
+    # Job dashboard / API: running, then the queue, then failures, then history
+    "queue": (("in_progress", "processing"), ("queued",), ("failed",), ("done", "cancelled")),
+}
+
+# Queued jobs are listed oldest first (next to run); everything else newest first
+ASCENDING_STATUSES = {"queued"}
+
+
+def encode_cursor(*values):
+    raw = json.dumps(list(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, *types):
+    """Decode a cursor made by ``encode_cursor``, coercing each value with ``types``."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(values) != len(types):
+            raise ValueError
+        return [t(v) for t, v in zip(types, values)]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _status_slice(conn, status, after, limit):
+    ascending = status in ASCENDING_STATUSES
+    op, direction = (">", "ASC") if ascending else ("<", "DESC")
+    query = "SELECT rowid AS row_id, * FROM jobs WHERE status = ?"
+    values = [status]
+    if after:
+        # The first comparison bounds the index range, the row value breaks ties
+        query += f" AND {RECENT_TS} {op}= ? AND ({RECENT_TS}, rowid) {op} (?, ?)"
+        values += [after[0], after[0], after[1]]
+    query += f" ORDER BY {RECENT_TS} {direction}, rowid {direction} LIMIT ?"
+    values.append(limit)
+    rows = [dict(r) for r in conn.execute(query, values).fetchall()]
+    for r in rows:
+        r["_ts"] = r["end_time"] or r["start_time"] or ""
+    return rows
+
+@timed
+def get_recent_jobs_page(limit=50, status=None, cursor=None, order="dashboard"):
+    """Return ``(jobs, next_cursor)`` in status-priority order.
+
+    Each status is read straight off ``idx_jobs_status_recent``, so a page
+    costs O(limit) regardless of table size. ``next_cursor`` is None on the
+    last page.
+    """
+    groups = ((status,),) if status and status != "all" else RECENT_ORDERS[order]
+    first_group, after = 0, None
+    if cursor:
+        first_group, ts, row_id = decode_cursor(cursor, int, str, int)
+        after = (ts, row_id)
+
+    conn = get_conn()
+    picked = []
+    for group_index in range(first_group, len(groups)):
+        wanted = limit + 1 - len(picked)
+        if wanted <= 0:
+            break
+        group_after = after if group_index == first_group else None
+        rows = []
+        for st in groups[group_index]:
+            rows += _status_slice(conn, st, group_after, wanted)
+        if len(groups[group_index]) > 1:
+            rows.sort(key=lambda r: (r["_ts"], r["row_id"]),
+                      reverse=groups[group_index][0] not in ASCENDING_STATUSES)
+        picked += [(group_index, r) for r in rows[:wanted]]
+
+    next_cursor = None
+    if len(picked) > limit:
+        picked = picked[:limit]
+        group_index, last = picked[-1]
+        next_cursor = encode_cursor(group_index, last["_ts"], last["row_id"])
+
+    jobs = []
+    for _, r in picked:
+        r.pop("_ts")
+        r.pop("row_id")
+        jobs.append(r)
+    return jobs, next_cursor
+
+def get_recent_jobs(limit=50, status=None, order="dashboard"):
+    return get_recent_jobs_page(limit=limit, status=status, order=order)[0]
+
+# ==========================
+# ✅ PROMPT SEARCH (FTS5)
+# ==========================
+# External-content index over jobs.prompt keyed by the jobs rowid, kept in
+# sync by triggers. Prefix indexes make short "cas*" queries cheap.
+PROMPT_FTS_TRIGGERS = {
+    "jobs_fts_insert": "AFTER INSERT ON jobs BEGIN {insert} END",
+    "jobs_fts_delete": "AFTER DELETE ON jobs BEGIN {delete} END",
+    "jobs_fts_update": "AFTER UPDATE OF prompt ON jobs BEGIN {delete} {insert} END",
+}
+
+def _init_prompt_search(conn):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'jobs_fts'").fetchone()
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+        prompt,
+        content = 'jobs',
+        content_rowid = 'rowid',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    ''')
+    insert = "INSERT INTO jobs_fts (rowid, prompt) VALUES (NEW.rowid, NEW.prompt);"
+    delete = "INSERT INTO jobs_fts (jobs_fts, rowid, prompt) VALUES ('delete', OLD.rowid, OLD.prompt);"
+    for name, body in PROMPT_FTS_TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body.format(insert=insert, delete=delete)}")
+    if not exists:
+        rebuild_prompt_index()
+
+def rebuild_prompt_index():
+    """Re-read every prompt into the index (first run, or after a VACUUM renumbered rowids)."""
+    get_conn().execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('rebuild')")
+
+def fts_query(text):
+    """Turn search box input into an FTS5 MATCH expression.
+
+    ``"quoted words"`` match as a phrase, a trailing ``*`` makes a prefix
+    search and everything else must appear somewhere in the prompt.
+    Punctuation is dropped, so user input can never be a syntax error.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', text or ""):
+        tokens = re.findall(r"\w+", phrase or word)
+        if not tokens:
+            continue
+        if phrase:
+            terms.append('"' + " ".join(tokens) + '"')
+            continue
+        terms += [f'"{t}"' for t in tokens]
+        if word.endswith("*"):
+            terms[-1] += "*"
+    return " ".join(terms)
+
+SEARCH_SORTS = ("rank", "newest")
+
+@timed
+def search_jobs(query, limit=50, cursor=None, status=None, sort="rank"):
+    """Return ``(jobs, next_cursor)`` whose prompts match ``query``.
+
+    ``sort="rank"`` orders by bm25 relevance, ``"newest"`` by submission.
+    Pages are keyset-paginated on (rank, rowid) or rowid; a bad cursor
+    raises ValueError.
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Unknown sort '{sort}'")
+    match = fts_query(query)
+    if not match:
+        return [], None
+
+    sql = '''
+        SELECT j.rowid AS row_id, j.*, jobs_fts.rank AS score
+        FROM jobs_fts JOIN jobs j ON j.rowid = jobs_fts.rowid
+        WHERE jobs_fts MATCH ?
+    '''
+    values = [match]
+    if status and status != "all":
+        sql += " AND j.status = ?"
+        values.append(status)
+    if sort == "rank":
+        if cursor:
+            score, row_id = decode_cursor(cursor, float, int)
+            sql += " AND (jobs_fts.rank, jobs_fts.rowid) > (?, ?)"
+            values += [score, row_id]
+        sql += " ORDER BY jobs_fts.rank, jobs_fts.rowid"
+    else:
+        if cursor:
+            (row_id,) = decode_cursor(cursor, int)
+            sql += " AND jobs_fts.rowid < ?"
+            values.append(row_id)
+        sql += " ORDER BY jobs_fts.rowid DESC"
+    sql += " LIMIT ?"
+    values.append(limit + 1)
+
+    rows = [dict(r) for r in get_conn().execute(sql, values).fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["score"], last["row_id"]) if sort == "rank" else encode_cursor(last["row_id"])
+    for r in rows:
+        r.pop("row_id")
+        r.pop("score")
+    return rows, next_cursor
+
+@timed
+def update_job_status(job_id, status, start_time=None, end_time=None, error_message=None, cached_from=None, peak_rss_bytes=None,
+                      step_seconds=None, batch_size=None, expected_status=None):
+    """Update a job; with ``expected_status`` only if it is still in that state.
+
+    Returns whether a row was updated.
+    """
+    fields = ["status = ?"]
     values = [status]
     if start_time:
         fields.append("start_time = ?")
@@ -275,10 +781,797 @@ def update_job_status(job_id, status, start_time=None, end_time=None, error_mess
     if error_message:
         fields.append("error_message = ?")
         values.append(error_message)
+    if cached_from:
+        fields.append("cached_from = ?")
+        values.append(cached_from)
+    if peak_rss_bytes:
+        fields.append("peak_rss_bytes = ?")
+        values.append(peak_rss_bytes)
+    if step_seconds:
+        fields.append("step_seconds = ?")
+        values.append(step_seconds)
+    if batch_size:
+        fields.append("batch_size = ?")
+        values.append(batch_size)
     values.append(job_id)
-    c.execute(f'''
-    UPDATE jobs SET status = ?, {', '.join(fields)} WHERE job_id = ?
+    guard = ""
+    if expected_status:
+        guard = " AND status = ?"
+        values.append(expected_status)
+    cur = get_conn().execute(f'''
+    UPDATE jobs SET {', '.join(fields)} WHERE job_id = ?{guard}
     ''', values)
-    conn.commit()
-    conn.close()
+    return cur.rowcount > 0
+
+# ==========================
+# ✅ IMAGE CATALOG
+# ==========================
+# Stored permutations for "random" order, one index row per image each. A
+# session's seed picks one of them and a direction, so there are twice this
+# many distinct orders; more slots mean more variety and a bigger index.
+SHUFFLE_SLOTS = max(1, int(os.getenv("FLUX_GALLERY_SHUFFLE_SLOTS", "8")))
+
+def shuffle_key(slot, filename):
+    digest = hashlib.blake2b(f"{slot}:{filename}".encode(), digest_size=7).digest()
+    return int.from_bytes(digest, "big")
+
+def _sync_shuffle_slots(conn):
+    # Follow a changed FLUX_GALLERY_SHUFFLE_SLOTS: drop extra slots, fill new ones
+    conn.execute("DELETE FROM image_shuffle WHERE seed_slot >= ?", (SHUFFLE_SLOTS,))
+    images = None
+    for slot in range(SHUFFLE_SLOTS):
+        if conn.execute("SELECT 1 FROM image_shuffle WHERE seed_slot = ? LIMIT 1", (slot,)).fetchone():
+            continue
+        if images is None:
+            images = conn.execute("SELECT id, filename FROM images").fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO image_shuffle (seed_slot, shuffle_key, image_id) VALUES (?, ?, ?)",
+            [(slot, shuffle_key(slot, r["filename"]), r["id"]) for r in images]
+        )
+
+@timed
+def upsert_images(entries):
+    """Insert or refresh catalog rows. ``entries`` are dicts with
+    filename, job_id, width, height, mtime and size_bytes."""
+    with transaction() as conn:
+        for e in entries:
+            image_id = conn.execute('''
+                INSERT INTO images (filename, job_id, width, height, mtime, size_bytes)
+                VALUES (:filename, :job_id, :width, :height, :mtime, :size_bytes)
+                ON CONFLICT(filename) DO UPDATE SET
+                    job_id = excluded.job_id,
+                    width = excluded.width,
+                    height = excluded.height,
+                    mtime = excluded.mtime,
+                    size_bytes = excluded.size_bytes,
+                    thumbs = CASE WHEN images.mtime IS excluded.mtime THEN images.thumbs ELSE 0 END
+                RETURNING id
+            ''', e).fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO image_shuffle (seed_slot, shuffle_key, image_id) VALUES (?, ?, ?)",
+                [(slot, shuffle_key(slot, e["filename"]), image_id) for slot in range(SHUFFLE_SLOTS)]
+            )
 
+def remove_images(filenames):
+    filenames = list(filenames)
+    with transaction() as conn:
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            conn.execute(f"DELETE FROM images WHERE filename IN ({','.join('?' * len(chunk))})", chunk)
+
+@timed
+def get_pending_thumbnails(limit=100):
+    """Filenames of catalogued images still waiting for thumbnails, newest first."""
+    rows = get_conn().execute(
+        "SELECT filename FROM images WHERE thumbs = 0 ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [r["filename"] for r in rows]
+
+@timed
+def set_thumbnail_state(filenames, state):
+    filenames = list(filenames)
+    with transaction() as conn:
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            conn.execute(f"UPDATE images SET thumbs = ? WHERE filename IN ({','.join('?' * len(chunk))})", [state, *chunk])
+
+def reset_thumbnails():
+    """Mark every catalogued image as pending again; return how many changed."""
+    return get_conn().execute("UPDATE images SET thumbs = 0 WHERE thumbs != 0").rowcount
+
+def count_pending_thumbnails():
+    return get_conn().execute("SELECT COUNT(*) FROM images WHERE thumbs = 0").fetchone()[0]
+
+def get_catalog_mtimes():
+    return {r["filename"]: r["mtime"] for r in get_conn().execute("SELECT filename, mtime FROM images")}
+
+def get_jobs_by_filenames(filenames):
+    filenames = list(filenames)
+    jobs = {}
+    conn = get_conn()
+    for i in range(0, len(filenames), 500):
+        chunk = filenames[i:i + 500]
+        rows = conn.execute(
+            f"SELECT job_id, filename, width, height FROM jobs WHERE filename IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        jobs.update({r["filename"]: dict(r) for r in rows})
+    return jobs
+
+@timed
+def get_gallery_page(sort="newest", limit=20, cursor=None, seed=0):
+    """Return ``(images, next_cursor)`` from the catalog.
+
+    Every page, however deep, is an index seek from the cursor.
+    """
+    conn = get_conn()
+    if sort == "random":
+        slot = seed % SHUFFLE_SLOTS
+        ascending = (seed // SHUFFLE_SLOTS) % 2 == 0
+        query = '''
+            SELECT i.*, s.shuffle_key AS k1, s.image_id AS k2
+            FROM image_shuffle s JOIN images i ON i.id = s.image_id
+            WHERE s.seed_slot = ?
+        '''
+        values = [slot]
+        if cursor:
+            key, image_id = decode_cursor(cursor, int, int)
+            query += f" AND (s.shuffle_key, s.image_id) {'>' if ascending else '<'} (?, ?)"
+            values += [key, image_id]
+        order = "" if ascending else " DESC"
+        query += f" ORDER BY s.shuffle_key{order}, s.image_id{order} LIMIT ?"
+    else:
+        query = "SELECT i.*, i.mtime AS k1, i.id AS k2 FROM images i"
+        values = []
+        if cursor:
+            mtime, image_id = decode_cursor(cursor, float, int)
+            query += " WHERE i.mtime <= ? AND (i.mtime, i.id) < (?, ?)"
+            values += [mtime, mtime, image_id]
+        query += " ORDER BY i.mtime DESC, i.id DESC LIMIT ?"
+    values.append(limit + 1)
+
+    rows = [dict(r) for r in conn.execute(query, values).fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["k1"], rows[-1]["k2"])
+    for r in rows:
+        r.pop("k1")
+        r.pop("k2")
+    return rows, next_cursor
+
+# ==========================
+# ✅ JOB METRICS (maintained by triggers)
+# ==========================
+# Per-status counters and duration sums are kept current by triggers on every
+# insert/update/delete, so reading them never touches the jobs table. Jobs
+# finishing in the last day are also appended to job_finishes (pruned as it
+# grows) for rolling windows and percentiles.
+FINISH_WINDOW = "-1 day"
+DURATION_SQL = "(julianday({r}.end_time) - julianday({r}.start_time)) * 86400.0"
+
+# Bump when the trigger definitions change; the counters are rebuilt once
+STATS_VERSION = 2
+
+def _timed_sql(r):
+    # Cache hits finish instantly and would drag the averages down
+    return f"({r}.start_time IS NOT NULL AND {r}.end_time IS NOT NULL AND {r}.cached_from IS NULL)"
+
+def _stats_delta(r, sign):
+    timed = _timed_sql(r)
+    return f"{sign}1", f"{sign}{timed}", f"{sign}(CASE WHEN {timed} THEN {DURATION_SQL.format(r=r)} ELSE 0 END)"
+
+def _init_job_stats(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_status_counts (
+        status TEXT PRIMARY KEY,
+        jobs INTEGER NOT NULL DEFAULT 0,
+        timed_jobs INTEGER NOT NULL DEFAULT 0,
+        duration_sum REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_finishes (
+        end_time TEXT NOT NULL,
+        status TEXT NOT NULL,
+        duration REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_finishes_end ON job_finishes(end_time)")
+
+    add = "INSERT INTO job_status_counts (status, jobs, timed_jobs, duration_sum) VALUES (NEW.status, {}, {}, {}) " \
+          "ON CONFLICT(status) DO UPDATE SET jobs = jobs + excluded.jobs, " \
+          "timed_jobs = timed_jobs + excluded.timed_jobs, duration_sum = duration_sum + excluded.duration_sum;"
+    sub = "UPDATE job_status_counts SET jobs = jobs + {}, timed_jobs = timed_jobs + {}, " \
+          "duration_sum = duration_sum + {} WHERE status = OLD.status;"
+    plus = add.format(*_stats_delta("NEW", "+"))
+    minus = sub.format(*_stats_delta("OLD", "-"))
+
+    # Recreated on every start so the definitions always match this code
+    for name in ("jobs_stats_insert", "jobs_stats_delete", "jobs_stats_update", "jobs_record_finish", "jobs_record_cached_finish"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute(f"CREATE TRIGGER jobs_stats_insert AFTER INSERT ON jobs BEGIN {plus} END")
+    conn.execute(f"CREATE TRIGGER jobs_stats_delete AFTER DELETE ON jobs BEGIN {minus} END")
+    conn.execute(f"""
+    CREATE TRIGGER jobs_stats_update AFTER UPDATE OF status, start_time, end_time, cached_from ON jobs
+    BEGIN {minus} {plus} END
+    """)
+    record = f"""
+        INSERT INTO job_finishes (end_time, status, duration)
+        VALUES (COALESCE(NEW.end_time, strftime('%Y-%m-%dT%H:%M:%f', 'now')), NEW.status,
+                CASE WHEN {_timed_sql("NEW")} THEN {DURATION_SQL.format(r="NEW")} END);
+        DELETE FROM job_finishes WHERE end_time < strftime('%Y-%m-%dT%H:%M:%S', 'now', '{FINISH_WINDOW}');
+    """
+    conn.execute(f"""
+    CREATE TRIGGER jobs_record_finish AFTER UPDATE OF status ON jobs
+    WHEN NEW.status IN ('done', 'failed') AND OLD.status NOT IN ('done', 'failed')
+    BEGIN {record} END
+    """)
+    # Jobs answered from the result cache are inserted already finished
+    conn.execute(f"""
+    CREATE TRIGGER jobs_record_cached_finish AFTER INSERT ON jobs
+    WHEN NEW.status IN ('done', 'failed')
+    BEGIN {record} END
+    """)
+
+    # First run on an existing database, or the formulas changed: seed once
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < STATS_VERSION or conn.execute("SELECT COUNT(*) FROM job_status_counts").fetchone()[0] == 0:
+        rebuild_job_stats()
+        conn.execute(f"PRAGMA user_version = {STATS_VERSION}")
+
+def rebuild_job_stats():
+    """Recompute the trigger-maintained counters from scratch (one full scan)."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM job_status_counts")
+        conn.execute(f'''
+            INSERT INTO job_status_counts (status, jobs, timed_jobs, duration_sum)
+            SELECT status, COUNT(*),
+                   SUM({_timed_sql("jobs")}),
+                   SUM(CASE WHEN {_timed_sql("jobs")} THEN {DURATION_SQL.format(r="jobs")} ELSE 0 END)
+            FROM jobs GROUP BY status
+        ''')
+        conn.execute("DELETE FROM job_finishes")
+        conn.execute(f'''
+            INSERT INTO job_finishes (end_time, status, duration)
+            SELECT end_time, status, CASE WHEN {_timed_sql("jobs")} THEN {DURATION_SQL.format(r="jobs")} END
+            FROM jobs
+            WHERE status IN ('done', 'failed')
+              AND end_time >= strftime('%Y-%m-%dT%H:%M:%S', 'now', '{FINISH_WINDOW}')
+        ''')
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def _window_stats(conn, modifier):
+    rows = conn.execute('''
+        SELECT status, duration FROM job_finishes
+        WHERE end_time >= strftime('%Y-%m-%dT%H:%M:%S', 'now', ?)
+    ''', (modifier,)).fetchall()
+    durations = sorted(r["duration"] for r in rows if r["status"] == "done" and r["duration"] is not None)
+    return {
+        "completed_jobs": sum(1 for r in rows if r["status"] == "done"),
+        "failed_jobs": sum(1 for r in rows if r["status"] == "failed"),
+        "average_duration_seconds": round(sum(durations) / len(durations), 2) if durations else 0,
+        "p50_duration_seconds": round(_percentile(durations, 50), 2),
+        "p95_duration_seconds": round(_percentile(durations, 95), 2),
+    }
+
+@timed
+def get_job_metrics():
+    conn = get_conn()
+    counts = {r["status"]: dict(r) for r in conn.execute("SELECT * FROM job_status_counts")}
+    done = counts.get("done", {})
+
+    last_job = conn.execute("SELECT MAX(start_time) as last_job FROM jobs").fetchone()["last_job"]
+    avg = done["duration_sum"] / done["timed_jobs"] if done.get("timed_jobs") else 0
+
+    return {
+        "total_jobs": sum(c["jobs"] for c in counts.values()),
+        "completed_jobs": done.get("jobs", 0),
+        "failed_jobs": counts.get("failed", {}).get("jobs", 0),
+        "cancelled_jobs": counts.get("cancelled", {}).get("jobs", 0),
+        "queued_jobs": counts.get("queued", {}).get("jobs", 0),
+        "in_progress_jobs": counts.get("in_progress", {}).get("jobs", 0),
+        "average_duration_seconds": round(avg, 2),
+        "most_recent_job_time": format_local_time(last_job) if last_job else "N/A",
+        "last_hour": _window_stats(conn, "-1 hour"),
+        "last_24h": _window_stats(conn, FINISH_WINDOW),
+        "result_cache": _result_cache_stats(conn),
+        "init_cache": _init_cache_stats(),
+        "batching": _batching_stats(),
+    }
+
+# ==========================
+# ✅ COUNTERS
+# ==========================
+def incr_counter(name, amount=1):
+    get_conn().execute('''
+        INSERT INTO counters (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+    ''', (name, amount))
+
+def get_counters(prefix=""):
+    rows = get_conn().execute("SELECT name, value FROM counters WHERE name LIKE ?", (prefix + "%",))
+    return {r["name"]: r["value"] for r in rows}
+
+# ==========================
+# ✅ JOB PROGRESS
+# ==========================
+# Workers upsert these rows a few times per generator call at most and never
+# touch the jobs row (and its triggers) until the job finishes.
+def set_job_progress(job_ids, step, steps, step_seconds):
+    now = datetime.utcnow().isoformat()
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO job_progress (job_id, step, steps, step_seconds, updated) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(job_id) DO UPDATE SET
+                step = excluded.step, steps = excluded.steps,
+                step_seconds = excluded.step_seconds, updated = excluded.updated
+        ''', [(job_id, step, steps, step_seconds, now) for job_id in job_ids])
+
+def clear_job_progress(job_ids):
+    job_ids = list(job_ids)
+    if job_ids:
+        get_conn().execute(f"DELETE FROM job_progress WHERE job_id IN ({','.join('?' * len(job_ids))})", job_ids)
+
+def get_job_progress(job_id=None):
+    """Progress row of one running job (None before its first step), or {job_id: row} for all."""
+    conn = get_conn()
+    if job_id is not None:
+        row = conn.execute("SELECT * FROM job_progress WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+    return {r["job_id"]: dict(r) for r in conn.execute("SELECT * FROM job_progress")}
+
+def get_running_jobs():
+    rows = get_conn().execute('''
+        SELECT job_id, prompt, steps, width, height, init_image, strength, start_time, worker
+        FROM jobs WHERE status = 'in_progress'
+    ''').fetchall()
+    return [dict(r) for r in rows]
+
+@timed
+def get_step_rates(days=7, limit=500, per_job=False):
+    """Median seconds per denoising step of recently finished jobs.
+
+    By default the wall time of a step of the generator call, which is what
+    a running job's progress reports. ``per_job`` shares each call's step
+    out over the jobs batched into it, the rate at which the queue drains.
+
+    Returns {(mode, width, height): seconds}.
+    """
+    rate = "step_seconds / COALESCE(batch_size, 1)" if per_job else "step_seconds"
+    rows = get_conn().execute(f'''
+        SELECT init_image IS NOT NULL AS img2img, width, height, {rate} AS step_seconds FROM jobs
+        WHERE end_time >= ? AND status = 'done' AND step_seconds IS NOT NULL
+        ORDER BY end_time DESC LIMIT ?
+    ''', (cutoff_iso(days), limit)).fetchall()
+    samples = {}
+    for r in rows:
+        key = ("img2img" if r["img2img"] else "txt2img", r["width"], r["height"])
+        samples.setdefault(key, []).append(r["step_seconds"])
+    return {key: _percentile(sorted(values), 50) for key, values in samples.items()}
+
+# ==========================
+# ✅ RESULT CACHE
+# ==========================
+def get_cached_result(param_hash):
+    """Look up a cached output and mark it as recently used."""
+    row = get_conn().execute(
+        "UPDATE result_cache SET last_used = ?, hits = hits + 1 WHERE param_hash = ? RETURNING *",
+        (datetime.utcnow().isoformat(), param_hash)
+    ).fetchone()
+    return dict(row) if row else None
+
+def put_cached_result(param_hash, path, size_bytes, source_job_id):
+    now = datetime.utcnow().isoformat()
+    get_conn().execute('''
+        INSERT INTO result_cache (param_hash, path, size_bytes, source_job_id, created, last_used)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(param_hash) DO UPDATE SET
+            path = excluded.path, size_bytes = excluded.size_bytes,
+            source_job_id = excluded.source_job_id, last_used = excluded.last_used
+    ''', (param_hash, path, size_bytes, source_job_id, now, now))
+
+def drop_cached_result(param_hash):
+    get_conn().execute("DELETE FROM result_cache WHERE param_hash = ?", (param_hash,))
+
+def evict_cached_results(max_bytes, max_entries):
+    """Drop least-recently-used entries until both bounds hold; return their paths."""
+    evicted = []
+    with transaction() as conn:
+        total = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size_bytes), 0) AS b FROM result_cache").fetchone()
+        entries, size = total["n"], total["b"]
+        if entries <= max_entries and size <= max_bytes:
+            return evicted
+        for row in conn.execute("SELECT param_hash, path, size_bytes FROM result_cache ORDER BY last_used").fetchall():
+            if entries <= max_entries and size <= max_bytes:
+                break
+            conn.execute("DELETE FROM result_cache WHERE param_hash = ?", (row["param_hash"],))
+            evicted.append(row["path"])
+            entries -= 1
+            size -= row["size_bytes"]
+    return evicted
+
+def _result_cache_stats(conn):
+    counters = get_counters("result_cache.")
+    hits, misses = counters.get("result_cache.hits", 0), counters.get("result_cache.misses", 0)
+    size = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size_bytes), 0) AS b FROM result_cache").fetchone()
+    return {
+        "hits": int(hits),
+        "misses": int(misses),
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0,
+        "entries": size["n"],
+        "bytes": size["b"],
+    }
+
+# ==========================
+# ✅ BULK MAINTENANCE
+# ==========================
+# Maintenance tasks (see maintenance.py) work through jobs in rowid order,
+# one short transaction per chunk, so workers can claim in between and a
+# task can pick up from its last rowid after a restart.
+def _rowids_sql(rowids):
+    return f"rowid IN ({','.join('?' * len(rowids))})"
+
+def max_job_rowid():
+    return get_conn().execute("SELECT COALESCE(MAX(rowid), 0) FROM jobs").fetchone()[0]
+
+def count_jobs_for_maintenance(statuses, cutoff=None, max_rowid=None, after=0):
+    """How many jobs ``get_jobs_chunk`` would still return in total."""
+    where, values = _maintenance_filter(statuses, cutoff, max_rowid, after)
+    return get_conn().execute(f"SELECT COUNT(*) FROM jobs WHERE {where}", values).fetchone()[0]
+
+def _maintenance_filter(statuses, cutoff, max_rowid, after):
+    where = [f"status IN ({','.join('?' * len(statuses))})", "rowid > ?"]
+    values = [*statuses, after]
+    if cutoff:
+        where.append("(end_time IS NULL OR end_time < ?)")
+        values.append(cutoff)
+    if max_rowid is not None:
+        where.append("rowid <= ?")
+        values.append(max_rowid)
+    return " AND ".join(where), values
+
+def get_jobs_chunk(statuses, after=0, limit=500, cutoff=None, max_rowid=None):
+    """Next ``limit`` jobs in ``statuses`` after rowid ``after``, oldest first."""
+    where, values = _maintenance_filter(statuses, cutoff, max_rowid, after)
+    rows = get_conn().execute(f'''
+        SELECT rowid AS row_id, job_id, filename, end_time FROM jobs
+        WHERE {where} ORDER BY rowid LIMIT ?
+    ''', [*values, limit]).fetchall()
+    return [dict(r) for r in rows]
+
+def delete_jobs_by_rowid(rowids):
+    if not rowids:
+        return 0
+    return get_conn().execute(f"DELETE FROM jobs WHERE {_rowids_sql(rowids)}", list(rowids)).rowcount
+
+def archive_jobs_by_rowid(rowids):
+    """Move jobs to the cold stores; return how many left the hot table.
+
+    Rows are written (and committed) to their monthly store first, then
+    deleted here, so a crash in between leaves a copy in both places, never
+    in neither; lookups prefer the hot row and the next run tidies up.
+    """
+    if not rowids:
+        return 0
+    rows = get_conn().execute(f"SELECT * FROM jobs WHERE {_rowids_sql(rowids)}", list(rowids)).fetchall()
+    write_cold_jobs([dict(r) for r in rows])
+    with transaction() as conn:
+        return conn.execute(f"DELETE FROM jobs WHERE {_rowids_sql(rowids)}", list(rowids)).rowcount
+
+def reclaim_free_pages():
+    # Only does anything once compact_database() switched on incremental auto_vacuum
+    get_conn().execute("PRAGMA incremental_vacuum").fetchall()
+
+def compact_database():
+    """VACUUM the hot database, keeping free pages reclaimable from then on.
+
+    Holds the write lock for the whole rebuild. VACUUM can renumber job
+    rowids, so the prompt index is rebuilt afterwards.
+    """
+    conn = get_conn()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    rebuild_prompt_index()
+
+MAINTENANCE_ACTIVE = ("pending", "running")
+
+def _maintenance_row(row):
+    task = dict(row)
+    task["params"] = json.loads(task["params"] or "{}")
+    task["state"] = json.loads(task["state"] or "{}")
+    return task
+
+def create_maintenance_task(kind, params, total):
+    """Queue a task; an unfinished task of the same kind is returned instead."""
+    with transaction() as conn:
+        row = conn.execute(f'''
+            SELECT * FROM maintenance_tasks WHERE kind = ? AND status IN ({",".join("?" * len(MAINTENANCE_ACTIVE))})
+        ''', (kind, *MAINTENANCE_ACTIVE)).fetchone()
+        if row:
+            return _maintenance_row(row)
+        row = conn.execute('''
+            INSERT INTO maintenance_tasks (kind, params, status, total, created, updated)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+            RETURNING *
+        ''', (kind, json.dumps(params), total, datetime.utcnow().isoformat(), datetime.utcnow().isoformat())).fetchone()
+    return _maintenance_row(row)
+
+def claim_maintenance_task(runner):
+    """Take the oldest pending task (resumed tasks keep their state)."""
+    now = datetime.utcnow().isoformat()
+    row = get_conn().execute('''
+        UPDATE maintenance_tasks
+        SET status = 'running', runner = ?, started = COALESCE(started, ?), updated = ?
+        WHERE id = (SELECT id FROM maintenance_tasks WHERE status = 'pending' ORDER BY id LIMIT 1)
+          AND status = 'pending'
+        RETURNING *
+    ''', (runner, now, now)).fetchone()
+    return _maintenance_row(row) if row else None
+
+def update_maintenance_task(task_id, status=None, state=None, processed=None, message=None):
+    fields, values = ["updated = ?"], [datetime.utcnow().isoformat()]
+    if status:
+        fields.append("status = ?")
+        values.append(status)
+        if status not in MAINTENANCE_ACTIVE:
+            fields.append("finished = ?")
+            values.append(values[0])
+    if state is not None:
+        fields.append("state = ?")
+        values.append(json.dumps(state))
+    if processed is not None:
+        fields.append("processed = ?")
+        values.append(processed)
+    if message is not None:
+        fields.append("message = ?")
+        values.append(message)
+    values.append(task_id)
+    get_conn().execute(f"UPDATE maintenance_tasks SET {', '.join(fields)} WHERE id = ?", values)
+
+def release_orphaned_maintenance_tasks(is_alive):
+    """Put running tasks whose runner is gone back to pending; return how many.
+
+    ``is_alive(runner)`` decides for each distinct runner id.
+    """
+    conn = get_conn()
+    runners = [r["runner"] for r in conn.execute(
+        "SELECT DISTINCT runner FROM maintenance_tasks WHERE status = 'running'"
+    )]
+    dead = [r for r in runners if not is_alive(r)]
+    if not dead:
+        return 0
+    return conn.execute(f'''
+        UPDATE maintenance_tasks SET status = 'pending', runner = NULL
+        WHERE status = 'running' AND runner IN ({",".join("?" * len(dead))})
+    ''', dead).rowcount
+
+def get_maintenance_tasks(limit=10):
+    rows = get_conn().execute("SELECT * FROM maintenance_tasks ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [_maintenance_row(r) for r in rows]
+
+# ==========================
+# ✅ COLD STORAGE
+# ==========================
+# Archived jobs live outside the hot database, one SQLite file per month of
+# end_time (jobs-YYYY-MM.db). Each row is kept as zlib-compressed JSON next to
+# the few columns lookups need, and prompts go into a contentless FTS5 index,
+# so the text is stored only once, compressed. Stores are append-only.
+COLD_STORE_DIR = os.path.expanduser(os.getenv("FLUX_COLD_STORE_DIR", "~/flux_api/archive"))
+COLD_STORE_NAME = re.compile(r"^jobs-(\d{4}-\d{2}|undated)\.db$")
+COLD_COMPRESSION = 9
+
+def _cold_month(job):
+    stamp = job.get("end_time") or job.get("start_time") or job.get("queued_at") or ""
+    return stamp[:7] if re.match(r"^\d{4}-\d{2}", stamp) else "undated"
+
+def _cold_path(month):
+    return os.path.join(COLD_STORE_DIR, f"jobs-{month}.db")
+
+def list_cold_stores():
+    """Months with a cold store, newest first ("undated" last)."""
+    try:
+        names = os.listdir(COLD_STORE_DIR)
+    except FileNotFoundError:
+        return []
+    months = [m.group(1) for m in map(COLD_STORE_NAME.match, names) if m]
+    return sorted((m for m in months if m != "undated"), reverse=True) + [m for m in months if m == "undated"]
+
+def _open_cold(month, write=False):
+    if write:
+        os.makedirs(COLD_STORE_DIR, exist_ok=True)
+        conn = sqlite3.connect(_cold_path(month), isolation_level=None, timeout=BUSY_TIMEOUT_MS / 1000)
+    else:
+        conn = sqlite3.connect(f"file:{_cold_path(month)}?mode=ro", uri=True, isolation_level=None,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    if write:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,    -- explicit, so VACUUM keeps the FTS rowids valid
+            job_id TEXT NOT NULL UNIQUE,
+            status TEXT,
+            end_time TEXT,
+            filename TEXT,
+            data BLOB NOT NULL         -- zlib-compressed JSON of the full jobs row
+        )
+        ''')
+        conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+            prompt,
+            content = '',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''')
+    return conn
+
+def _pack_job(job):
+    return zlib.compress(json.dumps(job, separators=(",", ":")).encode(), COLD_COMPRESSION)
+
+def _unpack_job(row, month):
+    job = json.loads(zlib.decompress(row["data"]))
+    job["archived"] = month
+    return job
+
+def write_cold_jobs(jobs):
+    """Append jobs to their monthly stores; jobs already archived are skipped."""
+    by_month = {}
+    for job in jobs:
+        job.pop("row_id", None)
+        by_month.setdefault(_cold_month(job), []).append(job)
+    for month, month_jobs in by_month.items():
+        conn = _open_cold(month, write=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in month_jobs:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, status, end_time, filename, data) VALUES (?, ?, ?, ?, ?)",
+                    (job["job_id"], job.get("status"), job.get("end_time"), job.get("filename"), _pack_job(job))
+                )
+                if cur.rowcount:
+                    conn.execute("INSERT INTO jobs_fts (rowid, prompt) VALUES (?, ?)", (cur.lastrowid, job.get("prompt") or ""))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+def get_archived_job(job_id):
+    """The archived copy of a job (with ``archived`` set to its month), or None."""
+    for month in list_cold_stores():
+        conn = _open_cold(month)
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row:
+            return _unpack_job(row, month)
+    return None
+
+def search_archived_jobs(query, limit=50, cursor=None, status=None):
+    """Return ``(jobs, next_cursor)`` of archived jobs whose prompts match, newest first.
+
+    Walks the monthly stores from the newest; the cursor is (month, id).
+    """
+    match = fts_query(query)
+    if not match:
+        return [], None
+    months = list_cold_stores()
+    after_month, before_id = None, None
+    if cursor:
+        after_month, before_id = decode_cursor(cursor, str, int)
+        if after_month not in months:
+            raise ValueError("Invalid cursor")
+        months = months[months.index(after_month):]
+
+    jobs = []
+    for month in months:
+        sql = '''
+            SELECT j.id, j.data FROM jobs_fts JOIN jobs j ON j.id = jobs_fts.rowid
+            WHERE jobs_fts MATCH ?
+        '''
+        values = [match]
+        if status and status != "all":
+            sql += " AND j.status = ?"
+            values.append(status)
+        if month == after_month:
+            sql += " AND j.id < ?"
+            values.append(before_id)
+        sql += " ORDER BY j.id DESC LIMIT ?"
+        values.append(limit + 1 - len(jobs))
+        conn = _open_cold(month)
+        try:
+            rows = conn.execute(sql, values).fetchall()
+        finally:
+            conn.close()
+        jobs += [(month, r["id"], r) for r in rows]
+        if len(jobs) > limit:
+            break
+
+    next_cursor = None
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        next_cursor = encode_cursor(jobs[-1][0], jobs[-1][1])
+    return [_unpack_job(r, month) for month, _, r in jobs], next_cursor
+
+def count_archived_jobs():
+    """{month: jobs} for every cold store."""
+    counts = {}
+    for month in list_cold_stores():
+        conn = _open_cold(month)
+        try:
+            counts[month] = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        finally:
+            conn.close()
+    return counts
+
+# Before cold storage, archive_done copied rows into an archived_jobs table
+# in this database. These drain it into the cold stores.
+def count_legacy_archived_jobs():
+    conn = get_conn()
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_jobs'").fetchone():
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM archived_jobs").fetchone()[0]
+
+def get_legacy_archived_chunk(after=0, limit=500):
+    rows = get_conn().execute(
+        "SELECT rowid AS row_id, * FROM archived_jobs WHERE rowid > ? ORDER BY rowid LIMIT ?", (after, limit)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+def move_legacy_archived_jobs(jobs):
+    rowids = [job["row_id"] for job in jobs]
+    write_cold_jobs([dict(job) for job in jobs])
+    with transaction() as conn:
+        return conn.execute(f"DELETE FROM archived_jobs WHERE {_rowids_sql(rowids)}", rowids).rowcount
+
+def drop_legacy_archive():
+    with transaction() as conn:
+        if conn.execute("SELECT 1 FROM archived_jobs LIMIT 1").fetchone() is None:
+            conn.execute("DROP TABLE archived_jobs")
+
+# ==========================
+# ✅ SETTINGS
+# ==========================
+def get_setting(name, default=None):
+    row = get_conn().execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+    return json.loads(row["value"]) if row else default
+
+def set_setting(name, value):
+    get_conn().execute('''
+        INSERT INTO settings (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    ''', (name, json.dumps(value)))
+
+# ==========================
+# ✅ BATCHING
+# ==========================
+# Compatible txt2img jobs run as one generator call of up to this many;
+# /admin can override it at runtime (settings "batch.max_size").
+DEFAULT_BATCH_SIZE = int(os.getenv("FLUX_BATCH_MAX", "4"))
+
+def get_batch_max_size():
+    return max(1, int(get_setting("batch.max_size", DEFAULT_BATCH_SIZE)))
+
+def _init_cache_stats():
+    counters = get_counters("init_cache.")
+    hits, misses = counters.get("init_cache.hits", 0), counters.get("init_cache.misses", 0)
+    return {
+        "hits": int(hits),
+        "misses": int(misses),
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0,
+    }
+
+def _batching_stats():
+    counters = get_counters("batch.")
+    runs, jobs = counters.get("batch.runs", 0), counters.get("batch.jobs", 0)
+    return {
+        "max_batch_size": get_batch_max_size(),
+        "runs": int(runs),
+        "jobs": int(jobs),
+        "average_batch_size": round(jobs / runs, 2) if runs else 0,
+    }
@@ -0,0 +1,147 @@
+"""Job state change events.
+
+Workers and the API publish the id of every job whose state changed on the
+``events`` notify channel. The API process runs one ``EventHub`` that turns
+those ids into rendered rows and metric deltas once, and fans them out to
+every Server-Sent Events subscriber.
+"""
+import json
+import time
+import asyncio
+import threading
+
+from notify import Listener, publish
+
+EVENTS_CHANNEL = "events"
+
+HEARTBEAT_SECONDS = 15
+COALESCE_SECONDS = 0.05
+SUBSCRIBER_BUFFER = 200
+
+
+# ==========================
+# ✅ PUBLISHING (any process)
+# ==========================
+def publish_job_change(job_id):
+    publish(EVENTS_CHANNEL, json.dumps({"job_id": job_id}))
+
+
+def publish_refresh():
+    """Tell dashboards to re-fetch everything (bulk deletes, queue clears)."""
+    publish(EVENTS_CHANNEL, json.dumps({"refresh": True}))
+
+
+# ==========================
+# ✅ HUB (API process)
+# ==========================
+class EventHub:
+    def __init__(self, load_job, render_job, metrics_fields):
+        # load_job(job_id) -> dict | None
+        # render_job(job) -> dict sent as the "job" event payload
+        # metrics_fields() -> {field_id: value}, diffed into "metrics" events
+        self.load_job = load_job
+        self.render_job = render_job
+        self.metrics_fields = metrics_fields
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_metrics = {}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        try:
+            self._last_metrics = self.metrics_fields()
+        except Exception:
+            self._last_metrics = {}
+        self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        with Listener(EVENTS_CHANNEL) as listener:
+            while not self._stop.is_set():
+                messages = listener.wait(1.0)
+                if not messages:
+                    continue
+                # Let a burst (e.g. a batch finishing) settle into one broadcast
+                time.sleep(COALESCE_SECONDS)
+                messages += listener.drain()
+                try:
+                    self._broadcast(self._build_events(messages))
+                except Exception as e:
+                    print(f"⚠️ Event hub error: {e}")
+
+    def _build_events(self, messages):
+        job_ids, refresh = [], False
+        for raw in messages:
+            try:
+                msg = json.loads(raw)
+            except ValueError:
+                continue
+            if msg.get("refresh"):
+                refresh = True
+            elif msg.get("job_id"):
+                job_ids.append(msg["job_id"])
+
+        events = []
+        if refresh:
+            events.append(("refresh", {}))
+        for job_id in dict.fromkeys(job_ids):
+            job = self.load_job(job_id)
+            if job:
+                events.append(("job", self.render_job(job)))
+            else:
+                events.append(("job_removed", {"job_id": job_id}))
+
+        current = self.metrics_fields()
+        delta = {k: v for k, v in current.items() if self._last_metrics.get(k) != v}
+        self._last_metrics = current
+        if delta:
+            events.append(("metrics", delta))
+        return events
+
+    def _broadcast(self, events):
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, events)
+
+    @staticmethod
+    def _offer(queue, events):
+        for event in events:
+            if queue.full():
+                # Slow client: drop what it missed and make it re-fetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("refresh", {}))
+                return
+            queue.put_nowait(event)
+
+    async def stream(self, request):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
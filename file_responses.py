@@ -0,0 +1,146 @@
+"""File responses with validators, conditional requests and byte ranges.
+
+``file_response`` answers ``If-None-Match`` / ``If-Modified-Since`` with a
+304, honours a single ``Range`` (with ``If-Range``) with a 206 so downloads
+can resume, and otherwise streams the whole file. Validators come from the
+file's mtime and size, so they change whenever the file does.
+"""
+import os
+import hashlib
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+
+# For names whose content never changes (job-id outputs, content-addressed files)
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Always revalidate, but a matching validator costs only a 304
+REVALIDATE = "no-cache"
+
+
+def make_etag(stat, variant=""):
+    raw = f"{stat.st_mtime_ns}-{stat.st_size}-{variant}".encode()
+    return f'"{hashlib.md5(raw).hexdigest()}"'
+
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    return etag.removeprefix("W/") in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(request, etag, mtime):
+    # A resume against a changed file must get the whole new file
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range.strip() == etag
+    try:
+        return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive for a single-range header.
+
+    Returns None when the header should be ignored (missing, malformed or
+    multi-range; the full file is sent instead) and raises ValueError when
+    the range can't be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not first and not last:
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start is None:
+        # Suffix: the last N bytes
+        if not end:
+            raise ValueError("Empty suffix range")
+        return max(0, size - end), size - 1
+    end = size - 1 if end is None else min(end, size - 1)
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def content_disposition(filename):
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*=utf-8''{quoted}"
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, media_type=None, filename=None, cache_control=REVALIDATE, vary=None, variant=""):
+    """Serve ``path`` for ``request`` honouring validators and ranges.
+
+    ``variant`` distinguishes representations negotiated from the same URL
+    (it is folded into the ETag); pass ``vary`` to name the request header
+    they were chosen by.
+    """
+    stat = os.stat(path)
+    etag = make_etag(stat, variant)
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if vary:
+        headers["Vary"] = vary
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), stat.st_size)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{stat.st_size}"
+        return Response(status_code=416, headers=headers)
+
+    if byte_range and _range_applies(request, etag, stat.st_mtime):
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(_read_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
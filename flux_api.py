@@ -2,26 +2,38 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import sqlite3
 import multiprocessing
+import re
 import random
+import threading
 from fastapi import FastAPI, HTTPException, Query, Request, Form, status, Header, Depends, APIRouter, Body, File, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from starlette.responses import Response
 from starlette.middleware.sessions import SessionMiddleware
 from auth import verify_password, require_login, is_authenticated
-from db import add_job, get_job, get_job_by_filename, get_job_metrics, get_recent_jobs, delete_old_jobs, get_completed_jobs_for_archive, delete_job, get_all_jobs, get_oldest_queued_job, count_jobs_by_status
-from job_queue import add_job_to_db_and_queue, clear_queue
-from typing import Optional
+from db import get_gallery_page, get_job, get_job_by_filename, get_job_metrics, get_recent_jobs, get_recent_jobs_page, delete_job, get_all_jobs, get_job_for_retry, cancel_job, count_jobs_by_status, get_queue_plan, LANES, get_setting, set_setting, get_batch_max_size, count_pending_thumbnails, search_jobs, get_maintenance_tasks, get_archived_job, search_archived_jobs, get_status_counts
+from job_queue import add_job_to_db_and_queue, add_jobs_to_db_and_queue, clear_queue, cancel_running_job
+import catalog
+import thumbnails
+import maintenance
+import progress
+import uploads
+from metrics import RequestMetrics, render as render_metrics, record_memory, mark_process_dead, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from file_responses import file_response, IMMUTABLE, REVALIDATE
+from start_workers import request_resize
+from events import EventHub, publish_job_change
+from typing import Optional, List
 from datetime import datetime
 import uuid
 import pytz
 from dateutil import parser
 import logging
 import shutil
+import functools
+import anyio
 import psutil
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +41,9 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(root_path="/flux")
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SECRET_KEY"))
+app.add_middleware(uploads.LimitUploadSize, paths=["/generate"])
+# Added last so it is outermost and times rejected uploads too
+app.add_middleware(RequestMetrics)
 OUTPUT_DIR = os.path.expanduser("~/FluxImages")
 UPLOAD_DIR = os.path.join(OUTPUT_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -36,9 +51,24 @@ templates = Jinja2Templates(directory="templates")
 templates.env.globals["root_path"] = "/flux"
 templates.env.globals['now'] = datetime.now
 API_TOKEN = os.getenv("N8N_API_TOKEN")
+# Additional named tokens ("name:token,..."); each name is its own fair-share client
+API_TOKENS = {
+    token: name
+    for name, token in (pair.split(":", 1) for pair in os.getenv("FLUX_API_TOKENS", "").split(",") if ":" in pair)
+}
 eastern = pytz.timezone("US/Eastern")
 LINKABLE_DIR = "/mnt/ai_data/linkable"
 
+# Dashboard-sized work (job lists, queue plans, directory scans) runs on its
+# own small thread limiter: it never blocks the event loop and can never take
+# every threadpool slot from light routes like /status. It is mostly
+# template rendering, i.e. GIL-bound, so more threads add contention for
+# the light routes rather than throughput.
+HEAVY_LIMITER = anyio.CapacityLimiter(int(os.getenv("FLUX_HEAVY_REQUEST_THREADS", "1")))
+
+async def run_heavy(fn, *args, **kwargs):
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=HEAVY_LIMITER)
+
 # Add custom Jinja filter for basename
 templates.env.filters["basename"] = lambda path: os.path.basename(path) if path else ""
 
@@ -53,6 +83,15 @@ class PromptRequest(BaseModel):
     output_dir: Optional[str] = None
     init_image: Optional[str] = None   # img2img
     strength: float = 0.75    #img2img         
+    seed: Optional[int] = None  # fixed seed: deterministic, served from the result cache on repeats
+    lane: Optional[str] = None  # "interactive" or "bulk"; defaults depend on the endpoint
+    priority: int = 0           # -10..10, higher runs first within a lane
+
+class BatchPromptRequest(BaseModel):
+    jobs: List[PromptRequest]
+    idempotency_key: Optional[str] = None  # or send an Idempotency-Key header
+
+MAX_BATCH_SIZE = 500
 
 def format_local_time(iso_str):
     try:
@@ -65,36 +104,116 @@ def format_local_time(iso_str):
 # ✅ Register it as a Jinja2 filter
 templates.env.filters["localtime"] = format_local_time
 
-def parse_time(ts):
-    if not ts:
-        return datetime.utcnow()  # instead of datetime.min
-    try:
-        return datetime.fromisoformat(ts)
-    except:
-        return datetime.utcnow()  # fallback to now if invalid
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m {secs}s"
+
+templates.env.filters["duration"] = format_duration
+
+def metrics_fields():
+    # Keys are the element ids in partials/_metrics.html
+    m = get_job_metrics()
+    return {
+        "total_jobs": m["total_jobs"],
+        "completed_jobs": m["completed_jobs"],
+        "failed_jobs": m["failed_jobs"],
+        "cancelled_jobs": m["cancelled_jobs"],
+        "queued_jobs": m["queued_jobs"],
+        "in_progress_jobs": m["in_progress_jobs"],
+        "average_duration": m["average_duration_seconds"],
+        "last_hour_completed": m["last_hour"]["completed_jobs"],
+        "last_hour_failed": m["last_hour"]["failed_jobs"],
+        "last_24h_completed": m["last_24h"]["completed_jobs"],
+        "last_24h_failed": m["last_24h"]["failed_jobs"],
+        "p50_duration": m["last_24h"]["p50_duration_seconds"],
+        "p95_duration": m["last_24h"]["p95_duration_seconds"],
+        "cache_hits": m["result_cache"]["hits"],
+        "cache_misses": m["result_cache"]["misses"],
+        "cache_entries": m["result_cache"]["entries"],
+        "init_cache_hits": m["init_cache"]["hits"],
+        "init_cache_misses": m["init_cache"]["misses"],
+        "avg_batch_size": m["batching"]["average_batch_size"],
+        "max_batch_size": m["batching"]["max_batch_size"],
+        "recent_job": m["most_recent_job_time"],
+    }
+
+def render_job_event(job):
+    # Rendered once per change, shared by every connected dashboard
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "rows": {
+            "recent": templates.get_template("partials/_recent_job_row.html").render(job=job),
+            "table": templates.get_template("partials/_job_table_row.html").render(job=job),
+        }
+    }
+
+event_hub = EventHub(load_job=get_job, render_job=render_job_event, metrics_fields=metrics_fields)
+
+@app.on_event("startup")
+def start_event_hub():
+    event_hub.start()
+
+@app.on_event("shutdown")
+def stop_event_hub():
+    event_hub.stop()
+
+maintenance_runner = maintenance.MaintenanceRunner()
+
+@app.on_event("startup")
+def start_maintenance_runner():
+    # Also resumes tasks interrupted by the last shutdown
+    maintenance_runner.start()
+
+@app.on_event("shutdown")
+def stop_maintenance_runner():
+    maintenance_runner.stop()
+
+@app.on_event("shutdown")
+def drop_process_metrics():
+    mark_process_dead(os.getpid())
+
+@app.on_event("startup")
+def reconcile_image_catalog():
+    # Files may have been added or removed while the API was down; scan in
+    # the background so startup isn't held up by a large image directory.
+    def run():
+        try:
+            logger.info(f"Image catalog reconciled: {catalog.reconcile(OUTPUT_DIR)}")
+            thumbnails.request_thumbnails()
+        except Exception as e:
+            logger.warning(f"Image catalog reconcile failed: {e}")
+    threading.Thread(target=run, name="catalog-reconcile", daemon=True).start()
+
+def session_client(request: Request):
+    # One fair-share client per browser session
+    if "client_id" not in request.session:
+        request.session["client_id"] = uuid.uuid4().hex[:8]
+    return f"session:{request.session['client_id']}"
 
 def require_token(authorization: str = Header(None), request: Request = None):
+    """Authorize the request and return the submitting client's id."""
     expected_token = os.getenv("N8N_API_TOKEN")
 
     token = None
     if authorization and authorization.startswith("Bearer "):
         token = authorization[len("Bearer "):].strip()
 
+    if token and token in API_TOKENS:
+        return f"token:{API_TOKENS[token]}"
     if token != expected_token and not is_authenticated(request):
         raise HTTPException(status_code=403, detail="Unauthorized")
+    return "token:n8n" if token else session_client(request)
 
-def sort_job_priority(job):
-    priority = {
-        "processing": 1,
-        "in_progress": 1,
-        "queued": 2,
-        "failed": 3,
-        "done": 4
-    }
-    return (
-        -priority.get(job["status"], 0),  # High priority first
-        parse_time(job.get("end_time") or job.get("start_time")),  # Most recent first
-    )
+def resolve_lane(lane, default):
+    if lane is None:
+        return default
+    if lane not in LANES:
+        raise HTTPException(status_code=400, detail=f"Unknown lane '{lane}' (expected one of {', '.join(LANES)})")
+    return lane
 
 #####################################################################################
 #                                   GET                                             #
@@ -113,8 +232,11 @@ def dashboard(request: Request):
     })
 
 @app.get("/admin", response_class=HTMLResponse)
-def admin_panel(request: Request):
+async def admin_panel(request: Request):
     require_login(request)
+    return await run_heavy(render_admin_panel, request)
+
+def render_admin_panel(request):
     system = admin_system_info(request)
     metrics = get_job_metrics()
     try:
@@ -133,9 +255,87 @@ def admin_panel(request: Request):
         "request": request,
         "system": system,
         "metrics": metrics,
+        "queue": queue_overview(),
+        "pool": worker_pool_info(),
+        "maintenance_tasks": maintenance_overview(),
         "linkable_files": linkable_files
     })
 
+def queue_overview(per_lane=10):
+    """Per-lane queue positions and estimated waits, following the claim order."""
+    plan = get_queue_plan()
+    metrics = get_job_metrics()
+    avg = metrics["last_24h"]["average_duration_seconds"] or metrics["average_duration_seconds"]
+    # Queued work means every worker is busy, so running jobs ~ worker count
+    workers = max(1, metrics["in_progress_jobs"])
+
+    def eta(jobs_ahead):
+        return round((jobs_ahead // workers + 0.5) * avg) if avg else None
+
+    lanes = {lane: {"queued": 0, "jobs": []} for lane in LANES}
+    for job in plan:
+        lane = lanes.setdefault(job["lane"], {"queued": 0, "jobs": []})
+        lane["queued"] += 1
+        if len(lane["jobs"]) < per_lane:
+            job["eta_seconds"] = eta(job["position"])
+            lane["jobs"].append(job)
+
+    # A new job waits for its own lane and every lane ahead of it
+    ahead = 0
+    for name in LANES:
+        ahead += lanes[name]["queued"]
+        lanes[name]["new_job_wait_seconds"] = eta(ahead)
+    return {"workers": workers, "average_duration_seconds": avg, "lanes": lanes}
+
+@app.get("/admin/queue")
+async def admin_queue(request: Request):
+    require_login(request)
+    return await run_heavy(queue_overview)
+
+@app.get("/partials/queue", response_class=HTMLResponse)
+async def partial_queue(request: Request):
+    require_login(request)
+    return await run_heavy(
+        lambda: templates.TemplateResponse("partials/_queue_lanes.html", {"request": request, "queue": queue_overview()})
+    )
+
+def worker_pool_info():
+    return {
+        "mode": get_setting("workers.mode", "auto"),
+        "count": get_setting("workers.count"),
+        "status": get_setting("workers.status", {}),
+        "batch_max_size": get_batch_max_size(),
+        "thumbnails_pending": count_pending_thumbnails(),
+    }
+
+@app.get("/admin/workers")
+def admin_workers(request: Request):
+    require_login(request)
+    return worker_pool_info()
+
+@app.post("/admin/workers")
+def admin_set_workers(request: Request, mode: str = Form("auto"), count: Optional[int] = Form(None)):
+    require_login(request)
+    if mode not in ("auto", "fixed"):
+        raise HTTPException(status_code=400, detail="Mode must be 'auto' or 'fixed'")
+    if mode == "fixed":
+        if count is None or count < 0:
+            raise HTTPException(status_code=400, detail="Fixed mode needs a worker count of 0 or more")
+        set_setting("workers.count", count)
+    set_setting("workers.mode", mode)
+    # Running jobs are never interrupted: surplus workers stop after their current job
+    request_resize()
+    return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
+
+@app.post("/admin/batching")
+def admin_set_batching(request: Request, max_size: int = Form(...)):
+    require_login(request)
+    if not 1 <= max_size <= 16:
+        raise HTTPException(status_code=400, detail="Batch size must be between 1 and 16")
+    # Workers read it on every claim
+    set_setting("batch.max_size", max_size)
+    return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
+
 @app.get("/admin/metrics")
 def metrics(request: Request):
     require_login(request)
@@ -174,84 +374,63 @@ def admin_system_info(request: Request):
         "memory_percent": memory_percent
     }
 
-import random
-from fastapi import Query
+@app.get("/events")
+async def job_events(request: Request):
+    return StreamingResponse(
+        event_hub.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/gallery", response_class=HTMLResponse)
-def gallery(request: Request, page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100)):
-    image_dir = os.path.expanduser("~/FluxImages")
-    files = [f for f in os.listdir(image_dir) if f.lower().endswith(".png")]
-    random.shuffle(files)
-
-    # Calculate pagination bounds
-    total = len(files)
-    start = (page - 1) * limit
-    end = start + limit
-    page_files = files[start:end]
-
-    images = []
-    for fname in page_files:
-        job = get_job_by_filename(fname)
-        if job:
-            images.append({"filename": fname, "job_id": job["job_id"]})
-
-    return templates.TemplateResponse("gallery.html", {
-        "request": request,
-        "images": images,
-        "page": page,
-        "limit": limit,
-        "total": total,
-        "has_prev": page > 1,
-        "has_next": end < total,
-        "root_path": request.scope.get("root_path", "")
-    })
+def gallery(request: Request):
+    # Just the shell: the page loads its images through /gallery/json
+    return templates.TemplateResponse("gallery.html", {"request": request})
 
 @app.get("/gallery/json")
 def gallery_json(
     request: Request,
-    page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
-    sort: str = Query("random", regex="^(random|newest)$")  # random or newest
+    sort: str = Query("random", regex="^(random|newest)$"),  # random or newest
+    cursor: Optional[str] = Query(None)
 ):
-    image_dir = os.path.expanduser("~/FluxImages")
-    files = [f for f in os.listdir(image_dir) if f.lower().endswith(".png")]
-
-    if sort == "random":
-        # ✅ Assign seed if not present
-        if "gallery_seed" not in request.session:
-            request.session["gallery_seed"] = random.randint(1, 1_000_000)
+    # ✅ Assign seed if not present
+    if "gallery_seed" not in request.session:
+        request.session["gallery_seed"] = random.randint(1, 1_000_000)
 
-        seeded_random = random.Random(request.session["gallery_seed"])
-        seeded_random.shuffle(files)
-    else:
-        # ✅ Newest first (sorted by modified time)
-        files.sort(key=lambda f: os.path.getmtime(os.path.join(image_dir, f)), reverse=True)
-
-    # Pagination
-    total = len(files)
-    start = (page - 1) * limit
-    end = start + limit
-    page_files = files[start:end]
-
-    images = []
-    for fname in page_files:
-        job = get_job_by_filename(fname)
-        if job:
-            images.append({
-                "filename": fname,
-                "job_id": job["job_id"],
-                "thumbnail_url": f"/flux/thumbnails/{fname}",
-                "detail_url": f"/flux/gallery/{job['job_id']}"
-            })
+    # Catalog pages: a cursor makes page 500 as cheap as page 1
+    try:
+        rows, next_cursor = get_gallery_page(
+            sort=sort, limit=limit, cursor=cursor,
+            seed=request.session["gallery_seed"]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    images = [{
+        "filename": r["filename"],
+        "job_id": r["job_id"],
+        "width": r["width"],
+        "height": r["height"],
+        "thumbnail_url": f"/flux/thumbnails/{r['filename']}",
+        # {format: srcset}, best format first, for <picture> sources
+        "thumbnail_srcsets": thumbnails.srcsets(r["filename"], "/flux/thumbnails"),
+        "detail_url": f"/flux/gallery/{r['job_id']}"
+    } for r in rows]
 
     return {
         "images": images,
-        "has_next": end < total
+        "has_next": next_cursor is not None,
+        "next_cursor": next_cursor
     }
 
+def find_job(job_id):
+    # Archived jobs live in the cold stores; only look there on a miss
+    return get_job(job_id) or get_archived_job(job_id)
+
 @app.get("/gallery/{job_id}", response_class=HTMLResponse)
 def view_gallery(request: Request, job_id: str):
-    job = get_job(job_id)
+    job = find_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return templates.TemplateResponse("gallery_detail.html", {
@@ -259,21 +438,61 @@ def view_gallery(request: Request, job_id: str):
         "job": job
     })
 
+# Outputs named by job id and content-addressed init images never change;
+# other names in the image dir (custom filenames) can be overwritten in place
+STABLE_IMAGE_NAME = re.compile(r"^(?:[0-9a-f]{8}\.png|init_[0-9a-f]{16}\.(?:png|jpg|webp))$")
+
+def image_cache_control(filename):
+    return IMMUTABLE if STABLE_IMAGE_NAME.match(filename) else REVALIDATE
+
 @app.get("/images/{filename}")
-def get_image(filename: str):
+def get_image(request: Request, filename: str):
     image_path = os.path.join(OUTPUT_DIR, filename)
 
-    if not os.path.exists(image_path):
+    if filename != os.path.basename(filename) or not os.path.isfile(image_path):
         raise HTTPException(status_code=404, detail="Image not found in FluxImages")
 
-    return FileResponse(image_path, media_type="image/png")
+    cache_control = image_cache_control(filename)
+    # PNGs go out as a cached WebP/AVIF copy to clients that ask for one;
+    # API clients sending */* keep getting the original PNG
+    if filename.lower().endswith(".png"):
+        fmt = thumbnails.negotiate(request.headers.get("accept"), fallback="png")
+        rendition = thumbnails.fresh_rendition(filename, fmt, image_dir=OUTPUT_DIR) if fmt != "png" else None
+        if rendition:
+            return file_response(request, rendition, media_type=thumbnails.MEDIA_TYPES[fmt],
+                                 cache_control=cache_control, vary="Accept", variant=fmt)
+        return file_response(request, image_path, media_type="image/png", cache_control=cache_control, vary="Accept")
+    return file_response(request, image_path, cache_control=cache_control)
 
 @app.get("/jobs/json")
-def jobs_json(status: str = Query(None), limit: int = Query(50)):
-    jobs = get_recent_jobs(limit=limit, status=status)
-    jobs = sorted(jobs, key=sort_job_priority, reverse=True)
-    return jobs
+def jobs_json(status: str = Query(None), limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = Query(None)):
+    try:
+        jobs, next_cursor = get_recent_jobs_page(limit=limit, status=status, cursor=cursor, order="queue")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Body stays a plain list for existing clients; the next page is in a header
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(jobs, headers=headers)
     
+@app.get("/jobs/search")
+def jobs_search(
+    q: str = Query(..., min_length=1),
+    status: str = Query(None),
+    sort: str = Query("rank", regex="^(rank|newest)$"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    archived: bool = Query(False)
+):
+    try:
+        if archived:
+            # Cold stores are searched newest first; there is no cross-month ranking
+            jobs, next_cursor = search_archived_jobs(q, limit=limit, cursor=cursor, status=status)
+        else:
+            jobs, next_cursor = search_jobs(q, limit=limit, cursor=cursor, status=status, sort=sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"jobs": jobs, "next_cursor": next_cursor}
+
 @app.get("/jobs", response_class=HTMLResponse)
 async def job_dashboard(
     request: Request,
@@ -281,15 +500,23 @@ async def job_dashboard(
     q: str = Query("")
 ):
     require_login(request)
-    jobs = get_recent_jobs(status=status)
-    if q:
-        jobs = [j for j in jobs if q.lower() in j["prompt"].lower()]
-    jobs = sorted(jobs, key=sort_job_priority, reverse=True)
+    return await run_heavy(render_job_dashboard, request, status, q)
+
+def find_jobs(status, q, limit=50):
+    # A search is ranked by relevance across all history, not just recent
+    # jobs; archived matches fill up whatever the hot table doesn't
+    if q.strip():
+        jobs = search_jobs(q, limit=limit, status=status)[0]
+        if len(jobs) < limit:
+            jobs += search_archived_jobs(q, limit=limit - len(jobs), status=status)[0]
+        return jobs
+    return get_recent_jobs(status=status, order="queue")
+
+def render_job_dashboard(request, status, q):
+    jobs = find_jobs(status, q)
 
-    # ✅ Fetch all gallery images sorted by filename
-    image_dir = os.path.expanduser("~/FluxImages")
-    gallery_images = [f for f in os.listdir(image_dir) if f.lower().endswith(".png")]
-    gallery_images.sort()  # Sort alphabetically; use reverse=True for reverse order
+    # ✅ All gallery images sorted by filename (rescanned only when the directory changes)
+    gallery_images = catalog.list_pngs(OUTPUT_DIR)
 
     return templates.TemplateResponse("jobs.html", {
         "request": request,
@@ -302,7 +529,7 @@ async def job_dashboard(
 @app.get("/jobs/{job_id}")
 def job_details(request: Request, job_id: str):
     require_login(request)
-    job = get_job(job_id)
+    job = find_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
@@ -310,17 +537,34 @@ def job_details(request: Request, job_id: str):
 @app.get("/job/{job_id}", response_class=HTMLResponse)
 def view_job(request: Request, job_id: str):
     require_login(request)
-    job = get_job(job_id)
+    job = find_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return templates.TemplateResponse("job_detail.html", {
         "request": request,
-        "job": job
+        "job": job,
+        "progress": progress.describe(job)
     })
 
+@app.get("/partials/job_progress/{job_id}", response_class=HTMLResponse)
+def partial_job_progress(request: Request, job_id: str):
+    require_login(request)
+    job = find_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Once the job has finished, reload the page so it shows the image or error
+    headers = None if job["status"] in ("queued", "in_progress") else {"HX-Refresh": "true"}
+    return templates.TemplateResponse("partials/_job_progress.html", {
+        "request": request,
+        "job": job,
+        "progress": progress.describe(job)
+    }, headers=headers)
+
 @app.get("/linkable", response_class=HTMLResponse)
-def linkable_page(request: Request):
-    
+async def linkable_page(request: Request):
+    return await run_heavy(render_linkable_page, request)
+
+def render_linkable_page(request):
     try:
         files = [
             f for f in os.listdir(LINKABLE_DIR)
@@ -334,12 +578,13 @@ def linkable_page(request: Request):
     })
 
 @app.get("/linkable/download/{filename}")
-def download_linkable_file(filename: str):
+def download_linkable_file(request: Request, filename: str):
     # Sanitize filename and enforce safe path
     safe_path = os.path.abspath(os.path.join(LINKABLE_DIR, filename))
     if not safe_path.startswith(os.path.abspath(LINKABLE_DIR)) or not os.path.isfile(safe_path):
         raise HTTPException(status_code=404, detail="Invalid file")
-    return FileResponse(safe_path, filename=filename, media_type="application/octet-stream")
+    # Files here can be replaced under the same name, so revalidate; ranges let downloads resume
+    return file_response(request, safe_path, filename=filename, media_type="application/octet-stream")
 
 @app.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
@@ -354,16 +599,25 @@ def logout(request: Request):
 def metrics_json():
     return get_job_metrics()
 
+@app.get("/metrics")
+def metrics_prometheus():
+    # Scraped by Prometheus: every process's histograms and gauges plus queue depth
+    record_memory("api")
+    body = render_metrics(get_status_counts())
+    if body is None:
+        return Response("prometheus_client is not installed\n", status_code=503, media_type="text/plain")
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/partials/job_table", response_class=HTMLResponse)
 async def partial_job_table(
     request: Request,
     status: str = Query("all"),
     q: str = Query("")
 ):
-    jobs = get_recent_jobs(status=status)
-    if q:
-        jobs = [j for j in jobs if q.lower() in j["prompt"].lower()]
-    jobs = sorted(jobs, key=sort_job_priority, reverse=True)
+    return await run_heavy(render_job_table, request, status, q)
+
+def render_job_table(request, status, q):
+    jobs = find_jobs(status, q)
 
     return templates.TemplateResponse("partials/_job_table.html", {
         "request": request,
@@ -391,89 +645,98 @@ def privacy_page(request: Request):
 
 @app.get("/status/{job_id}")
 def status(job_id: str):
-    job = get_job(job_id)
+    job = find_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return job
+    # Queued and running jobs also get percent, eta_seconds and their details
+    return {**job, **progress.describe(job)}
 
 @app.get("/terms", response_class=HTMLResponse)
 def terms_page(request: Request):
     return templates.TemplateResponse("terms.html", {"request": request})
 
 @app.get("/thumbnails/{filename}")
-def get_thumbnail(filename: str):
-    thumb_path = os.path.join(OUTPUT_DIR, "thumbnails", filename)
-    if not os.path.exists(thumb_path):
+def get_thumbnail(request: Request, filename: str):
+    if filename != os.path.basename(filename):
         raise HTTPException(status_code=404, detail="Thumbnail not found")
 
-    headers = {
-        "Cache-Control": "public, max-age=31536000, immutable"  # 1 year cache
-    }
-    return FileResponse(thumb_path, media_type="image/png", headers=headers)
+    vary = None
+    rendition = thumbnails.parse_thumb_name(filename, image_dir=OUTPUT_DIR)
+    if rendition:
+        # A srcset entry: <image stem>_<width>.<format>
+        source, width, fmt = rendition
+    else:
+        # Plain /thumbnails/<image>: default width in the best format the client
+        # names; clients that name none get a PNG, as the URL says
+        source, width = filename, thumbnails.DEFAULT_WIDTH
+        fmt = thumbnails.negotiate(request.headers.get("accept"), fallback="png")
+        vary = "Accept"
+
+    try:
+        # Rendered here if the background thumbnailer hasn't got to it yet
+        thumb_path = thumbnails.ensure(source, width, fmt, image_dir=OUTPUT_DIR)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    except Exception as e:
+        logger.warning(f"Thumbnail render failed for {source}: {e}")
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return file_response(request, thumb_path, media_type=thumbnails.MEDIA_TYPES[fmt],
+                         cache_control=image_cache_control(source), vary=vary, variant=fmt)
 
 #####################################################################################
 #                                   POST                                            #
 #####################################################################################
 
+# Bulk actions run as background maintenance tasks (see maintenance.py);
+# progress shows up on /admin.
 @app.post("/admin/archive")
 def archive_images(request: Request, days: int = 1):
     require_login(request)
-    jobs = get_completed_jobs_for_archive(days)
-    archived = []
-    for job in jobs:
-        try:
-            archive_date = job["end_time"].split("T")[0]
-            archive_dir = os.path.join(OUTPUT_DIR, "archive", archive_date)
-            os.makedirs(archive_dir, exist_ok=True)
-            src = os.path.join(OUTPUT_DIR, job["filename"])
-            dst = os.path.join(archive_dir, job["filename"])
-            if os.path.exists(src):
-                os.rename(src, dst)
-                archived.append(dst)
-        except Exception:
-            pass
+    maintenance.start_task("archive_images", days=days)
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
 
 @app.post("/admin/archive_done")
 def archive_done(request: Request):
     require_login(request)
-    conn = sqlite3.connect(os.path.expanduser("~/flux_api/flux_jobs.db"))
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS archived_jobs AS SELECT * FROM jobs WHERE 0''')
-    c.execute("INSERT INTO archived_jobs SELECT * FROM jobs WHERE status = 'done'")
-    c.execute("DELETE FROM jobs WHERE status = 'done'")
-    conn.commit()
-    conn.close()
+    maintenance.start_task("archive_done")
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
 
 @app.post("/admin/cleanup")
 def cleanup(request: Request, days: int = 7):
     require_login(request)
-    deleted = delete_old_jobs(days=days)
-    deleted_files = []
-    for job in deleted:
-        filepath = os.path.join(OUTPUT_DIR, job["filename"])
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                deleted_files.append(job["filename"])
-            except Exception:
-                pass
+    maintenance.start_task("cleanup", days=days)
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
 
 @app.post("/admin/cleanup_failed")
 def cleanup_failed(request: Request):
     require_login(request)
-    conn = sqlite3.connect(os.path.expanduser("~/flux_api/flux_jobs.db"))
-    c = conn.cursor()
-    c.execute("SELECT filename FROM jobs WHERE status = 'failed'")
-    for row in c.fetchall():
-        f = os.path.join(OUTPUT_DIR, row[0])
-        if os.path.exists(f):
-            os.remove(f)
-    c.execute("DELETE FROM jobs WHERE status = 'failed'")
-    conn.commit()
-    conn.close()
+    maintenance.start_task("cleanup_failed")
+    return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
+
+@app.post("/admin/compact")
+def compact(request: Request):
+    require_login(request)
+    maintenance.start_task("compact")
+    return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
+
+def maintenance_overview(limit=5):
+    return [maintenance.describe(task) for task in get_maintenance_tasks(limit)]
+
+@app.get("/admin/maintenance")
+def admin_maintenance(request: Request, limit: int = Query(10, ge=1, le=100)):
+    require_login(request)
+    return maintenance_overview(limit)
+
+@app.get("/partials/maintenance", response_class=HTMLResponse)
+def partial_maintenance(request: Request):
+    require_login(request)
+    return templates.TemplateResponse("partials/_maintenance_tasks.html", {"request": request, "tasks": maintenance_overview()})
+
+@app.post("/admin/thumbnails/backfill")
+def admin_backfill_thumbnails(request: Request):
+    require_login(request)
+    # The supervisor's thumbnailer works through them; existing renditions are skipped
+    thumbnails.backfill()
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
 
 @app.post("/admin/clear_queue")
@@ -491,6 +754,7 @@ def admin_delete(request: Request, job_id: str):
     path = os.path.join(OUTPUT_DIR, filename)
     if os.path.exists(path):
         os.remove(path)
+    publish_job_change(job_id)
     return RedirectResponse(url="/flux/jobs", status_code=303)
 
 @app.post("/clear_queue")
@@ -508,29 +772,26 @@ def generate_from_form(
     width: int = Form(1024),
     filename: Optional[str] = Form(None),
     strength: float = Form(0.75),                # img2img
+    seed: Optional[str] = Form(None),            # blank = random
     init_image: UploadFile = File(None),         # img2img upload
     gallery_image: Optional[str] = Form(None)    # img2img from gallery
 ):
     require_login(request)
     init_image_path = None
+    try:
+        seed = int(seed) if seed and seed.strip() else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Seed must be a whole number")
 
-    # ✅ Case 1: Uploaded image
+    # ✅ Case 1: Uploaded image (stored once by content hash, checked while streaming)
     if init_image and init_image.filename:
-        suffix = os.path.splitext(init_image.filename)[-1] or ".png"
-        init_image_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{suffix}")
-
-        # Save uploaded image
-        with open(init_image_path, "wb") as buffer:
-            shutil.copyfileobj(init_image.file, buffer)
-
-        # Validate size (avoid zero-byte files)
-        if os.path.getsize(init_image_path) == 0:
-            os.remove(init_image_path)
-            raise HTTPException(status_code=400, detail="Uploaded image is empty")
+        try:
+            init_image_path = uploads.store_upload(init_image.file)
+        except uploads.UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
 
-        # Copy to gallery
-        gallery_copy = os.path.join(OUTPUT_DIR, f"init_{uuid.uuid4().hex}{suffix}")
-        shutil.copy2(init_image_path, gallery_copy)
+        # Hardlink into the gallery so it can be picked again
+        gallery_copy = uploads.link_into_gallery(init_image_path)
         logger.info(f"Uploaded init image saved as {gallery_copy}")
 
     # ✅ Case 2: Gallery image selected
@@ -551,56 +812,117 @@ def generate_from_form(
         "filename": filename,
         "autotune": True,  # Force autotune always
         "init_image": init_image_path,
-        "strength": strength
+        "strength": strength,
+        "seed": seed,
+        "lane": "interactive",
+        "client": session_client(request)
     })
 
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/job/{job_info['job_id']}", status_code=303)
 
-@app.post("/generate/json")
-def generate_from_json(payload: PromptRequest, request: Request, auth=Depends(require_token)):
-    payload.prompt = payload.prompt.strip()
-
+def resolve_init_image(init_image):
     # ✅ Only process img2img validation if init_image is provided
-    if payload.init_image:
-        candidate = os.path.join(OUTPUT_DIR, payload.init_image)
+    if not init_image:
+        # If init_image is None, it's a txt2img request, leave it alone
+        return None
 
-        if not os.path.exists(payload.init_image) and not os.path.exists(candidate):
-            raise HTTPException(status_code=404, detail="Init image not found")
+    candidate = os.path.join(OUTPUT_DIR, init_image)
+    if not os.path.exists(init_image) and not os.path.exists(candidate):
+        raise HTTPException(status_code=404, detail="Init image not found")
 
-        # If the original path doesn't exist, use candidate
-        payload.init_image = payload.init_image if os.path.exists(payload.init_image) else candidate
-    else:
-        # If init_image is None, it's a txt2img request, leave it alone
-        payload.init_image = None
+    # If the original path doesn't exist, use candidate
+    return init_image if os.path.exists(init_image) else candidate
+
+@app.post("/generate/batch")
+def generate_batch(
+    payload: BatchPromptRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    auth=Depends(require_token)
+):
+    if not payload.jobs:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(payload.jobs) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {MAX_BATCH_SIZE} jobs")
+
+    # Validate everything before inserting anything
+    params_list, errors = [], []
+    for index, job in enumerate(payload.jobs):
+        job.prompt = job.prompt.strip()
+        try:
+            job.init_image = resolve_init_image(job.init_image)
+            job.lane = resolve_lane(job.lane, "bulk")
+        except HTTPException as e:
+            errors.append({"index": index, "detail": e.detail})
+        params_list.append(dict(job.dict(), client=auth))
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
 
-    job_info = add_job_to_db_and_queue(payload.dict())
+    try:
+        result = add_jobs_to_db_and_queue(params_list, idempotency_key=payload.idempotency_key or idempotency_key)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return {
+        "message": "Batch already submitted" if result["replayed"] else "Batch submitted successfully",
+        "replayed": result["replayed"],
+        "job_ids": [j["job_id"] for j in result["jobs"]],
+        "jobs": result["jobs"]
+    }
+
+@app.post("/generate/json")
+def generate_from_json(payload: PromptRequest, request: Request, auth=Depends(require_token)):
+    payload.prompt = payload.prompt.strip()
+    payload.init_image = resolve_init_image(payload.init_image)
+    payload.lane = resolve_lane(payload.lane, "interactive")
+
+    job_info = add_job_to_db_and_queue(dict(payload.dict(), client=auth))
     return {
         "message": "Job submitted successfully",
         "job_id": job_info["job_id"],
         "filename": job_info["filename"]
     }
 
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job_route(request: Request, job_id: str, auth=Depends(require_token)):
+    previous = cancel_job(job_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if previous not in ("queued", "in_progress"):
+        raise HTTPException(status_code=409, detail=f"Job already {previous}")
+    if previous == "in_progress":
+        # The worker running it kills its generator and takes the next job
+        cancel_running_job(job_id)
+    publish_job_change(job_id)
+
+    if "text/html" in request.headers.get("accept", ""):
+        return RedirectResponse(url=f"{request.scope.get('root_path', '')}/job/{job_id}", status_code=303)
+    return {"job_id": job_id, "previous_status": previous, "status": "cancelled"}
+
 @app.post("/jobs/{job_id}/retry")
 def retry_job(request: Request, job_id: str):
     require_login(request)
     original = get_job_for_retry(job_id)
     if not original:
-        raise HTTPException(status_code=400, detail="Job not found or not failed")
-
-    new_id = uuid.uuid4().hex[:8]
-    new_filename = f"{new_id}.png"
-
-    add_job(
-        job_id=new_id,
-        prompt=original["prompt"],
-        steps=original["steps"],
-        guidance_scale=original["guidance_scale"],
-        height=original["height"],
-        width=original["width"],
-        autotune=bool(original["autotune"]),
-        filename=new_filename,
-        output_dir=original.get("output_dir", os.path.expanduser("~/FluxImages"))
-    )
+        raise HTTPException(status_code=400, detail="Job not found or not failed/cancelled")
+
+    # Queued like a new submission, so the result cache key is worked out
+    # from the parameters the retry actually runs with
+    add_job_to_db_and_queue({
+        "prompt": original["prompt"],
+        "steps": original["steps"],
+        "guidance_scale": original["guidance_scale"],
+        "height": original["height"],
+        "width": original["width"],
+        "autotune": bool(original["autotune"]),
+        "output_dir": original.get("output_dir") or os.path.expanduser("~/FluxImages"),
+        "init_image": original.get("init_image"),
+        "strength": original.get("strength"),
+        "seed": original.get("seed"),
+        "lane": original.get("lane"),
+        "priority": original.get("priority"),
+        "client": original.get("client"),
+    })
 
     return RedirectResponse(url=f"{request.scope.get('root_path', '')}/admin", status_code=303)
 
@@ -0,0 +1,547 @@
+"""Resident image generator.
+
+Run as a child process of a worker (``python generator.py --mode txt2img``).
+It loads its pipeline once, then reads one JSON request per line on stdin and
+answers with one JSON event per line on stdout, so a worker pays the model
+load cost once instead of once per job.
+
+The worker side lives in ``GeneratorProcess`` / ``GeneratorPool`` below and
+only needs the standard library, as does the ``fake`` backend.
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+import random
+import hashlib
+import select
+import signal
+import argparse
+import importlib
+import subprocess
+
+from cpu_topology import numa_prefix
+
+# ==========================
+# ✅ CONFIG SECTION
+# ==========================
+GENERATOR_SCRIPT = os.path.abspath(__file__)
+RUN_FLUX_SCRIPT = "/home/smithkt/flux_schnell_cpu/run_flux.py"
+
+# diffusers | subprocess | fake | "package.module:Class"
+DEFAULT_BACKEND = os.getenv("FLUX_GENERATOR_BACKEND", "diffusers")
+FAKE_LATENCY = float(os.getenv("FLUX_FAKE_LATENCY", "0.5"))
+
+# Keep the txt2img and img2img generators loaded at the same time instead of
+# swapping when consecutive jobs need a different mode.
+KEEP_BOTH_RESIDENT = os.getenv("FLUX_GENERATOR_KEEP_BOTH", "0") == "1"
+
+MODES = ("txt2img", "img2img")
+
+# tqdm's "<step>/<total> [" as printed by run_flux.py
+PROGRESS_BAR = re.compile(rb"(\d+)/(\d+) \[")
+
+
+class GeneratorError(Exception):
+    pass
+
+
+class GeneratorTimeout(GeneratorError):
+    pass
+
+
+class GeneratorCancelled(GeneratorError):
+    pass
+
+
+def denoising_steps(params):
+    """Steps the pipeline actually runs: img2img skips the first (1 - strength) of them."""
+    steps = int(params.get("steps") or 4)
+    if params.get("init_image") and params.get("strength") is not None:
+        return max(1, min(steps, int(steps * float(params["strength"]))))
+    return steps
+
+
+# ==========================
+# ✅ BACKENDS
+# ==========================
+class ProgressReporter:
+    """Backends call ``self.progress(step, steps)`` after each denoising step.
+
+    ``serve`` replaces it with one that sends a progress event to the worker.
+    """
+
+    def progress(self, step, steps):
+        pass
+
+
+class FakeBackend(ProgressReporter):
+    """Writes a flat-colour PNG after a configurable delay. No weights needed."""
+
+    def __init__(self, mode, model_path=None, latency=FAKE_LATENCY):
+        self.mode = mode
+        self.latency = latency
+
+    def load(self):
+        pass
+
+    def generate(self, params):
+        self._denoise(params)
+        self._write(params)
+
+    def generate_batch(self, batch):
+        # One delay per call, like a real batched forward pass
+        self._denoise(batch[0])
+        for params in batch:
+            self._write(params)
+        return [None] * len(batch)
+
+    def _denoise(self, params):
+        steps = denoising_steps(params)
+        for step in range(1, steps + 1):
+            time.sleep(self.latency / steps)
+            self.progress(step, steps)
+
+    @staticmethod
+    def _write(params):
+        digest = hashlib.sha1(params["prompt"].encode()).digest()
+        write_png(params["output_path"], int(params.get("width", 64)), int(params.get("height", 64)), digest[:3])
+
+
+class DiffusersBackend(ProgressReporter):
+    """Keeps a Flux Schnell (txt2img) or SD1.5 (img2img) pipeline in memory."""
+
+    def __init__(self, mode, model_path):
+        self.mode = mode
+        self.model_path = model_path
+        self.pipe = None
+
+    def load(self):
+        import torch
+
+        if os.getenv("FLUX_TORCH_THREADS"):
+            torch.set_num_threads(int(os.environ["FLUX_TORCH_THREADS"]))
+
+        if self.mode == "img2img":
+            from diffusers import StableDiffusionImg2ImgPipeline
+            self.pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
+                self.model_path, torch_dtype=torch.float32, safety_checker=None
+            )
+        else:
+            from diffusers import FluxPipeline
+            self.pipe = FluxPipeline.from_pretrained(self.model_path, torch_dtype=torch.float32)
+        self.pipe.to("cpu")
+
+    @staticmethod
+    def _rng(params, required=False):
+        if params.get("seed") is None and not required:
+            return None
+        import torch
+        seed = params["seed"] if params.get("seed") is not None else random.getrandbits(63)
+        return torch.Generator("cpu").manual_seed(int(seed))
+
+    def generate(self, params):
+        if self.mode == "img2img":
+            init = self._init_image(params)
+            image = self.pipe(
+                prompt=params["prompt"],
+                image=init,
+                strength=float(params["strength"]),
+                guidance_scale=float(params["guidance_scale"]),
+                num_inference_steps=int(params["steps"]),
+                generator=self._rng(params),
+                callback_on_step_end=self._on_step_end,
+            ).images[0]
+        else:
+            image = self.pipe(
+                prompt=params["prompt"],
+                guidance_scale=float(params["guidance_scale"]),
+                num_inference_steps=int(params["steps"]),
+                height=int(params["height"]),
+                width=int(params["width"]),
+                generator=self._rng(params),
+                callback_on_step_end=self._on_step_end,
+            ).images[0]
+        image.save(params["output_path"])
+
+    def _on_step_end(self, pipe, step, timestep, callback_kwargs):
+        # Called by diffusers after every denoising step
+        self.progress(step + 1, pipe.num_timesteps)
+        return callback_kwargs
+
+    @staticmethod
+    def _init_image(params):
+        if params.get("init_array"):
+            # Decoded and sized by the worker (init_cache.py): only scale to [0, 1]
+            import numpy as np
+            import torch
+            pixels = np.load(params["init_array"], mmap_mode="r")
+            return torch.from_numpy(pixels.astype(np.float32) / 255).permute(2, 0, 1).unsqueeze(0)
+        from PIL import Image
+        return Image.open(params["init_image"]).convert("RGB")
+
+    def generate_batch(self, batch):
+        """One pipeline call for several txt2img jobs sharing steps/guidance/size."""
+        if self.mode != "txt2img":
+            return generate_each(self, batch)
+        first = batch[0]
+        images = self.pipe(
+            prompt=[params["prompt"] for params in batch],
+            guidance_scale=float(first["guidance_scale"]),
+            num_inference_steps=int(first["steps"]),
+            height=int(first["height"]),
+            width=int(first["width"]),
+            # Per-image generators keep seeded jobs reproducible inside a batch
+            generator=[self._rng(params, required=True) for params in batch],
+            callback_on_step_end=self._on_step_end,
+        ).images
+        for params, image in zip(batch, images):
+            image.save(params["output_path"])
+        return [None] * len(batch)
+
+
+class SubprocessBackend(ProgressReporter):
+    """Legacy path: one run_flux.py process per job (reloads weights every time)."""
+
+    def __init__(self, mode, model_path):
+        self.mode = mode
+        self.model_path = model_path
+        self.seed_flag = None
+
+    def load(self):
+        pass
+
+    def supports_seed(self):
+        # run_flux.py lives outside this repo; only pass --seed if its --help lists it
+        if self.seed_flag is None:
+            try:
+                usage = subprocess.run([sys.executable, RUN_FLUX_SCRIPT, "--help"], capture_output=True,
+                                       timeout=120).stdout
+                self.seed_flag = b"--seed" in usage
+            except (OSError, subprocess.SubprocessError):
+                self.seed_flag = False
+            if not self.seed_flag:
+                print("⚠️ run_flux.py has no --seed option; seeded jobs run unseeded", file=sys.stderr)
+        return self.seed_flag
+
+    def generate(self, params):
+        output_dir, output = os.path.split(params["output_path"])
+        cmd = [
+            sys.executable, RUN_FLUX_SCRIPT,
+            "--prompt", params["prompt"],
+            "--output", output,
+            "--output_dir", output_dir,
+            "--steps", str(params["steps"]),
+            "--guidance_scale", str(params["guidance_scale"]),
+        ]
+        if self.mode == "img2img":
+            cmd += [
+                "--init_image", params["init_image"],
+                "--strength", str(params["strength"]),
+                "--sd_model_path", self.model_path,
+            ]
+        else:
+            cmd += [
+                "--flux_model_path", self.model_path,
+                "--height", str(params["height"]),
+                "--width", str(params["width"]),
+            ]
+        if params.get("seed") is not None and self.supports_seed():
+            cmd += ["--seed", str(params["seed"])]
+        if params.get("autotune"):
+            cmd.append("--autotune")
+        # run_flux.py prints progress; keep our stdout clean for the protocol.
+        # Its denoising progress bar ("2/4 [00:10<00:10, ...]") is also the
+        # only step progress there is; other bars have a different total.
+        steps = denoising_steps(params)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        pending = b""
+        for chunk in iter(lambda: proc.stdout.read1(65536), b""):
+            sys.stderr.buffer.write(chunk)
+            sys.stderr.flush()
+            *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+            for line in lines:
+                match = PROGRESS_BAR.search(line)
+                if match and int(match.group(2)) == steps:
+                    self.progress(int(match.group(1)), steps)
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+BACKENDS = {
+    "diffusers": DiffusersBackend,
+    "subprocess": SubprocessBackend,
+    "fake": FakeBackend,
+}
+
+
+def load_backend_class(name):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    if ":" not in name:
+        raise GeneratorError(f"Unknown generator backend: {name}")
+    module_name, attr = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def write_png(path, width, height, rgb):
+    row = b"\x00" + bytes(rgb) * width
+    raw = zlib.compress(row * height, 6)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", raw))
+        f.write(chunk(b"IEND", b""))
+
+
+def generate_each(backend, batch):
+    """Fallback for backends without batching: one call per job.
+
+    Returns one entry per job, None on success or the error message.
+    """
+    errors = []
+    for params in batch:
+        try:
+            backend.generate(params)
+            errors.append(None)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    return errors
+
+
+# ==========================
+# ✅ SERVER (child process)
+# ==========================
+def serve(backend):
+    # The protocol owns the real stdout; anything the pipelines print goes to stderr.
+    out = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def send(event):
+        out.write(json.dumps(event) + "\n")
+
+    # Progress events precede the result of the request they belong to
+    backend.progress = lambda step, steps: send({"event": "progress", "step": step, "steps": steps})
+    backend.load()
+    send({"event": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        op = request.get("op")
+        if op == "shutdown":
+            break
+        if op not in ("generate", "generate_batch"):
+            send({"event": "result", "ok": False, "error": f"Unknown op: {op}"})
+            continue
+
+        started = time.time()
+        try:
+            if op == "generate_batch":
+                batch = request["batch"]
+                errors = backend.generate_batch(batch) if hasattr(backend, "generate_batch") else generate_each(backend, batch)
+                send({"event": "result", "ok": True, "seconds": round(time.time() - started, 3), "errors": errors})
+            else:
+                backend.generate(request["params"])
+                send({"event": "result", "ok": True, "seconds": round(time.time() - started, 3)})
+        except Exception as e:
+            send({"event": "result", "ok": False, "error": f"{type(e).__name__}: {e}"})
+
+
+# ==========================
+# ✅ CLIENT (worker side)
+# ==========================
+class GeneratorProcess:
+    def __init__(self, mode, python_bin, model_path, backend=DEFAULT_BACKEND):
+        self.mode = mode
+        self.python_bin = python_bin
+        self.model_path = model_path
+        self.backend = backend
+        self.proc = None
+        self.pending = b""  # read from stdout, not yet split into events
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self, deadline=None, watch=None):
+        """Launch the generator and wait for its model to load.
+
+        ``deadline`` and ``watch`` apply to the load as in ``_read``: a load
+        that overruns or is cancelled kills the child.
+        """
+        # CPU affinity and thread budgets are inherited from the worker;
+        # memory is bound to its NUMA node where numactl is available
+        cmd = numa_prefix() + [
+            self.python_bin, GENERATOR_SCRIPT,
+            "--mode", self.mode,
+            "--backend", self.backend,
+            "--model-path", self.model_path or "",
+        ]
+        # Own process group, so a kill also takes out run_flux.py children
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+            start_new_session=True
+        )
+        self.pending = b""
+        event = self._read(watch=watch, deadline=deadline)
+        if event.get("event") != "ready":
+            self.close()
+            raise GeneratorError(f"{self.mode} generator failed to start: {event}")
+        print(f"✅ {self.mode} generator ready (pid {event['pid']}, backend {self.backend})")
+
+    def _read(self, timeout=None, watch=None, deadline=None):
+        """Read the next event.
+
+        ``timeout`` bounds the wait in seconds (``deadline``, a
+        ``time.monotonic()`` value, takes precedence). ``watch`` is an
+        optional object with ``fileno()`` and ``poll()``; when it becomes
+        readable and ``poll()`` returns a reason, the run is abandoned.
+        Either way the generator's process group is killed so its CPU is
+        freed at once.
+
+        stdout is read straight from the pipe: a request answers with
+        several lines (progress, then the result), and lines sitting in a
+        file object's buffer would be invisible to ``select``.
+        """
+        if deadline is None and timeout:
+            deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self.pending:
+            remaining = max(0, deadline - time.monotonic()) if deadline else None
+            ready, _, _ = select.select([fd] + ([watch] if watch else []), [], [], remaining)
+            if fd in ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    code = self.proc.wait()
+                    self.proc = None
+                    raise GeneratorError(f"{self.mode} generator exited with code {code}")
+                self.pending += chunk
+                continue
+            if watch in ready:
+                reason = watch.poll()
+                if reason:
+                    self.kill()
+                    raise GeneratorCancelled(reason)
+                continue
+            self.kill()
+            raise GeneratorTimeout(f"{self.mode} generator timed out")
+
+        line, _, self.pending = self.pending.partition(b"\n")
+        return json.loads(line)
+
+    def _request(self, request, timeout=None, watch=None, on_progress=None):
+        """Send one request and wait for its result.
+
+        Progress events arriving first go to ``on_progress(step, steps)``;
+        ``timeout`` covers the whole call, not each event.
+        """
+        # A (re)start's model load counts towards the call's timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        if not self.alive:
+            self.start(deadline=deadline, watch=watch)
+        try:
+            self.proc.stdin.write(json.dumps(request) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            self.close()
+            raise GeneratorError(f"{self.mode} generator is not accepting work: {e}")
+
+        event = self._read(watch=watch, deadline=deadline)
+        while event.get("event") == "progress":
+            if on_progress:
+                on_progress(event["step"], event["steps"])
+            event = self._read(watch=watch, deadline=deadline)
+        if not event.get("ok"):
+            raise GeneratorError(event.get("error", "unknown error"))
+        return event
+
+    def generate(self, params, timeout=None, watch=None, on_progress=None):
+        return self._request({"op": "generate", "params": params}, timeout, watch, on_progress)
+
+    def generate_batch(self, batch, timeout=None, watch=None, on_progress=None):
+        """Run several jobs in one call; returns per-job errors (None = ok)."""
+        return self._request({"op": "generate_batch", "batch": batch}, timeout, watch, on_progress)["errors"]
+
+    def kill(self):
+        if not self.proc:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.proc.wait()
+        self.proc = None
+
+    def close(self):
+        if not self.proc:
+            return
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write(json.dumps({"op": "shutdown"}) + "\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=10)
+            except Exception:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+
+class GeneratorPool:
+    """One resident generator per mode, swapped or kept depending on config."""
+
+    def __init__(self, specs, backend=DEFAULT_BACKEND, keep_both=KEEP_BOTH_RESIDENT):
+        # specs: {mode: (python_bin, model_path)}
+        self.specs = specs
+        self.backend = backend
+        self.keep_both = keep_both
+        self.generators = {}
+
+    def get(self, mode):
+        gen = self.generators.get(mode)
+        if gen is None:
+            if not self.keep_both:
+                # Free the other pipeline's memory before loading this one
+                for other in list(self.generators):
+                    self.generators.pop(other).close()
+            python_bin, model_path = self.specs[mode]
+            if self.backend == "fake":
+                python_bin = sys.executable
+            gen = GeneratorProcess(mode, python_bin, model_path, backend=self.backend)
+            self.generators[mode] = gen
+        return gen
+
+    def generate(self, mode, params, timeout=None, watch=None, on_progress=None):
+        return self.get(mode).generate(params, timeout, watch, on_progress)
+
+    def generate_batch(self, mode, batch, timeout=None, watch=None, on_progress=None):
+        return self.get(mode).generate_batch(batch, timeout, watch, on_progress)
+
+    def close(self):
+        for gen in self.generators.values():
+            gen.close()
+        self.generators.clear()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Resident Flux/SD1.5 generator")
+    ap.add_argument("--mode", choices=MODES, required=True)
+    ap.add_argument("--backend", default=DEFAULT_BACKEND)
+    ap.add_argument("--model-path", default="")
+    args = ap.parse_args()
+
+    backend_cls = load_backend_class(args.backend)
+    serve(backend_cls(args.mode, args.model_path))
+
+
+if __name__ == "__main__":
+    main()
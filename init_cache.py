@@ -0,0 +1,109 @@
+"""Decoded init images for img2img, cached between jobs.
+
+The first img2img job on an image decodes it, converts it to RGB and sizes
+it the way the pipeline would (down to a multiple of 8 on each side), then
+saves the pixels as an uncompressed ``.npy`` array under
+``cache/init/<sha256>_<w>x<h>.npy``. The generator memory-maps that array
+instead of decoding the PNG/JPEG again, so repeat runs off the same image skip
+the decode and resize entirely. The cache is bounded by size; least recently
+used arrays go first.
+
+numpy is optional here: without it ``prepare`` returns None and generators
+keep reading ``init_image`` as before.
+"""
+import os
+import re
+import uuid
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from db import incr_counter
+from result_cache import file_digest
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache", "init")
+UPLOAD_DIR = os.path.join(OUTPUT_DIR, "uploads")
+MAX_BYTES = int(float(os.getenv("FLUX_INIT_CACHE_MB", "1024")) * 1024 * 1024)
+
+# SD1.5's VAE works on multiples of 8
+ALIGN = 8
+
+# Uploads are stored as uploads/<sha256>.<ext> already
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}$")
+
+# {path: (mtime_ns, size, digest)} so gallery images are hashed once per change
+_digests = {}
+
+
+def target_size(width, height):
+    return max(ALIGN, width - width % ALIGN), max(ALIGN, height - height % ALIGN)
+
+
+def content_digest(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(UPLOAD_DIR) and CONTENT_ADDRESSED.match(stem):
+        return stem
+    st = os.stat(path)
+    cached = _digests.get(path)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    digest = file_digest(path)
+    _digests[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def prepare(path, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    """Path of the cached pixel array for init image ``path``, building it if needed.
+
+    Returns None when numpy isn't available.
+    """
+    if np is None:
+        return None
+    digest = content_digest(path)
+    with Image.open(path) as img:
+        size = target_size(*img.size)
+        cached = os.path.join(cache_dir, f"{digest}_{size[0]}x{size[1]}.npy")
+        if os.path.exists(cached):
+            # mtime doubles as the LRU clock
+            os.utime(cached)
+            incr_counter("init_cache.hits")
+            return cached
+
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+        pixels = np.asarray(img, dtype=np.uint8)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = os.path.join(cache_dir, f".{uuid.uuid4().hex}.npy")
+    np.save(tmp, pixels)
+    os.replace(tmp, cached)
+    incr_counter("init_cache.misses")
+    evict(cache_dir, max_bytes, keep=cached)
+    return cached
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, keep=None):
+    """Drop least recently used arrays until the cache fits ``max_bytes``."""
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".npy") and not entry.name.startswith("."):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -1,19 +1,39 @@
 import os
-import time
 import uuid
-import subprocess
 import re
+import json
+import hashlib
 import shutil
+import time
 from datetime import datetime
-from PIL import Image
+import psutil
+
+from generator import GeneratorPool, GeneratorError, GeneratorTimeout, GeneratorCancelled, DEFAULT_BACKEND, denoising_steps
+import catalog
+import result_cache
+import init_cache
+import metrics
+from thumbnails import request_thumbnails
 
 from db import (
     add_job,
+    add_jobs,
+    get_job,
     update_job_status,
     init_db,
-    get_oldest_queued_job,
-    delete_queued_jobs
+    claim_next_job,
+    delete_queued_jobs,
+    set_client_weight,
+    claim_compatible_jobs,
+    get_batch_max_size,
+    incr_counter,
+    requeue_jobs,
+    set_job_progress,
+    clear_job_progress,
+    LANES
 )
+from notify import Listener, publish
+from events import publish_job_change, publish_refresh
 
 # ==========================
 # ✅ CONFIG SECTION
@@ -28,11 +48,44 @@ SD15_PYTHON = "/home/smithkt/SD1.5/SD_env/bin/python"
 FLUX_MODEL_PATH = "/home/smithkt/flux_schnell_cpu/flux_schnell_local"
 SD15_MODEL_PATH = "/home/smithkt/SD1.5"
 
+# Workers are woken as soon as a job is queued; this is only a safety net
+# for missed wake-ups (e.g. jobs inserted by another tool).
+FALLBACK_POLL_SECONDS = float(os.getenv("FLUX_FALLBACK_POLL_SECONDS", "30"))
+JOBS_CHANNEL = "jobs"
+# The API publishes the id of a running job here to have it killed
+CANCEL_CHANNEL = "cancel"
+
+# Wall-clock limit per generator call: a fixed allowance plus time per
+# denoising step per megapixel, summed over the jobs in a batch.
+JOB_TIMEOUT_BASE_SECONDS = float(os.getenv("FLUX_JOB_TIMEOUT_BASE", "300"))
+JOB_TIMEOUT_PER_STEP_MP = float(os.getenv("FLUX_JOB_TIMEOUT_PER_STEP_MP", "60"))
+
+# Fair-share weights: "client=weight" pairs, matched on the full client id
+# ("token:n8n") or its kind ("token", "session"); everything else gets 1.
+CLIENT_WEIGHTS = dict(
+    (name.strip(), float(weight))
+    for name, weight in (pair.split("=") for pair in os.getenv("FLUX_CLIENT_WEIGHTS", "").split(",") if "=" in pair)
+)
+MAX_PRIORITY = 10
+
+# After claiming a batchable job, wait this long for compatible jobs to
+# arrive before running a batch smaller than the configured maximum.
+BATCH_WAIT_SECONDS = float(os.getenv("FLUX_BATCH_WAIT_SECONDS", "0.5"))
+
+# Step progress of a running job is written at most this often
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("FLUX_PROGRESS_INTERVAL", "1"))
+
+# Resident generator per mode: (python interpreter, model path)
+GENERATOR_SPECS = {
+    "txt2img": (FLUX_PYTHON, FLUX_MODEL_PATH),
+    "img2img": (SD15_PYTHON, SD15_MODEL_PATH),
+}
+
 
 # ==========================
 # ✅ ADD JOB TO DB & QUEUE
 # ==========================
-def add_job_to_db_and_queue(params):
+def _prepare_job(params, created_dirs):
     job_id = uuid.uuid4().hex[:8]
 
     # Internal filename (always random)
@@ -50,166 +103,541 @@ def add_job_to_db_and_queue(params):
     output_dir = params.get("output_dir")
     if output_dir:
         output_dir = os.path.abspath(os.path.expanduser(output_dir))
-        os.makedirs(output_dir, exist_ok=True)
+        if output_dir not in created_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            created_dirs.add(output_dir)
     else:
         output_dir = OUTPUT_DIR
 
+    row = {
+        "job_id": job_id,
+        "prompt": params["prompt"],
+        "steps": params.get("steps", 4),
+        "guidance_scale": params.get("guidance_scale", 3.5),
+        "height": params.get("height", 1024),
+        "width": params.get("width", 1024),
+        "autotune": params.get("autotune", True),
+        "filename": internal_filename,
+        "output_dir": output_dir,
+        "custom_filename": custom_filename,
+        "init_image": params.get("init_image"),
+        "strength": params.get("strength"),
+        "seed": params.get("seed"),
+        "lane": params.get("lane") if params.get("lane") in LANES else "bulk",
+        "priority": max(-MAX_PRIORITY, min(MAX_PRIORITY, int(params.get("priority") or 0))),
+        "client": params.get("client"),
+    }
+    mode, request = build_generation_request(row, None)
+    row["param_hash"] = result_cache.param_hash(mode, request, (DEFAULT_BACKEND, GENERATOR_SPECS[mode][1]))
+    return row, requested_filename
+
+
+def _serve_from_cache(row):
+    """Finish ``row`` from the result cache if an identical output exists.
+
+    The output is linked into place and the row marked done in memory;
+    returns True on a hit.
+    """
+    if not row["param_hash"]:
+        return False
+    cached = result_cache.lookup(row["param_hash"])
+    if not cached:
+        return False
+
+    internal_path = os.path.join(OUTPUT_DIR, row["filename"])
+    try:
+        result_cache.materialize(cached, internal_path)
+    except OSError as e:
+        print(f"⚠️ Failed to serve cached result: {e}")
+        return False
+    deliver_output(row, internal_path, link=True)
+
+    now = datetime.utcnow().isoformat()
+    row.update(status="done", cached_from=row["param_hash"], start_time=now, end_time=now)
+    return True
+
+
+def client_weight(client):
+    if client in CLIENT_WEIGHTS:
+        return CLIENT_WEIGHTS[client]
+    return CLIENT_WEIGHTS.get(client.split(":", 1)[0], 1.0)
+
+
+def _register_clients(rows):
+    for client in {row["client"] for row in rows if row["client"]}:
+        set_client_weight(client, client_weight(client))
+
+
+def _publish_cached(row):
+    # Gallery entries for a job that never went through a worker
+    add_gallery_assets(row, os.path.join(OUTPUT_DIR, row["filename"]))
+
+
+def add_job_to_db_and_queue(params):
+    row, requested_filename = _prepare_job(params, set())
+    job_id = row["job_id"]
+    cached = _serve_from_cache(row)
+    _register_clients([row])
+
     # Insert into DB
-    add_job(
-        job_id=job_id,
-        prompt=params["prompt"],
-        steps=params.get("steps", 4),
-        guidance_scale=params.get("guidance_scale", 3.5),
-        height=params.get("height", 1024),
-        width=params.get("width", 1024),
-        autotune=params.get("autotune", True),
-        filename=internal_filename,
-        output_dir=output_dir,
-        custom_filename=custom_filename,
-        init_image=params.get("init_image"),
-        strength=params.get("strength")
-    )
+    add_job(**row)
+
+    if cached:
+        _publish_cached(row)
+    else:
+        wake_workers()
+    publish_job_change(job_id)
 
     params["job_id"] = job_id
-    params["internal_filename"] = internal_filename
-    params["output_dir"] = output_dir
-    params["custom_filename"] = custom_filename
+    params["internal_filename"] = row["filename"]
+    params["output_dir"] = row["output_dir"]
+    params["custom_filename"] = row["custom_filename"]
 
     return {
         "job_id": job_id,
-        "status": "queued",
-        "filename": internal_filename,
-        "output_dir": output_dir,
+        "status": row.get("status", "queued"),
+        "filename": row["filename"],
+        "output_dir": row["output_dir"],
         "custom_filename": requested_filename
     }
 
 
+def add_jobs_to_db_and_queue(params_list, idempotency_key=None):
+    """Queue a batch of jobs with one insert transaction.
+
+    Raises ValueError if ``idempotency_key`` was already used for a
+    different batch.
+    """
+    request_hash = hashlib.sha256(json.dumps(params_list, sort_keys=True, default=str).encode()).hexdigest()
+    created_dirs = set()
+    rows = [_prepare_job(dict(params), created_dirs)[0] for params in params_list]
+    cached = [row for row in rows if _serve_from_cache(row)]
+    _register_clients(rows)
+
+    created, replay = add_jobs(rows, idempotency_key=idempotency_key, request_hash=request_hash)
+    if replay:
+        # Nothing was inserted: drop the outputs linked for cache hits
+        for row in cached:
+            _remove_quietly(os.path.join(OUTPUT_DIR, row["filename"]))
+        if replay["request_hash"] != request_hash:
+            raise ValueError("Idempotency key was already used for a different batch")
+        return {"jobs": created, "replayed": True}
+
+    for row in cached:
+        _publish_cached(row)
+    if len(cached) < len(rows):
+        wake_workers()
+    for job in created:
+        publish_job_change(job["job_id"])
+    return {"jobs": created, "replayed": False}
+
+
+# ==========================
+# ✅ WAKE IDLE WORKERS
+# ==========================
+def wake_workers():
+    publish(JOBS_CHANNEL)
+
+
 # ==========================
 # ✅ CLEAR QUEUE
 # ==========================
 def clear_queue():
     delete_queued_jobs()
+    publish_refresh()
+
+
+# ==========================
+# ✅ STATUS UPDATES
+# ==========================
+def set_job_status(job_id, status, **fields):
+    updated = update_job_status(job_id, status, **fields)
+    if updated:
+        publish_job_change(job_id)
+    return updated
 
 
 # ==========================
-# ✅ THUMBNAIL CREATION
+# ✅ OUTPUT DELIVERY
 # ==========================
-def create_thumbnail(source_path, dest_path, size=(400, 400)):
+def deliver_output(job, internal_path, link=False):
+    """Copy a finished image to the job's output dir / custom filename."""
+    user_output_dir = os.path.abspath(os.path.expanduser(job.get("output_dir") or OUTPUT_DIR))
+    internal_filename = os.path.basename(internal_path)
+    place = result_cache.materialize if link else shutil.copy2
     try:
-        img = Image.open(source_path)
-        img.thumbnail(size)
-        img.save(dest_path, "PNG", optimize=True)
-        return True
-    except Exception as e:
-        print(f"⚠️ Failed to create thumbnail: {e}")
-        return False
+        custom_filename = job.get("custom_filename")
+        if custom_filename:
+            dest_path = os.path.join(user_output_dir, custom_filename)
+        elif user_output_dir != os.path.abspath(OUTPUT_DIR):
+            dest_path = os.path.join(user_output_dir, internal_filename)
+        else:
+            return
+        started = time.perf_counter()
+        place(internal_path, dest_path)
+        metrics.OUTPUT_COPY.labels(*metrics.job_labels(job)).observe(time.perf_counter() - started)
+        print(f"✅ Copied{' and renamed' if custom_filename else ''} to: {dest_path}")
+    except Exception as copy_err:
+        print(f"⚠️ Failed to copy to output_dir: {copy_err}")
+
+
+def add_gallery_assets(job, internal_path):
+    # ✅ Add to the gallery catalog; thumbnails are rendered in the background
+    try:
+        catalog.add_image(job, internal_path)
+        request_thumbnails()
+    except Exception as cat_err:
+        print(f"⚠️ Failed to catalog image: {cat_err}")
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ==========================
+# ✅ GENERATOR REQUEST
+# ==========================
+def build_generation_request(job, output_path):
+    if job.get("init_image"):
+        # SD1.5 Img2Img
+        mode = "img2img"
+        params = {
+            "prompt": job["prompt"],
+            "output_path": output_path,
+            "init_image": job["init_image"],
+            "strength": job.get("strength") or 0.6,
+            "guidance_scale": 6.5,
+            "steps": 40,
+        }
+    else:
+        # Flux Schnell Txt2Img
+        mode = "txt2img"
+        params = {
+            "prompt": job["prompt"],
+            "output_path": output_path,
+            "steps": job.get("steps") or 4,
+            "guidance_scale": job.get("guidance_scale") or 3.5,
+            "height": job.get("height") or 1024,
+            "width": job.get("width") or 1024,
+        }
+    if job.get("seed") is not None:
+        params["seed"] = int(job["seed"])
+    params["autotune"] = bool(job.get("autotune"))
+    return mode, params
+
+
+# ==========================
+# ✅ TIMEOUTS & CANCELLATION
+# ==========================
+def job_timeout(batch):
+    """Seconds a generator call for ``batch`` (list of request params) may take."""
+    work = 0
+    for params in batch:
+        megapixels = (params.get("width") or 512) * (params.get("height") or 512) / 1_000_000
+        work += params.get("steps", 4) * max(megapixels, 0.25)
+    return JOB_TIMEOUT_BASE_SECONDS + JOB_TIMEOUT_PER_STEP_MP * work
+
+
+class CancelWatch:
+    """Cancel requests for the jobs this worker is currently running."""
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.job_ids = set()
+        self.cancelled = set()
+
+    def fileno(self):
+        return self.listener.fileno()
+
+    def watch(self, job_ids):
+        self.job_ids = set(job_ids)
+        self.cancelled = set()
+
+    def poll(self):
+        for raw in self.listener.drain():
+            job_id = raw.decode(errors="replace")
+            if job_id in self.job_ids:
+                self.cancelled.add(job_id)
+        if self.cancelled:
+            return f"cancelled {', '.join(sorted(self.cancelled))}"
+        return None
+
+
+def cancel_running_job(job_id):
+    publish(CANCEL_CHANNEL, job_id)
+
+
+# ==========================
+# ✅ STEP PROGRESS
+# ==========================
+class ProgressRecorder:
+    """Records the generator's step events for the jobs of one call.
+
+    The first and last steps are written at once, others at most every
+    ``interval`` seconds, so a 40-step img2img run costs a handful of
+    small writes instead of one per step.
+    """
+
+    def __init__(self, job_ids, interval=PROGRESS_INTERVAL_SECONDS):
+        self.job_ids = list(job_ids)
+        self.interval = interval
+        self.started = time.monotonic()
+        self.first = None  # (step, time) of the first event
+        self.written_at = None
+        self.steps = None
+
+    def step_seconds(self, step, now):
+        # From the first step on, so model warm-up and prompt encoding don't count
+        first_step, first_at = self.first
+        if step > first_step:
+            return (now - first_at) / (step - first_step)
+        return (now - self.started) / step
+
+    def __call__(self, step, steps):
+        now = time.monotonic()
+        self.steps = steps
+        if self.first is None:
+            self.first = (step, now)
+        if self.written_at is not None and now - self.written_at < self.interval and step < steps:
+            return
+        self.written_at = now
+        try:
+            set_job_progress(self.job_ids, step, steps, round(self.step_seconds(step, now), 3))
+        except Exception as e:
+            print(f"⚠️ Failed to record progress: {e}")
+
+    def clear(self):
+        try:
+            clear_job_progress(self.job_ids)
+        except Exception as e:
+            print(f"⚠️ Failed to clear progress: {e}")
 
 
 # ==========================
 # ✅ MAIN WORKER LOOP
 # ==========================
-def run_worker():
+def run_worker(generators=None, stop=None):
+    """Claim and run jobs until ``stop`` (a multiprocessing.Event) is set.
+
+    ``stop`` is only checked between jobs, so a draining worker always
+    finishes the job it is on.
+    """
+    generators = generators or GeneratorPool(GENERATOR_SPECS)
+    try:
+        _worker_loop(generators, stop)
+    finally:
+        generators.close()
+
+
+def _worker_loop(generators, stop=None):
+    worker = str(os.getpid())
+    # Bind before the first claim so a job queued in between still wakes us
+    with Listener(JOBS_CHANNEL) as wakeups, Listener(CANCEL_CHANNEL) as cancels:
+        watch = CancelWatch(cancels)
+        busy = metrics.WORKER_BUSY.labels(worker)
+        while not (stop and stop.is_set()):
+            busy.set(0)
+            metrics.record_memory("worker", include_children=True)
+            jobs = claim_batch(worker, wakeups)
+            if not jobs:
+                wakeups.wait(FALLBACK_POLL_SECONDS)
+                continue
+            busy.set(1)
+            process_batch(jobs, generators, watch)
+
+
+def claim_batch(worker, wakeups):
+    """Claim the next job plus compatible txt2img jobs to run alongside it."""
+    job = claim_next_job(worker=worker)
+    if not job:
+        return []
+    publish_job_change(job["job_id"])
+    _observe_queue_wait(job)
+    batch = [job]
+    max_size = get_batch_max_size()
+    if max_size <= 1 or job.get("init_image"):
+        return batch
+
+    deadline = time.monotonic() + BATCH_WAIT_SECONDS
     while True:
-        job = get_oldest_queued_job()
-        if not job:
-            time.sleep(1)
-            continue
+        for companion in claim_compatible_jobs(job, max_size - len(batch), worker=worker):
+            publish_job_change(companion["job_id"])
+            _observe_queue_wait(companion)
+            batch.append(companion)
+        remaining = deadline - time.monotonic()
+        if len(batch) >= max_size or remaining <= 0:
+            return batch
+        wakeups.wait(remaining)
+
+
+def _observe_queue_wait(job):
+    try:
+        waited = datetime.fromisoformat(job["start_time"]) - datetime.fromisoformat(job["queued_at"])
+    except (TypeError, ValueError):
+        return
+    metrics.QUEUE_WAIT.labels(*metrics.job_labels(job)).observe(max(0.0, waited.total_seconds()))
+
+
+def _peak_rss(proc):
+    # VmHWM is the high-water mark; plain RSS where /proc isn't available
+    try:
+        with open(f"/proc/{proc.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return proc.memory_info().rss
+
+
+def worker_footprint():
+    """Peak resident memory of this worker plus its generator processes."""
+    try:
+        me = psutil.Process()
+        return sum(_peak_rss(p) for p in [me, *me.children(recursive=True)])
+    except psutil.Error:
+        return None
+
+
+# Final updates only apply while the job is still ours; a cancelled job stays cancelled
+def _fail(job, message):
+    set_job_status(job["job_id"], "failed", end_time=datetime.utcnow().isoformat(), error_message=message,
+                   expected_status="in_progress")
+
+
+def _finish_job(job, internal_path, cached_key=None, footprint=None, step_seconds=None, batch_size=None):
+    # A job cancelled while it ran gets none of the side effects: no copy to
+    # its output dir, no gallery entry, no cache entry, and no stray file for
+    # the catalog to pick up on the next start
+    current = get_job(job["job_id"])
+    if not current or current["status"] != "in_progress":
+        _remove_quietly(internal_path)
+        return
+
+    deliver_output(job, internal_path)
+    add_gallery_assets(job, internal_path)
 
-        job_id = job["job_id"]
-        update_job_status(job_id, "in_progress", start_time=datetime.utcnow().isoformat())
+    key = job.get("param_hash")
+    if key and not cached_key:
+        try:
+            result_cache.store(key, internal_path, job["job_id"])
+        except OSError as cache_err:
+            print(f"⚠️ Failed to cache result: {cache_err}")
+
+    set_job_status(job["job_id"], "done", end_time=datetime.utcnow().isoformat(), cached_from=cached_key,
+                   peak_rss_bytes=footprint, step_seconds=step_seconds, batch_size=batch_size,
+                   expected_status="in_progress")
+
+
+def process_batch(jobs, generators, watch=None):
+    """Run claimed jobs; compatible txt2img jobs share one generator call.
 
+    Every job still gets its own output file and status.
+    """
+    pending = []
+    for job in jobs:
         try:
             # Ensure user-specified output directory exists
-            user_output_dir = os.path.abspath(os.path.expanduser(job.get("output_dir", OUTPUT_DIR)))
+            user_output_dir = os.path.abspath(os.path.expanduser(job.get("output_dir") or OUTPUT_DIR))
             os.makedirs(user_output_dir, exist_ok=True)
         except Exception as e:
-            update_job_status(job_id, "failed", end_time=datetime.utcnow().isoformat(),
-                              error_message=f"Output dir error: {e}")
+            _fail(job, f"Output dir error: {e}")
             continue
 
         # Internal save location
-        internal_save_dir = OUTPUT_DIR
-        internal_filename = job["filename"]
-        internal_path = os.path.join(internal_save_dir, internal_filename)
-
-        # ==========================
-        # ✅ SELECT MODE & ENV
-        # ==========================
-        if job.get("init_image"):
-            # Use SD1.5 Img2Img
-            python_bin = SD15_PYTHON
-            cmd = [
-                python_bin,
-                "/home/smithkt/flux_schnell_cpu/run_flux.py",
-                "--prompt", job["prompt"],
-                "--output", internal_filename,
-                "--output_dir", internal_save_dir,
-                "--init_image", job["init_image"],
-                "--strength", str(job.get("strength", 0.6)),
-                "--sd_model_path", SD15_MODEL_PATH,
-                "--guidance_scale", "6.5",
-                "--steps", "40"
-            ]
-        else:
-            # Use Flux Schnell Txt2Img
-            python_bin = FLUX_PYTHON
-            cmd = [
-                python_bin,
-                "/home/smithkt/flux_schnell_cpu/run_flux.py",
-                "--prompt", job["prompt"],
-                "--output", internal_filename,
-                "--output_dir", internal_save_dir,
-                "--flux_model_path", FLUX_MODEL_PATH,
-                "--steps", str(job.get("steps", 4)),
-                "--guidance_scale", str(job.get("guidance_scale", 3.5)),
-                "--height", str(job.get("height", 1024)),
-                "--width", str(job.get("width", 1024))
-            ]
-
-        if job.get("autotune"):
-            cmd.append("--autotune")
-
-        # ==========================
-        # ✅ EXECUTE JOB
-        # ==========================
-        try:
-            subprocess.run(cmd, check=True)
+        internal_path = os.path.join(OUTPUT_DIR, job["filename"])
 
-            # ✅ Copy to user output dir if needed
+        # An identical job may have finished since this one was queued
+        key = job.get("param_hash")
+        cached = result_cache.lookup(key, count_miss=False) if key else None
+        if cached:
             try:
-                custom_filename = job.get("custom_filename")
-                if custom_filename:
-                    dest_path = os.path.join(user_output_dir, custom_filename)
-                    shutil.copy2(internal_path, dest_path)
-                    print(f"✅ Copied and renamed to: {dest_path}")
-                elif os.path.abspath(user_output_dir) != os.path.abspath(internal_save_dir):
-                    dest_path = os.path.join(user_output_dir, internal_filename)
-                    shutil.copy2(internal_path, dest_path)
-                    print(f"✅ Copied to: {dest_path}")
-            except Exception as copy_err:
-                print(f"⚠️ Failed to copy to output_dir: {copy_err}")
-
-            # ✅ Create thumbnail for gallery (FluxImages/thumbnails)
+                result_cache.materialize(cached, internal_path)
+                _finish_job(job, internal_path, cached_key=key)
+            except Exception as e:
+                _fail(job, f"Unexpected error: {e}")
+            continue
+
+        mode, params = build_generation_request(job, internal_path)
+        if params.get("init_image"):
             try:
-                thumb_dir = os.path.join(OUTPUT_DIR, "thumbnails")
-                os.makedirs(thumb_dir, exist_ok=True)
-                thumb_path = os.path.join(thumb_dir, internal_filename)
-
-                if create_thumbnail(internal_path, thumb_path):
-                    print(f"✅ Thumbnail created at {thumb_path}")
-                else:
-                    print(f"⚠️ Thumbnail creation failed for {internal_path}")
-            except Exception as thumb_err:
-                print(f"⚠️ Thumbnail generation error: {thumb_err}")
-
-            update_job_status(job_id, "done", end_time=datetime.utcnow().isoformat())
-
-        except subprocess.CalledProcessError as e:
-            update_job_status(job_id, "failed", end_time=datetime.utcnow().isoformat(),
-                              error_message=f"Subprocess error: {e}")
+                init_array = init_cache.prepare(params["init_image"])
+                if init_array:
+                    params["init_array"] = init_array
+            except Exception as e:
+                # The generator can still decode init_image itself
+                print(f"⚠️ Init image cache failed: {e}")
+        pending.append((job, mode, params))
+
+    if not pending:
+        return
+
+    # ==========================
+    # ✅ EXECUTE JOBS
+    # ==========================
+    # claim_batch only groups txt2img jobs, so the whole batch shares a mode
+    mode = pending[0][1]
+    batch = [params for _, _, params in pending]
+    timeout = job_timeout(batch)
+    if watch:
+        watch.watch(job["job_id"] for job, _, _ in pending)
+    progress = ProgressRecorder(job["job_id"] for job, _, _ in pending)
+    errors = None
+    try:
+        started = time.perf_counter()
+        if len(pending) == 1:
+            generators.generate(mode, batch[0], timeout=timeout, watch=watch, on_progress=progress)
+            errors = [None]
+        else:
+            errors = generators.generate_batch(mode, batch, timeout=timeout, watch=watch, on_progress=progress)
+        elapsed = time.perf_counter() - started
+        metrics.GENERATION.labels(*metrics.job_labels(pending[0][0])).observe(elapsed)
+        # Per call, like the progress rows; the queue estimate shares it out by batch_size
+        step_seconds = elapsed / (progress.steps or denoising_steps(batch[0]))
+        incr_counter("batch.runs")
+        incr_counter("batch.jobs", len(pending))
+    except GeneratorCancelled as e:
+        # The cancelled jobs are already marked; batch-mates go back in the queue
+        survivors = [job["job_id"] for job, _, _ in pending if job["job_id"] not in watch.cancelled]
+        requeue_jobs(survivors)
+        for job_id in survivors:
+            publish_job_change(job_id)
+        if survivors:
+            wake_workers()
+        print(f"⚠️ Generator killed: {e}")
+        return
+    except GeneratorTimeout:
+        for job, _, _ in pending:
+            _fail(job, f"Timed out after {timeout:.0f}s")
+        return
+    except GeneratorError as e:
+        for job, _, _ in pending:
+            _fail(job, f"Generator error: {e}")
+        return
+    except Exception as e:
+        for job, _, _ in pending:
+            _fail(job, f"Unexpected error: {e}")
+        return
+    finally:
+        # On success the rows stay until the jobs are marked done, so pollers
+        # never see a finished generation as not started
+        if errors is None:
+            progress.clear()
+
+    footprint = worker_footprint()
+    for (job, _, params), error in zip(pending, errors):
+        if error:
+            _fail(job, f"Generator error: {error}")
+            continue
+        try:
+            _finish_job(job, params["output_path"], footprint=footprint, step_seconds=round(step_seconds, 4),
+                        batch_size=len(pending))
         except Exception as e:
-            update_job_status(job_id, "failed", end_time=datetime.utcnow().isoformat(),
-                              error_message=f"Unexpected error: {e}")
+            _fail(job, f"Unexpected error: {e}")
+    progress.clear()
 
 
 # Init DB
@@ -0,0 +1,255 @@
+"""Bulk archive and cleanup work, run in the background from /admin.
+
+The admin actions only queue a row in ``maintenance_tasks`` and publish on
+the ``maintenance`` channel. A ``MaintenanceRunner`` thread in the API
+process claims it and works through the matching jobs in rowid order, one
+chunk at a time: file moves/deletes first, then one short transaction for
+the rows, so workers can claim jobs between chunks. After every chunk the
+task records the last rowid it finished, so a task interrupted by a restart
+is picked up again where it stopped. File operations are rate limited to
+keep the disk available to the generators.
+"""
+import os
+import time
+import threading
+
+import psutil
+
+from db import (
+    get_jobs_chunk, count_jobs_for_maintenance, max_job_rowid, delete_jobs_by_rowid, archive_jobs_by_rowid,
+    count_legacy_archived_jobs, get_legacy_archived_chunk, move_legacy_archived_jobs, drop_legacy_archive,
+    reclaim_free_pages, compact_database, remove_images, create_maintenance_task, claim_maintenance_task,
+    update_maintenance_task, release_orphaned_maintenance_tasks, cutoff_iso, transaction
+)
+from notify import Listener, publish
+from events import publish_refresh
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+ARCHIVE_DIR = os.path.join(OUTPUT_DIR, "archive")
+
+MAINTENANCE_CHANNEL = "maintenance"
+CHUNK_SIZE = max(1, int(os.getenv("FLUX_MAINTENANCE_CHUNK", "500")))
+# 0 disables the limit
+FILE_OPS_PER_SEC = float(os.getenv("FLUX_MAINTENANCE_FILE_OPS", "200"))
+CHUNK_PAUSE_SECONDS = float(os.getenv("FLUX_MAINTENANCE_PAUSE_MS", "50")) / 1000
+FALLBACK_POLL_SECONDS = 60
+
+
+class Throttle:
+    """Spaces out calls to ``tick`` to at most ``rate`` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = time.monotonic()
+
+    def tick(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+# ==========================
+# ✅ TASK KINDS
+# ==========================
+# Each kind fetches chunks of rows in rowid order and handles one chunk at a
+# time; ``params`` are fixed when the task is queued, so a resumed task works
+# on the same set of jobs.
+def _archive_images(chunk, state, throttle):
+    # Moves the images of old finished jobs out of the gallery; the job rows stay
+    archived = []
+    for job in chunk:
+        throttle.tick()
+        try:
+            archive_dir = os.path.join(ARCHIVE_DIR, (job["end_time"] or "undated").split("T")[0])
+            os.makedirs(archive_dir, exist_ok=True)
+            src = os.path.join(OUTPUT_DIR, job["filename"])
+            if os.path.exists(src):
+                os.rename(src, os.path.join(archive_dir, job["filename"]))
+                archived.append(job["filename"])
+            else:
+                state["missing"] = state.get("missing", 0) + 1
+        except OSError as e:
+            state["errors"] = state.get("errors", 0) + 1
+            state["last_error"] = f"{job['filename']}: {e}"
+    remove_images(archived)
+    state["files"] = state.get("files", 0) + len(archived)
+
+
+def _delete_jobs(chunk, state, throttle):
+    # Files go first: a chunk interrupted halfway finds them already gone on resume
+    deleted = []
+    for job in chunk:
+        throttle.tick()
+        path = os.path.join(OUTPUT_DIR, job["filename"])
+        try:
+            os.remove(path)
+            deleted.append(job["filename"])
+        except FileNotFoundError:
+            state["missing"] = state.get("missing", 0) + 1
+        except OSError as e:
+            state["errors"] = state.get("errors", 0) + 1
+            state["last_error"] = f"{job['filename']}: {e}"
+    with transaction():
+        state["rows"] = state.get("rows", 0) + delete_jobs_by_rowid([job["row_id"] for job in chunk])
+    remove_images(deleted)
+    state["files"] = state.get("files", 0) + len(deleted)
+
+
+def _archive_rows(chunk, state, throttle):
+    state["rows"] = state.get("rows", 0) + archive_jobs_by_rowid([job["row_id"] for job in chunk])
+
+
+def _migrate_legacy(chunk, state, throttle):
+    state["rows"] = state.get("rows", 0) + move_legacy_archived_jobs(chunk)
+
+
+def _compact(chunk, state, throttle):
+    compact_database()
+    state["compacted"] = True
+
+
+def _job_kind(label, statuses, handler, cutoff=False):
+    return {
+        "label": label,
+        "handler": handler,
+        "cutoff": cutoff,
+        "params": lambda: {"max_rowid": max_job_rowid()},
+        "count": lambda params: count_jobs_for_maintenance(statuses, params.get("cutoff"), params["max_rowid"]),
+        "chunks": lambda params, after, limit: get_jobs_chunk(statuses, after, limit, params.get("cutoff"),
+                                                              params["max_rowid"]),
+    }
+
+
+KINDS = {
+    "archive_images": _job_kind("Archive images", ("done",), _archive_images, cutoff=True),
+    "archive_done": {**_job_kind("Archive done jobs", ("done",), _archive_rows), "finish": reclaim_free_pages},
+    "cleanup": {**_job_kind("Delete old jobs", ("done", "failed"), _delete_jobs, cutoff=True), "finish": reclaim_free_pages},
+    "cleanup_failed": {**_job_kind("Delete failed jobs", ("failed",), _delete_jobs), "finish": reclaim_free_pages},
+    # Drains the pre-cold-storage archived_jobs table; queued on startup when it has rows
+    "migrate_archive": {
+        "label": "Move archive table to cold storage",
+        "handler": _migrate_legacy,
+        "params": dict,
+        "count": lambda params: count_legacy_archived_jobs(),
+        "chunks": lambda params, after, limit: get_legacy_archived_chunk(after, limit),
+        "finish": drop_legacy_archive,
+    },
+    # One VACUUM; a single pseudo-chunk so it reuses the task bookkeeping
+    "compact": {
+        "label": "Compact database",
+        "handler": _compact,
+        "params": dict,
+        "count": lambda params: 1,
+        "chunks": lambda params, after, limit: [] if after else [{"row_id": 1}],
+    },
+}
+
+
+def start_task(kind, days=None):
+    """Queue a maintenance task and wake the runner; return the task.
+
+    An unfinished task of the same kind is returned instead of a new one.
+    """
+    spec = KINDS[kind]
+    # Jobs finishing after the click aren't part of the task
+    params = spec["params"]()
+    if spec.get("cutoff"):
+        params["days"] = days
+        params["cutoff"] = cutoff_iso(days)
+    task = create_maintenance_task(kind, params, spec["count"](params))
+    publish(MAINTENANCE_CHANNEL)
+    return task
+
+
+def describe(task):
+    """Task row plus display fields for /admin."""
+    total = task["total"] or 0
+    return {
+        **task,
+        "label": KINDS[task["kind"]]["label"] if task["kind"] in KINDS else task["kind"],
+        "percent": round(100 * task["processed"] / total) if total else 100,
+    }
+
+
+# ==========================
+# ✅ RUNNER
+# ==========================
+class MaintenanceRunner:
+    """Runs queued maintenance tasks one at a time on a daemon thread."""
+
+    def __init__(self, chunk_size=CHUNK_SIZE, file_ops_per_sec=FILE_OPS_PER_SEC, pause=CHUNK_PAUSE_SECONDS):
+        self.chunk_size = chunk_size
+        self.file_ops_per_sec = file_ops_per_sec
+        self.pause = pause
+        self.runner_id = str(os.getpid())
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        publish(MAINTENANCE_CHANNEL)
+
+    def _runner_alive(self, runner):
+        # A fresh process can't own a running task yet, even if its pid was reused
+        return runner != self.runner_id and runner is not None and psutil.pid_exists(int(runner))
+
+    def _run(self):
+        # Bind before the first claim so a task queued in between still wakes us
+        with Listener(MAINTENANCE_CHANNEL) as wakeups:
+            try:
+                release_orphaned_maintenance_tasks(self._runner_alive)
+                if count_legacy_archived_jobs():
+                    start_task("migrate_archive")
+            except Exception as e:
+                print(f"⚠️ Maintenance resume failed: {e}")
+            while not self._stop.is_set():
+                task = claim_maintenance_task(self.runner_id)
+                if task:
+                    self.run_task(task)
+                    continue
+                wakeups.wait(FALLBACK_POLL_SECONDS)
+
+    def run_task(self, task):
+        spec = KINDS[task["kind"]]
+        params, state = task["params"], task["state"]
+        processed = task["processed"]
+        throttle = Throttle(self.file_ops_per_sec)
+        try:
+            while not self._stop.is_set():
+                chunk = spec["chunks"](params, state.get("after", 0), self.chunk_size)
+                if not chunk:
+                    if spec.get("finish"):
+                        spec["finish"]()
+                    update_maintenance_task(task["id"], status="done", state=state, processed=processed,
+                                            message=self._summary(state))
+                    publish_refresh()
+                    return
+                spec["handler"](chunk, state, throttle)
+                processed += len(chunk)
+                state["after"] = chunk[-1]["row_id"]
+                update_maintenance_task(task["id"], state=state, processed=processed)
+                self._stop.wait(self.pause)
+            # Stopped mid-task: leave it for the next start to resume
+            update_maintenance_task(task["id"], status="pending")
+        except Exception as e:
+            print(f"⚠️ Maintenance task {task['id']} ({task['kind']}) failed: {e}")
+            update_maintenance_task(task["id"], status="failed", state=state, processed=processed, message=str(e))
+
+    @staticmethod
+    def _summary(state):
+        parts = [f"{state[key]} {label}" for key, label in (
+            ("rows", "rows"), ("files", "files"), ("missing", "files already missing"), ("errors", "errors")
+        ) if state.get(key)]
+        if state.get("compacted"):
+            parts.append("compacted")
+        return ", ".join(parts) or "Nothing to do"
@@ -0,0 +1,196 @@
+"""Prometheus metrics for the API, the workers and the thumbnailer.
+
+All of them record through prometheus_client's multiprocess mode: each
+process writes its samples to its own memory-mapped files under
+``METRICS_DIR`` and ``GET /metrics`` merges every file at scrape time, so
+histograms add up over the whole worker pool, including workers that have
+since been restarted. A process's gauges are dropped when the supervisor
+reaps it. Queue depth is not recorded at all; it is read from the database's
+per-status counters on each scrape.
+
+prometheus_client is optional: without it every metric here is a no-op and
+``/metrics`` answers 503.
+"""
+import os
+import time
+import functools
+
+import psutil
+
+from notify import RUN_DIR
+
+# prometheus_client reads this at import; child processes inherit it
+METRICS_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.expanduser(os.getenv("FLUX_METRICS_DIR", os.path.join(RUN_DIR, "prometheus")))
+)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+JOB_STATUSES = ("queued", "in_progress", "done", "failed", "cancelled")
+
+
+class _NoMetric:
+    """Stands in for every metric when prometheus_client isn't installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _histogram(name, documentation, labels, buckets=None):
+    if prometheus_client is None:
+        return _NoMetric()
+    if buckets:
+        return Histogram(name, documentation, labels, buckets=buckets)
+    return Histogram(name, documentation, labels)
+
+
+def _gauge(name, documentation, labels, mode):
+    return Gauge(name, documentation, labels, multiprocess_mode=mode) if prometheus_client else _NoMetric()
+
+
+# ==========================
+# ✅ METRICS
+# ==========================
+# Per-stage histograms carry mode (txt2img/img2img) and resolution ("WxH")
+QUEUE_WAIT = _histogram(
+    "flux_queue_wait_seconds", "Time from queueing to a worker claiming the job",
+    ["mode", "resolution"], buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+)
+GENERATION = _histogram(
+    "flux_generation_seconds", "Generator call duration (one call per batch)",
+    ["mode", "resolution"], buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+)
+OUTPUT_COPY = _histogram(
+    "flux_output_copy_seconds", "Copying a finished image to its output dir / custom filename",
+    ["mode", "resolution"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+THUMBNAIL = _histogram(
+    "flux_thumbnail_seconds", "Rendering all thumbnails and renditions of one image",
+    ["resolution"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+DB_OPERATION = _histogram(
+    "flux_db_operation_seconds", "Database call duration; begin_immediate is the write lock wait",
+    ["operation"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+HTTP_REQUEST = _histogram(
+    "flux_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+
+WORKER_BUSY = _gauge(
+    "flux_worker_busy", "1 while the worker (by pid) has jobs claimed, 0 while idle",
+    ["worker"], "livesum"
+)
+# The pid is an explicit label (not liveall) because forked children inherit
+# their parent's series at 0, which livesum adds up harmlessly
+RESIDENT_MEMORY = _gauge(
+    "flux_resident_memory_bytes", "RSS of each process; workers include their generator processes",
+    ["role", "pid"], "livesum"
+)
+
+
+def resolution(width, height):
+    return f"{width}x{height}" if width and height else "unknown"
+
+
+def job_labels(job):
+    """(mode, resolution) labels for a job row."""
+    return "img2img" if job.get("init_image") else "txt2img", resolution(job.get("width"), job.get("height"))
+
+
+def timed(fn):
+    """Record calls to a database function in flux_db_operation_seconds."""
+    if prometheus_client is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_OPERATION.labels(fn.__name__).observe(time.perf_counter() - started)
+    return wrapper
+
+
+def record_memory(role, include_children=False):
+    try:
+        proc = psutil.Process()
+        procs = [proc, *proc.children(recursive=True)] if include_children else [proc]
+        RESIDENT_MEMORY.labels(role, str(proc.pid)).set(sum(p.memory_info().rss for p in procs))
+    except psutil.Error:
+        pass
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a process that has exited."""
+    if prometheus_client:
+        multiprocess.mark_process_dead(pid, METRICS_DIR)
+
+
+# ==========================
+# ✅ EXPOSITION
+# ==========================
+class _QueueDepth:
+    def __init__(self, counts):
+        self.counts = counts
+
+    def collect(self):
+        family = GaugeMetricFamily("flux_jobs", "Jobs in the database by status", labels=["status"])
+        for status in sorted(set(JOB_STATUSES) | set(self.counts)):
+            family.add_metric([status], self.counts.get(status, 0))
+        yield family
+
+
+def render(status_counts):
+    """Prometheus text exposition of every process's metrics plus queue depth.
+
+    Returns None when prometheus_client isn't installed.
+    """
+    if prometheus_client is None:
+        return None
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, METRICS_DIR)
+    registry.register(_QueueDepth(status_counts))
+    return generate_latest(registry)
+
+
+class RequestMetrics:
+    """ASGI middleware timing requests by the path template of the matched route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or prometheus_client is None:
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def tracking_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, tracking_send)
+        finally:
+            # The router stores the matched route in the scope it was handed
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
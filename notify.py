@@ -0,0 +1,85 @@
+"""Local wake-up channels between the API and the worker processes.
+
+Each listener binds a Unix datagram socket under ``RUN_DIR/<channel>/``;
+``publish`` sends a datagram to every socket in that directory. Nothing is
+persisted: the database stays the source of truth and listeners only use the
+messages as a hint to go and look.
+"""
+import os
+import uuid
+import select
+import socket
+
+RUN_DIR = os.path.expanduser(os.getenv("FLUX_RUN_DIR", "~/flux_api/run"))
+
+MAX_MESSAGE = 65536
+
+
+def _channel_dir(channel):
+    path = os.path.join(RUN_DIR, channel)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class Listener:
+    def __init__(self, channel):
+        self.path = os.path.join(_channel_dir(channel), f"{os.getpid()}-{uuid.uuid4().hex[:6]}.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def drain(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.sock.recv(MAX_MESSAGE))
+            except (BlockingIOError, InterruptedError):
+                return messages
+
+    def wait(self, timeout=None):
+        """Block until at least one message arrives or ``timeout`` expires.
+
+        Returns every pending message (possibly an empty list on timeout).
+        """
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        return self.drain() if ready else []
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def publish(channel, message=b""):
+    if isinstance(message, str):
+        message = message.encode()
+    directory = _channel_dir(channel)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                sock.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Listener died without cleaning up
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except (BlockingIOError, OSError):
+                # Receiver's buffer is full: it already has a wake-up pending
+                pass
+    finally:
+        sock.close()
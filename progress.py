@@ -0,0 +1,146 @@
+"""Percent complete and ETAs for running and queued jobs.
+
+Running jobs report their denoising steps while they run (``job_progress``,
+written by the worker): the time left is the remaining steps at the job's
+own step rate. A job that hasn't finished its first step yet (model load,
+prompt encoding) falls back to the median step rate of recent generator
+calls with the same mode and size. Queued jobs are walked in claim order
+(``get_queue_plan``) and handed to whichever worker frees up first, each
+taking its steps at the historical rate shared out over batch-mates (a
+batch of four steps once for all four jobs). The queue walk is cached for a
+couple of seconds because ``/status`` is polled.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from db import get_job_progress, get_queue_plan, get_running_jobs, get_setting, get_step_rates
+from generator import denoising_steps
+from job_queue import build_generation_request
+
+CACHE_SECONDS = 2
+
+
+def _seconds_since(iso, now):
+    try:
+        return max(0.0, (now - datetime.fromisoformat(iso)).total_seconds())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def job_steps(job):
+    """(mode, denoising steps) the worker will run for ``job``."""
+    mode, params = build_generation_request(job, None)
+    return mode, denoising_steps(params)
+
+
+def step_rate(rates, mode, width, height):
+    """Seconds per step for a job, from ``get_step_rates`` history.
+
+    An unseen size is scaled from the same mode's other sizes by pixel
+    count (per-step cost grows with it); None without any history.
+    """
+    if (mode, width, height) in rates:
+        return rates[(mode, width, height)]
+    pixels = (width or 1024) * (height or 1024)
+    for same_mode in (True, False):
+        per_pixel = [rate / ((w or 1024) * (h or 1024)) for (m, w, h), rate in rates.items()
+                     if (m == mode) == same_mode]
+        if per_pixel:
+            return sorted(per_pixel)[len(per_pixel) // 2] * pixels
+    return None
+
+
+def running_progress(job, row, rates, now):
+    """Progress fields of an in-progress job; ``row`` is its job_progress row or None."""
+    mode, steps = job_steps(job)
+    if row:
+        rate = row["step_seconds"] or step_rate(rates, mode, job["width"], job["height"])
+        steps = row["steps"]
+        left = (steps - row["step"]) * rate - _seconds_since(row["updated"], now) if rate else None
+        return {
+            "percent": round(100 * row["step"] / steps) if steps else 0,
+            "eta_seconds": round(max(0.0, left), 1) if left is not None else None,
+            "progress": {"step": row["step"], "steps": steps, "step_seconds": round(rate, 3) if rate else None},
+        }
+    rate = step_rate(rates, mode, job["width"], job["height"])
+    left = steps * rate - _seconds_since(job.get("start_time"), now) if rate else None
+    return {
+        "percent": 0,
+        "eta_seconds": round(max(0.0, left), 1) if left is not None else None,
+        "progress": {"step": 0, "steps": steps, "step_seconds": round(rate, 3) if rate else None},
+    }
+
+
+def _estimate_queue(call_rates, job_rates):
+    now = datetime.utcnow()
+    running = get_running_jobs()
+    progress = get_job_progress()
+    estimates = {}
+
+    # When each worker is next free, starting with what it is running now;
+    # a worker running a batch is free once all of it is done
+    busy_until = {}
+    for job in running:
+        estimate = running_progress(job, progress.get(job["job_id"]), call_rates, now)
+        estimates[job["job_id"]] = estimate
+        left = estimate["eta_seconds"] if estimate["eta_seconds"] is not None else float("inf")
+        busy_until[job["worker"]] = max(busy_until.get(job["worker"], 0.0), left)
+    workers = max(1, (get_setting("workers.status", {}) or {}).get("running") or len(busy_until))
+    free_at = sorted(busy_until.values())[:workers]
+    free_at += [0.0] * (workers - len(free_at))
+    heapq.heapify(free_at)
+
+    for job in get_queue_plan():
+        mode, steps = job_steps(job)
+        rate = step_rate(job_rates, mode, job["width"], job["height"])
+        start = heapq.heappop(free_at)
+        done = start + steps * rate if rate is not None else float("inf")
+        heapq.heappush(free_at, done)
+        estimates[job["job_id"]] = {
+            "percent": 0,
+            "queue_position": job["position"],
+            "starts_in_seconds": round(start, 1) if start != float("inf") else None,
+            "eta_seconds": round(done, 1) if done != float("inf") else None,
+        }
+    return estimates
+
+
+class _Cached:
+    """``compute()``'s result, recomputed at most every ``seconds``."""
+
+    def __init__(self, compute, seconds=CACHE_SECONDS):
+        self.compute = compute
+        self.seconds = seconds
+        self.at = None
+        self.value = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.at is None or time.monotonic() - self.at > self.seconds:
+                self.value = self.compute()
+                self.at = time.monotonic()
+            return self.value
+
+
+# Seconds per step of a generator call, and of one job's share of it
+_call_rates = _Cached(get_step_rates, seconds=30)
+_job_rates = _Cached(lambda: get_step_rates(per_job=True), seconds=30)
+_queue = _Cached(lambda: _estimate_queue(_call_rates.get(), _job_rates.get()))
+
+
+def queue_estimates():
+    """{job_id: progress fields} for every running and queued job (cached briefly)."""
+    return _queue.get()
+
+
+def describe(job):
+    """Fields /status adds to a queued or running job: percent, eta_seconds and details."""
+    if job["status"] == "in_progress":
+        # A running job's own progress row is read fresh; it is one key lookup
+        return running_progress(job, get_job_progress(job["job_id"]), _call_rates.get(), datetime.utcnow())
+    if job["status"] == "queued":
+        return queue_estimates().get(job["job_id"], {"percent": 0, "eta_seconds": None})
+    return {}
@@ -0,0 +1,98 @@
+"""Content-addressed cache of finished outputs.
+
+A job that carries a seed is deterministic, so identical parameters give the
+same image. ``param_hash`` names such a request; when a worker finishes one,
+its output is hardlinked into ``CACHE_DIR/<hash>.png`` and later identical
+submissions are served from there without ever reaching a worker.
+"""
+import os
+import json
+import hashlib
+import shutil
+
+from db import get_cached_result, put_cached_result, drop_cached_result, evict_cached_results, incr_counter
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+
+MAX_BYTES = int(float(os.getenv("FLUX_RESULT_CACHE_MB", "2048")) * 1024 * 1024)
+MAX_ENTRIES = int(os.getenv("FLUX_RESULT_CACHE_ENTRIES", "5000"))
+
+# Bump to invalidate every existing entry (e.g. after a model upgrade)
+CACHE_VERSION = 1
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _normalize(value):
+    # 3, 3.0 and "3.0" from different clients must hash the same
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    return float(value)
+
+
+def param_hash(mode, params, model):
+    """Hash of everything that determines the output, or None without a seed.
+
+    ``params`` is the generator request from ``build_generation_request``;
+    the output path and tuning flags don't affect the pixels and are left out.
+    Init images are hashed by content, not by path.
+    """
+    if params.get("seed") is None:
+        return None
+    canonical = {k: _normalize(v) for k, v in params.items() if k not in ("output_path", "autotune")}
+    if canonical.get("init_image"):
+        try:
+            canonical["init_image"] = file_digest(canonical["init_image"])
+        except OSError:
+            return None
+    canonical.update(mode=mode, model=model, version=CACHE_VERSION)
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def lookup(key, count_miss=True):
+    """Return the cached output path for ``key`` and count the hit or miss."""
+    entry = get_cached_result(key)
+    if entry and not os.path.exists(entry["path"]):
+        # Removed from disk behind our back
+        drop_cached_result(key)
+        entry = None
+    if entry:
+        incr_counter("result_cache.hits")
+    elif count_miss:
+        incr_counter("result_cache.misses")
+    return entry["path"] if entry else None
+
+
+def materialize(source, dest):
+    """Hardlink ``source`` to ``dest``, copying when a link isn't possible."""
+    if os.path.abspath(source) == os.path.abspath(dest):
+        return
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def store(key, output_path, job_id):
+    """Add a finished output to the cache and evict down to the size bounds."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(CACHE_DIR, f"{key}.png")
+    tmp_path = f"{cache_path}.{job_id}.tmp"
+    materialize(output_path, tmp_path)
+    os.replace(tmp_path, cache_path)
+    put_cached_result(key, cache_path, os.path.getsize(cache_path), job_id)
+
+    for path in evict_cached_results(MAX_BYTES, MAX_ENTRIES):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
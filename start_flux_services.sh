@@ -2,6 +2,9 @@
 source /home/smithkt/flux_schnell_cpu/flux_env/bin/activate
 cd /home/smithkt/flux_api
 
+# Prometheus keeps one metrics file per process; start from a clean set
+rm -rf "${FLUX_METRICS_DIR:-${FLUX_RUN_DIR:-$HOME/flux_api/run}/prometheus}"
+
 # Start FastAPI server in background
 /home/smithkt/flux_schnell_cpu/flux_env/bin/uvicorn flux_api:app --host 0.0.0.0 --port 8000 &
 
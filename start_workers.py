@@ -1,18 +1,273 @@
+import os
+import time
+import signal
 import multiprocessing
-from job_queue import run_worker
+from datetime import datetime
 
-NUM_WORKERS = 3  # Or however many you want
+import psutil
+
+from cpu_topology import partition, physical_cores
+from job_queue import run_worker, wake_workers
+from db import count_jobs_by_status, fail_orphaned_jobs, get_recent_footprints, get_setting, set_setting
+from events import publish_job_change
+from notify import Listener, publish
+from thumbnails import Thumbnailer, request_thumbnails
+import metrics
+
+# ==========================
+# ✅ CONFIG SECTION
+# ==========================
+MIN_WORKERS = int(os.getenv("FLUX_MIN_WORKERS", "1"))
+MAX_WORKERS = int(os.getenv("FLUX_MAX_WORKERS", str(os.cpu_count() or 1)))
+CORES_PER_WORKER = max(1, int(os.getenv("FLUX_CORES_PER_WORKER", "4")))
+# Give each worker its own cores and a matching torch/OpenMP thread budget
+CPU_PINNING = os.getenv("FLUX_CPU_PINNING", "1") == "1"
+USE_SMT = os.getenv("FLUX_USE_SMT", "0") == "1"
+# Per-worker memory assumed until finished jobs have reported real footprints
+DEFAULT_WORKER_MEM_GB = float(os.getenv("FLUX_WORKER_MEM_GB", "8"))
+MEM_HEADROOM = 1.2
+FOOTPRINT_HISTORY = 50
+
+SUPERVISE_SECONDS = 5
+# Loading a model is slow: only shrink after the queue has been short this long
+SHRINK_AFTER_SECONDS = float(os.getenv("FLUX_SHRINK_AFTER_SECONDS", "120"))
+# A worker that dies sooner than this counts as a crash loop for backoff
+STABLE_SECONDS = 60
+MAX_BACKOFF_SECONDS = 60
+# Render gallery thumbnails in a separate low-priority process pool
+RUN_THUMBNAILER = os.getenv("FLUX_THUMBNAILER", "1") == "1"
+
+# /admin publishes here after changing the pool settings
+CONTROL_CHANNEL = "workers"
+
+
+def request_resize():
+    """Ask a running supervisor to re-read the pool settings now."""
+    publish(CONTROL_CHANNEL)
+
+
+def start_worker(index, stop, cpu_set=None):
+    # Leave Ctrl-C to the supervisor, which drains workers cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpu_set:
+        # Inherited by the generator processes started below
+        cpu_set.apply()
+        print(f"[Worker {index}] starting on CPUs {cpu_set.cpus} ({cpu_set.threads} threads)...")
+    else:
+        print(f"[Worker {index}] starting...")
+    run_worker(stop=stop)
+
+
+def start_thumbnailer(stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print("[Thumbnailer] starting...")
+    Thumbnailer().run(stop=stop)
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class WorkerSlot:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.stop = None
+        self.started = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.draining = False
+
+    def start(self, cpu_set=None):
+        self.stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=start_worker, args=(self.index, self.stop, cpu_set))
+        self.process.start()
+        self.started = time.monotonic()
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def drain(self):
+        self.draining = True
+        if self.stop:
+            self.stop.set()
+
+
+class Supervisor:
+    """Keeps the worker pool at the size the host and the queue call for."""
+
+    def __init__(self):
+        self.slots = {}
+        self.restarts = 0
+        self.shrink_since = None
+        self.stopping = False
+        self.status = {}
+        self.cores = physical_cores()
+        # Slot i always gets cpu_sets[i]; slots beyond the host's cores run unpinned
+        self.cpu_sets = partition(len(self.cores) // CORES_PER_WORKER, CORES_PER_WORKER, USE_SMT) if CPU_PINNING else []
+        self.thumbnailer = None
+        self.thumbnailer_stop = multiprocessing.Event()
+
+    # ==========================
+    # ✅ SIZING
+    # ==========================
+    def per_worker_bytes(self):
+        footprints = get_recent_footprints(FOOTPRINT_HISTORY)
+        if footprints:
+            return _percentile(footprints, 95) * MEM_HEADROOM
+        return DEFAULT_WORKER_MEM_GB * 1024**3
+
+    def worker_memory(self):
+        total = 0
+        for slot in self.slots.values():
+            if slot.alive():
+                try:
+                    proc = psutil.Process(slot.process.pid)
+                    total += sum(p.memory_info().rss for p in [proc, *proc.children(recursive=True)])
+                except psutil.Error:
+                    pass
+        return total
+
+    def capacity(self):
+        cpu_cap = max(1, len(self.cores) // CORES_PER_WORKER)
+        # Memory our own workers hold is available to the pool we size
+        usable = psutil.virtual_memory().available + self.worker_memory()
+        mem_cap = max(1, int(usable // self.per_worker_bytes()))
+        return cpu_cap, mem_cap
+
+    def target(self):
+        mode = get_setting("workers.mode", "auto")
+        cpu_cap, mem_cap = self.capacity()
+        demand = count_jobs_by_status("queued") + count_jobs_by_status("in_progress")
+        if mode == "fixed":
+            target = max(0, int(get_setting("workers.count", MIN_WORKERS)))
+        else:
+            target = max(MIN_WORKERS, min(demand, cpu_cap, mem_cap, MAX_WORKERS))
+        self.status.update(mode=mode, cpu_cap=cpu_cap, mem_cap=mem_cap, demand=demand,
+                           per_worker_mem_gb=round(self.per_worker_bytes() / 1024**3, 2))
+        return target
+
+    # ==========================
+    # ✅ LIFECYCLE
+    # ==========================
+    def active(self):
+        return [s for s in self.slots.values() if not s.draining]
+
+    def reap(self):
+        now = time.monotonic()
+        for index, slot in list(self.slots.items()):
+            if slot.process is None or slot.alive():
+                continue
+            exitcode = slot.process.exitcode
+            slot.process.join()
+            metrics.mark_process_dead(slot.process.pid)
+            slot.process = None
+            self.fail_orphans()
+            if slot.draining:
+                print(f"[Supervisor] worker {index} drained")
+                del self.slots[index]
+                continue
+            # Crashed: restart, backing off while it keeps dying young
+            slot.failures = slot.failures + 1 if now - slot.started < STABLE_SECONDS else 1
+            slot.retry_at = now + min(MAX_BACKOFF_SECONDS, 2 ** (slot.failures - 1))
+            self.restarts += 1
+            print(f"⚠️ [Supervisor] worker {index} exited ({exitcode}); restarting in {slot.retry_at - now:.0f}s")
+
+    def fail_orphans(self):
+        def alive(worker):
+            try:
+                return worker is not None and psutil.pid_exists(int(worker))
+            except ValueError:
+                return True
+        for job_id in fail_orphaned_jobs(alive):
+            publish_job_change(job_id)
+
+    def resize(self, target):
+        now = time.monotonic()
+        active = self.active()
+
+        if len(active) < target:
+            self.shrink_since = None
+            free = (i for i in range(len(self.slots) + target) if i not in self.slots)
+            for _ in range(target - len(active)):
+                index = next(free)
+                self.slots[index] = WorkerSlot(index)
+        elif len(active) > target:
+            self.shrink_since = self.shrink_since or now
+            fixed = self.status.get("mode") == "fixed"
+            if fixed or now - self.shrink_since >= SHRINK_AFTER_SECONDS:
+                # Highest slots go first; busy ones finish their current job
+                for slot in sorted(active, key=lambda s: s.index, reverse=True)[:len(active) - target]:
+                    slot.drain()
+                    if not slot.alive():
+                        del self.slots[slot.index]
+                wake_workers()
+                self.shrink_since = None
+        else:
+            self.shrink_since = None
+
+        for slot in self.active():
+            if not slot.alive() and now >= slot.retry_at:
+                slot.start(self.cpu_sets[slot.index] if slot.index < len(self.cpu_sets) else None)
+
+    def keep_thumbnailer(self):
+        if not RUN_THUMBNAILER or (self.thumbnailer and self.thumbnailer.is_alive()):
+            return
+        if self.thumbnailer:
+            print(f"⚠️ [Supervisor] thumbnailer exited ({self.thumbnailer.exitcode}); restarting")
+            self.thumbnailer.join()
+            metrics.mark_process_dead(self.thumbnailer.pid)
+        self.thumbnailer = multiprocessing.Process(target=start_thumbnailer, args=(self.thumbnailer_stop,))
+        self.thumbnailer.start()
+
+    def publish_status(self, target):
+        status = dict(
+            self.status,
+            target=target,
+            running=sum(1 for s in self.active() if s.alive()),
+            draining=sum(1 for s in self.slots.values() if s.draining),
+            restarts=self.restarts,
+            supervisor_pid=os.getpid(),
+        )
+        if status != {k: v for k, v in get_setting("workers.status", {}).items() if k != "updated"}:
+            set_setting("workers.status", dict(status, updated=datetime.utcnow().isoformat()))
+
+    def shutdown(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        # Jobs left in progress by a previous run whose workers are gone
+        self.fail_orphans()
+
+        with Listener(CONTROL_CHANNEL) as control:
+            while not self.stopping:
+                self.reap()
+                target = self.target()
+                self.resize(target)
+                self.keep_thumbnailer()
+                self.publish_status(target)
+                metrics.record_memory("supervisor")
+                control.wait(SUPERVISE_SECONDS)
+
+        print("[Supervisor] draining workers...")
+        for slot in self.slots.values():
+            slot.drain()
+        wake_workers()
+        self.thumbnailer_stop.set()
+        request_thumbnails()
+        for slot in self.slots.values():
+            if slot.process:
+                slot.process.join()
+                metrics.mark_process_dead(slot.process.pid)
+        if self.thumbnailer:
+            self.thumbnailer.join()
+            metrics.mark_process_dead(self.thumbnailer.pid)
+        metrics.mark_process_dead(os.getpid())
+        set_setting("workers.status", {})
 
-def start_worker(index):
-    print(f"[Worker {index}] starting...")
-    run_worker()
 
 if __name__ == "__main__":
-    processes = []
-    for i in range(NUM_WORKERS):
-        p = multiprocessing.Process(target=start_worker, args=(i,))
-        p.start()
-        processes.append(p)
-
-    for p in processes:
-        p.join()
+    Supervisor().run()
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+API_TOKEN = "test-token"
+
+# Point every path the modules read at import under a throwaway home
+HOME = tempfile.mkdtemp(prefix="flux-tests-")
+os.environ.update(
+    HOME=HOME,
+    FLUX_DB_PATH=os.path.join(HOME, "flux_api", "flux_jobs.db"),
+    FLUX_RUN_DIR=os.path.join(HOME, "run"),
+    FLUX_GENERATOR_BACKEND="fake",
+    SECRET_KEY="tests",
+    N8N_API_TOKEN=API_TOKEN,
+)
+os.makedirs(os.path.join(HOME, "flux_api"), exist_ok=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def fresh_db():
+    """An initialised database with no jobs or fair-share state."""
+    db.init_db()
+    conn = db.get_conn()
+    for table in ("jobs", "job_progress", "client_shares", "counters", "idempotency_keys", "images"):
+        conn.execute(f"DELETE FROM {table}")
+    return db
+
+
+@pytest.fixture
+def api(fresh_db):
+    """A TestClient for the app that sends the API token."""
+    from fastapi.testclient import TestClient
+
+    import flux_api
+
+    return TestClient(flux_api.app, headers={"Authorization": f"Bearer {API_TOKEN}"})
@@ -0,0 +1,39 @@
+def _batch(*prompts, key="batch-1"):
+    return {"jobs": [{"prompt": prompt, "steps": 4, "width": 64, "height": 64} for prompt in prompts],
+            "idempotency_key": key}
+
+
+def test_same_key_same_batch_returns_the_original_jobs(api, fresh_db):
+    first = api.post("/generate/batch", json=_batch("a fox", "a hare"))
+    assert first.status_code == 200
+    assert first.json()["replayed"] is False
+
+    again = api.post("/generate/batch", json=_batch("a fox", "a hare"))
+    assert again.status_code == 200
+    assert again.json()["replayed"] is True
+    assert again.json()["jobs"] == first.json()["jobs"]
+    assert fresh_db.count_jobs_by_status("queued") == 2
+
+
+def test_key_in_header_replays_too(api, fresh_db):
+    body = _batch("a fox", key=None)
+    first = api.post("/generate/batch", json=body, headers={"Idempotency-Key": "header-key"})
+    again = api.post("/generate/batch", json=body, headers={"Idempotency-Key": "header-key"})
+
+    assert again.json()["replayed"] is True
+    assert again.json()["job_ids"] == first.json()["job_ids"]
+    assert fresh_db.count_jobs_by_status("queued") == 1
+
+
+def test_same_key_different_batch_is_rejected(api, fresh_db):
+    api.post("/generate/batch", json=_batch("a fox"))
+
+    conflict = api.post("/generate/batch", json=_batch("a badger"))
+    assert conflict.status_code == 409
+    assert fresh_db.count_jobs_by_status("queued") == 1
+
+
+def test_without_a_key_every_submit_queues(api, fresh_db):
+    api.post("/generate/batch", json=_batch("a fox", key=None))
+    api.post("/generate/batch", json=_batch("a fox", key=None))
+    assert fresh_db.count_jobs_by_status("queued") == 2
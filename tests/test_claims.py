@@ -0,0 +1,30 @@
+def _queue(db, job_id, client, width=512):
+    db.add_job(job_id, "prompt", 8, 3.5, 512, width, False, f"{job_id}.png", None, client=client)
+
+
+def test_batch_companions_follow_fair_share(fresh_db):
+    # A bulk client queued first; another client's compatible jobs arrive later
+    for i in range(6):
+        _queue(fresh_db, f"a{i}", "token:bulk")
+    for i in range(3):
+        _queue(fresh_db, f"b{i}", "token:other")
+
+    first = fresh_db.claim_next_job(worker=1)
+    batch = [first, *fresh_db.claim_compatible_jobs(first, 3, worker=1)]
+
+    clients = [job["client"] for job in batch]
+    assert clients == ["token:bulk", "token:other", "token:bulk", "token:other"]
+    # Each client's own jobs still go in submission order
+    assert [job["job_id"] for job in batch] == ["a0", "b0", "a1", "b1"]
+
+
+def test_batch_companions_must_be_compatible(fresh_db):
+    _queue(fresh_db, "a0", "token:bulk")
+    _queue(fresh_db, "b0", "token:other", width=768)
+    _queue(fresh_db, "a1", "token:bulk")
+
+    first = fresh_db.claim_next_job(worker=1)
+    companions = fresh_db.claim_compatible_jobs(first, 3, worker=1)
+
+    assert [job["job_id"] for job in companions] == ["a1"]
+    assert fresh_db.get_job("b0")["status"] == "queued"
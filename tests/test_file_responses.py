@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from file_responses import IMMUTABLE, REVALIDATE, parse_range
+from generator import write_png
+from thumbnails import OUTPUT_DIR
+
+
+@pytest.fixture
+def images():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    for name in ("0a1b2c3d.png", "my_render.png"):
+        write_png(os.path.join(OUTPUT_DIR, name), 32, 32, (20, 80, 200))
+
+
+def test_job_id_images_are_immutable(api, images):
+    response = api.get("/images/0a1b2c3d.png", headers={"Accept": "*/*"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE
+
+
+def test_custom_named_images_revalidate(api, images):
+    for path in ("/images/my_render.png", "/thumbnails/my_render_400.webp"):
+        response = api.get(path, headers={"Accept": "*/*"})
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == REVALIDATE
+        assert "etag" in response.headers
+
+
+def test_matching_etag_is_not_modified(api, images):
+    first = api.get("/images/my_render.png", headers={"Accept": "*/*"})
+    response = api.get("/images/my_render.png", headers={"Accept": "*/*", "If-None-Match": first.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+    stale = api.get("/images/my_render.png", headers={"Accept": "*/*", "If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+
+
+def test_single_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=500-", 1000) == (500, 999)
+    # An end past the file is clamped
+    assert parse_range("bytes=900-5000", 1000) == (900, 999)
+
+
+def test_suffix_range():
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=-5000", 1000) == (0, 999)
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-1200", "bytes=50-10", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-10", "bytes=a-b", "bytes=0-10,20-30", "bytes=-"])
+def test_malformed_or_multi_range_is_ignored(header):
+    assert parse_range(header, 1000) is None
+
+
+def test_range_requests(api, images):
+    path = os.path.join(OUTPUT_DIR, "my_render.png")
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    headers = {"Accept": "*/*"}
+
+    partial = api.get("/images/my_render.png", headers={**headers, "Range": "bytes=0-9"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 0-9/{size}"
+    assert partial.content == data[:10]
+
+    suffix = api.get("/images/my_render.png", headers={**headers, "Range": "bytes=-10"})
+    assert suffix.status_code == 206
+    assert suffix.content == data[-10:]
+
+    unsatisfiable = api.get("/images/my_render.png", headers={**headers, "Range": f"bytes={size}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{size}"
+
+    malformed = api.get("/images/my_render.png", headers={**headers, "Range": "bytes=0-1,4-5"})
+    assert malformed.status_code == 200
+    assert malformed.content == data
@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+
+import pytest
+
+from generator import FakeBackend, GeneratorProcess, GeneratorTimeout
+
+
+class SlowLoadBackend(FakeBackend):
+    """A fake whose model load never finishes in time."""
+
+    def load(self):
+        time.sleep(60)
+
+
+def test_model_load_counts_towards_the_call_timeout(monkeypatch):
+    # The generator child imports this module for the backend class
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.abspath(__file__)))
+    gen = GeneratorProcess("txt2img", sys.executable, "", backend="test_generator:SlowLoadBackend")
+
+    started = time.monotonic()
+    with pytest.raises(GeneratorTimeout):
+        gen.generate({"prompt": "p", "steps": 4, "width": 8, "height": 8, "output_path": os.devnull}, timeout=1)
+
+    assert time.monotonic() - started < 10
+    assert gen.proc is None  # killed, not left loading
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+LATENCY = 0.8  # fake generator seconds per call
+STEPS = 4
+
+
+@pytest.fixture
+def generators():
+    os.environ["FLUX_FAKE_LATENCY"] = str(LATENCY)
+    from generator import GeneratorPool
+    from job_queue import GENERATOR_SPECS
+
+    pool = GeneratorPool(GENERATOR_SPECS, backend="fake")
+    # Start it now, so process start-up doesn't count towards the step rate
+    pool.get("txt2img").start()
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def progress():
+    import progress
+
+    for cached in (progress._call_rates, progress._job_rates, progress._queue):
+        cached.at = None
+    return progress
+
+
+def _queue_pair(db, prefix):
+    for i in range(2):
+        db.add_job(f"{prefix}{i}", f"prompt {prefix}{i}", STEPS, 3.5, 64, 64, False, f"{prefix}{i}.png", None)
+
+
+def _claim_pair(db, prefix):
+    _queue_pair(db, prefix)
+    first = db.claim_next_job(worker="1")
+    return [first, *db.claim_compatible_jobs(first, 1, worker="1")]
+
+
+def test_batch_records_the_step_time_of_the_call(fresh_db, generators):
+    import job_queue
+
+    job_queue.process_batch(_claim_pair(fresh_db, "past"), generators)
+
+    for job_id in ("past0", "past1"):
+        job = fresh_db.get_job(job_id)
+        assert job["status"] == "done"
+        assert job["batch_size"] == 2
+        assert job["step_seconds"] == pytest.approx(LATENCY / STEPS, rel=0.25)
+    assert fresh_db.get_job_progress() == {}
+
+
+def test_running_batch_eta_before_first_progress_event(fresh_db, generators, progress):
+    import job_queue
+
+    job_queue.process_batch(_claim_pair(fresh_db, "past"), generators)
+    running = _claim_pair(fresh_db, "now")
+    _queue_pair(fresh_db, "next")
+
+    for job in running:
+        estimate = progress.describe(fresh_db.get_job(job["job_id"]))
+        assert estimate["progress"]["step"] == 0
+        # The whole call is left, however many jobs share it
+        assert estimate["eta_seconds"] == pytest.approx(LATENCY, rel=0.25)
+
+    # Queued jobs start once the running batch is done and take their share
+    # of a batched call each
+    queued = progress.describe(fresh_db.get_job("next0"))
+    assert queued["starts_in_seconds"] == pytest.approx(LATENCY, rel=0.25)
+    assert queued["eta_seconds"] - queued["starts_in_seconds"] == pytest.approx(LATENCY / 2, rel=0.25)
@@ -0,0 +1,47 @@
+import pytest
+
+from db import fts_query
+
+
+def _queue(db, job_id, prompt):
+    db.add_job(job_id, prompt, 8, 3.5, 512, 512, False, f"{job_id}.png", None)
+
+
+def test_words_are_quoted_and_all_required():
+    assert fts_query("red fox") == '"red" "fox"'
+    # Quotes in the input close the phrase; they can't break out of it
+    assert fts_query('"red fox" snow') == '"red fox" "snow"'
+    assert fts_query('"red fox') == '"red fox"'
+
+
+def test_trailing_star_is_a_prefix_search():
+    assert fts_query("mount*") == '"mount"*'
+    assert fts_query("*mount") == '"mount"'
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("fox AND NOT dog", '"fox" "AND" "NOT" "dog"'),
+    ("fox OR dog", '"fox" "OR" "dog"'),
+    ("prompt:fox", '"prompt" "fox"'),
+    ("NEAR(fox dog)", '"NEAR" "fox" "dog"'),
+    ("(fox) -dog +cat ^wolf", '"fox" "dog" "cat" "wolf"'),
+])
+def test_fts5_operators_are_plain_words(text, expected):
+    assert fts_query(text) == expected
+
+
+@pytest.mark.parametrize("text", [None, "", "   ", '""', "*", "-+^()", '" "'])
+def test_empty_queries(text):
+    assert fts_query(text) == ""
+
+
+def test_search_never_raises_on_operator_input(fresh_db):
+    _queue(fresh_db, "a0", "a red fox in the snow")
+    _queue(fresh_db, "a1", "NOT a fox, a mountain")
+
+    for text in ('fox AND', 'NEAR(', '"unclosed', 'prompt:fox', "-fox", "^"):
+        fresh_db.search_jobs(text)
+
+    jobs, _ = fresh_db.search_jobs("NOT fox")
+    assert [job["job_id"] for job in jobs] == ["a1"]
+    assert fresh_db.search_jobs("-+^()") == ([], None)
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+import thumbnails
+from generator import write_png
+
+
+@pytest.fixture
+def images():
+    os.makedirs(thumbnails.OUTPUT_DIR, exist_ok=True)
+    for name in ("sunset.png", "harbour_400.png"):
+        write_png(os.path.join(thumbnails.OUTPUT_DIR, name), 32, 32, (200, 80, 20))
+
+
+def test_plain_thumbnail_is_png_for_clients_naming_no_format(api, images):
+    response = api.get("/thumbnails/sunset.png", headers={"Accept": "*/*"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_plain_thumbnail_follows_accept(api, images):
+    response = api.get("/thumbnails/sunset.png", headers={"Accept": "image/webp,*/*"})
+    assert response.headers["content-type"] == "image/webp"
+
+
+def test_rendition_names_need_a_rendered_width_and_an_existing_source(images):
+    assert thumbnails.parse_thumb_name("sunset_400.webp") == ("sunset.png", 400, "webp")
+    assert thumbnails.parse_thumb_name("sunset_401.webp") is None
+    # An image whose name merely looks like a rendition
+    assert thumbnails.parse_thumb_name("harbour_400.png") is None
+
+
+def test_image_named_like_a_rendition_gets_its_own_thumbnail(api, images):
+    response = api.get("/thumbnails/harbour_400.png", headers={"Accept": "*/*"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
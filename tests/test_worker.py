@@ -0,0 +1,42 @@
+import os
+
+import job_queue
+
+
+def _claimed_job(db, job_id, output_dir):
+    db.add_job(job_id, "prompt", 4, 3.5, 64, 64, False, f"{job_id}.png", output_dir,
+               custom_filename="mine.png", param_hash=f"hash-{job_id}")
+    return db.claim_next_job(worker="1")
+
+
+def _render(job):
+    path = os.path.join(job_queue.OUTPUT_DIR, job["filename"])
+    os.makedirs(job_queue.OUTPUT_DIR, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"png")
+    return path
+
+
+def test_finished_job_is_delivered(fresh_db, tmp_path):
+    job = _claimed_job(fresh_db, "kept", str(tmp_path))
+    path = _render(job)
+
+    job_queue._finish_job(job, path)
+
+    assert fresh_db.get_job("kept")["status"] == "done"
+    assert (tmp_path / "mine.png").exists()
+    assert os.path.exists(path)
+
+
+def test_job_cancelled_while_running_gets_no_side_effects(fresh_db, tmp_path):
+    job = _claimed_job(fresh_db, "dropped", str(tmp_path))
+    path = _render(job)
+    fresh_db.cancel_job("dropped")
+
+    job_queue._finish_job(job, path)
+
+    assert fresh_db.get_job("dropped")["status"] == "cancelled"
+    assert not (tmp_path / "mine.png").exists()
+    assert not os.path.exists(path)
+    assert fresh_db.get_conn().execute("SELECT COUNT(*) FROM images").fetchone()[0] == 0
+    assert fresh_db.get_cached_result("hash-dropped") is None
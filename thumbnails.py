@@ -0,0 +1,297 @@
+"""Gallery thumbnails, rendered off the worker's critical path.
+
+Every catalogued image gets a small set of downscaled renditions
+(``thumbnails/<stem>_<width>.<format>``) for gallery srcsets, plus a
+full-size WebP/AVIF copy (``renditions/<stem>.<format>``) that ``/images``
+serves to clients that accept it instead of the PNG. The ``images``
+table records which images still need them; workers only flip that flag and
+publish on the ``thumbnails`` channel, and a ``Thumbnailer`` (run by the
+worker supervisor) renders pending images in its own small process pool.
+Anything the pool hasn't got to yet is rendered on demand by the API.
+"""
+import os
+import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+try:
+    # Registers AVIF on Pillow builds without native support (optional)
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+from db import init_db, get_pending_thumbnails, set_thumbnail_state, reset_thumbnails, count_pending_thumbnails
+from notify import Listener, publish
+import metrics
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+THUMB_DIR = os.path.join(OUTPUT_DIR, "thumbnails")
+RENDITION_DIR = os.path.join(OUTPUT_DIR, "renditions")
+
+# Widths rendered for srcsets; DEFAULT_WIDTH backs the plain /thumbnails/<image> URL
+WIDTHS = (200, 400, 800)
+DEFAULT_WIDTH = 400
+
+# Encoders in preference order; AVIF only where this Pillow can write it
+QUALITY = {"avif": 55, "webp": 80, "png": None}
+FULL_QUALITY = {"avif": 70, "webp": 90}
+FULL_RENDITIONS = os.getenv("FLUX_FULL_RENDITIONS", "1") == "1"
+FORMATS = tuple(f for f in ("avif", "webp") if f".{f}" in Image.registered_extensions()) or ("png",)
+MEDIA_TYPES = {"avif": "image/avif", "webp": "image/webp", "png": "image/png"}
+
+THUMBS_CHANNEL = "thumbnails"
+POOL_SIZE = max(1, int(os.getenv("FLUX_THUMB_WORKERS", "2")))
+CLAIM_BATCH = 64
+FALLBACK_POLL_SECONDS = 60
+
+# <stem>_<width>.<format>, only for the widths rendered
+THUMB_NAME = re.compile(
+    rf"^(?P<stem>.+)_(?P<width>{'|'.join(map(str, WIDTHS))})\.(?P<format>{'|'.join(MEDIA_TYPES)})$"
+)
+
+
+def thumb_name(filename, width, fmt):
+    return f"{os.path.splitext(filename)[0]}_{width}.{fmt}"
+
+
+def parse_thumb_name(name, image_dir=OUTPUT_DIR):
+    """``(source filename, width, format)`` for a rendition name, or None.
+
+    Names that only look like one (``sunset_400.png`` with no
+    ``sunset.png`` next to it) are images in their own right.
+    """
+    m = THUMB_NAME.match(name)
+    if not m or m["format"] not in FORMATS + ("png",):
+        return None
+    source = f"{m['stem']}.png"
+    if not os.path.exists(os.path.join(image_dir, source)):
+        return None
+    return source, int(m["width"]), m["format"]
+
+
+def negotiate(accept, fallback=None):
+    """Best rendition format the client names in its Accept header.
+
+    Clients that name none (``*/*``) get ``fallback``, WebP by default.
+    """
+    accept = accept or ""
+    for fmt in FORMATS:
+        if MEDIA_TYPES[fmt] in accept:
+            return fmt
+    return fallback or ("webp" if "webp" in FORMATS else "png")
+
+
+def srcsets(filename, base_url):
+    """{format: srcset string} for every rendition of ``filename``."""
+    return {
+        fmt: ", ".join(f"{base_url}/{thumb_name(filename, w, fmt)} {w}w" for w in WIDTHS)
+        for fmt in FORMATS
+    }
+
+
+# ==========================
+# ✅ RENDERING
+# ==========================
+def _downscale(img, width):
+    """Fit ``img`` within ``width`` x ``width`` cheaply.
+
+    ``reduce`` does the bulk of the work with integer box averaging; the
+    final resample only covers the last factor of two or less.
+    """
+    scale = max(img.width, img.height) / width
+    if scale <= 1:
+        return img
+    factor = int(scale / 2)
+    if factor > 1:
+        img = img.reduce(factor)
+    size = (max(1, round(img.width * width / max(img.width, img.height))),
+            max(1, round(img.height * width / max(img.width, img.height))))
+    return img.resize(size, Image.LANCZOS)
+
+
+def _save(img, path, fmt, quality=QUALITY):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if fmt == "png":
+        img.save(tmp, "PNG")
+    else:
+        img.save(tmp, fmt.upper(), quality=quality[fmt])
+    os.replace(tmp, path)
+
+
+def _is_fresh(path, source_mtime):
+    try:
+        return os.stat(path).st_mtime >= source_mtime
+    except FileNotFoundError:
+        return False
+
+
+def render(source_path, thumb_dir=THUMB_DIR, widths=WIDTHS, formats=FORMATS):
+    """Write every missing or stale rendition of ``source_path``; return how many."""
+    os.makedirs(thumb_dir, exist_ok=True)
+    filename = os.path.basename(source_path)
+    source_mtime = os.stat(source_path).st_mtime
+
+    wanted = []
+    for width in widths:
+        for fmt in formats:
+            path = os.path.join(thumb_dir, thumb_name(filename, width, fmt))
+            if not _is_fresh(path, source_mtime):
+                wanted.append((width, fmt, path))
+    if not wanted:
+        return 0
+
+    with Image.open(source_path) as img:
+        # A no-op for PNG; JPEG init images decode straight at reduced scale
+        img.draft("RGB", (max(widths), max(widths)))
+        current = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+
+    # Largest first, each size made from the one before it
+    for width in sorted({w for w, _, _ in wanted}, reverse=True):
+        current = _downscale(current, width)
+        for w, fmt, path in wanted:
+            if w == width:
+                _save(current, path, fmt)
+    return len(wanted)
+
+
+def rendition_path(filename, fmt, rendition_dir=RENDITION_DIR):
+    return os.path.join(rendition_dir, f"{os.path.splitext(filename)[0]}.{fmt}")
+
+
+def render_full(source_path, rendition_dir=RENDITION_DIR, formats=FORMATS):
+    """Write missing or stale full-size renditions of a PNG; return how many."""
+    formats = [f for f in formats if f != "png"]
+    if not formats or not source_path.lower().endswith(".png"):
+        return 0
+    source_mtime = os.stat(source_path).st_mtime
+    wanted = [(fmt, rendition_path(os.path.basename(source_path), fmt, rendition_dir)) for fmt in formats]
+    wanted = [(fmt, path) for fmt, path in wanted if not _is_fresh(path, source_mtime)]
+    if not wanted:
+        return 0
+    os.makedirs(rendition_dir, exist_ok=True)
+    with Image.open(source_path) as img:
+        img.load()
+        for fmt, path in wanted:
+            _save(img, path, fmt, FULL_QUALITY)
+    return len(wanted)
+
+
+def fresh_rendition(filename, fmt, image_dir=OUTPUT_DIR, rendition_dir=RENDITION_DIR):
+    """Path of an up-to-date full-size rendition of ``filename``, or None."""
+    path = rendition_path(filename, fmt, rendition_dir)
+    try:
+        return path if _is_fresh(path, os.stat(os.path.join(image_dir, filename)).st_mtime) else None
+    except FileNotFoundError:
+        return None
+
+
+def render_all(source_path, thumb_dir=THUMB_DIR, rendition_dir=RENDITION_DIR):
+    """Everything the background stage produces for one image."""
+    started = time.perf_counter()
+    count = render(source_path, thumb_dir)
+    if FULL_RENDITIONS:
+        count += render_full(source_path, rendition_dir)
+    if count:
+        with Image.open(source_path) as img:
+            size = img.size
+        metrics.THUMBNAIL.labels(metrics.resolution(*size)).observe(time.perf_counter() - started)
+    return count
+
+
+def ensure(filename, width=DEFAULT_WIDTH, fmt=None, image_dir=OUTPUT_DIR, thumb_dir=THUMB_DIR):
+    """Path of one rendition, rendering it now if it doesn't exist yet.
+
+    Raises FileNotFoundError when the source image is gone.
+    """
+    fmt = fmt or FORMATS[0]
+    path = os.path.join(thumb_dir, thumb_name(filename, width, fmt))
+    if not os.path.exists(path):
+        render(os.path.join(image_dir, filename), thumb_dir, widths=(width,), formats=(fmt,))
+    return path
+
+
+# ==========================
+# ✅ BACKGROUND STAGE
+# ==========================
+def request_thumbnails():
+    """Wake the thumbnailer; call after cataloguing new images."""
+    publish(THUMBS_CHANNEL)
+
+
+def backfill():
+    """Queue every catalogued image for a check; existing renditions are skipped."""
+    queued = reset_thumbnails()
+    request_thumbnails()
+    return queued
+
+
+def _background_priority():
+    # Leave the CPU to the generators
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+class Thumbnailer:
+    """Renders pending thumbnails in a small process pool until stopped."""
+
+    def __init__(self, pool_size=POOL_SIZE, image_dir=OUTPUT_DIR, thumb_dir=THUMB_DIR, rendition_dir=RENDITION_DIR):
+        self.pool_size = pool_size
+        self.image_dir = image_dir
+        self.thumb_dir = thumb_dir
+        self.rendition_dir = rendition_dir
+
+    def run_once(self, pool):
+        """Render one claim batch; return how many images it covered."""
+        metrics.record_memory("thumbnailer", include_children=True)
+        pending = get_pending_thumbnails(CLAIM_BATCH)
+        if not pending:
+            return 0
+        futures = {
+            pool.submit(render_all, os.path.join(self.image_dir, filename), self.thumb_dir, self.rendition_dir): filename
+            for filename in pending
+        }
+        done, failed = [], []
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done.append(futures[future])
+            except Exception as e:
+                print(f"⚠️ Thumbnail failed for {futures[future]}: {e}")
+                failed.append(futures[future])
+        set_thumbnail_state(done, 1)
+        # Not retried until the image changes or a backfill is requested
+        set_thumbnail_state(failed, -1)
+        return len(pending)
+
+    def run(self, stop=None, until_empty=False):
+        # Bind before the first claim so an image catalogued in between still wakes us
+        with Listener(THUMBS_CHANNEL) as wakeups, \
+                ProcessPoolExecutor(self.pool_size, initializer=_background_priority) as pool:
+            while not (stop and stop.is_set()):
+                if self.run_once(pool):
+                    continue
+                if until_empty:
+                    return
+                wakeups.wait(FALLBACK_POLL_SECONDS)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Render gallery thumbnails")
+    ap.add_argument("--backfill", action="store_true", help="queue every catalogued image first")
+    ap.add_argument("--workers", type=int, default=POOL_SIZE)
+    args = ap.parse_args()
+
+    init_db()
+    if args.backfill:
+        print(f"Queued {backfill()} images")
+    Thumbnailer(args.workers).run(until_empty=True)
+    print(f"✅ Done ({count_pending_thumbnails()} pending)")
+
+
+if __name__ == "__main__":
+    main()
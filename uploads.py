@@ -0,0 +1,177 @@
+"""Init image uploads: size-capped, checked while streaming, stored by content.
+
+``store_upload`` copies an upload in chunks into ``uploads/<sha256>.<ext>``,
+hashing as it goes and rejecting it as soon as the header shows an
+unsupported format or oversized dimensions, or the byte count passes the
+cap. Re-uploading an image that is already stored keeps the existing file.
+Its gallery entry (``init_<hash>.<ext>`` in the image directory, which the
+img2img picker lists) is a hardlink to the same file.
+
+``LimitUploadSize`` enforces the cap before that, while the request body is
+still being received, so an oversized upload is cut off instead of being
+spooled to disk in full first.
+"""
+import io
+import os
+import uuid
+import hashlib
+import shutil
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+
+OUTPUT_DIR = os.path.expanduser("~/FluxImages")
+UPLOAD_DIR = os.path.join(OUTPUT_DIR, "uploads")
+
+MAX_UPLOAD_BYTES = int(os.getenv("FLUX_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+MAX_UPLOAD_SIDE = int(os.getenv("FLUX_MAX_UPLOAD_SIDE", "4096"))
+# Multipart framing and the other form fields
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+# PIL format: extension stored
+FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+CHUNK_SIZE = 256 * 1024
+# Give up looking for a header after this much (e.g. a JPEG with huge EXIF)
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    """The upload is not an acceptable init image; ``status_code`` says why."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check_header(head, complete=False):
+    """Format of the image whose first bytes are ``head``, or None if more are needed.
+
+    ``complete`` means ``head`` is the whole file.
+    """
+    try:
+        # Lazy open: only the header is parsed
+        with Image.open(io.BytesIO(head)) as img:
+            fmt, (width, height) = img.format, img.size
+    except Exception:
+        if not complete and len(head) < MAX_HEADER_BYTES:
+            return None
+        raise UploadRejected("Upload is not a readable image")
+    if fmt not in FORMATS:
+        raise UploadRejected(f"Unsupported image format {fmt}; use PNG, JPEG or WebP", 415)
+    if max(width, height) > MAX_UPLOAD_SIDE:
+        raise UploadRejected(f"Image is {width}x{height}; the limit is {MAX_UPLOAD_SIDE}px per side", 413)
+    return fmt
+
+
+def store_upload(fileobj, upload_dir=UPLOAD_DIR, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream ``fileobj`` into the content-addressed store; return its path.
+
+    Raises UploadRejected (nothing is kept) for empty, oversized,
+    unreadable or unsupported images.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    tmp = os.path.join(upload_dir, f".{uuid.uuid4().hex}.part")
+    digest, size, head, fmt = hashlib.sha256(), 0, b"", None
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"Upload exceeds {max_bytes // (1024 * 1024)} MB", 413)
+                if fmt is None:
+                    head += chunk
+                    fmt = _check_header(head)
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadRejected("Uploaded image is empty")
+        if fmt is None:
+            fmt = _check_header(head, complete=True)
+
+        path = os.path.join(upload_dir, digest.hexdigest() + FORMATS[fmt])
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+        return path
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def link_into_gallery(path, image_dir=OUTPUT_DIR):
+    """Hardlink a stored upload into the image directory; return the link path.
+
+    Falls back to a copy where hardlinks aren't possible (another file system).
+    """
+    digest, ext = os.path.splitext(os.path.basename(path))
+    link = os.path.join(image_dir, f"init_{digest[:16]}{ext}")
+    if os.path.exists(link):
+        return link
+    try:
+        os.link(path, link)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(path, link)
+    return link
+
+
+class LimitUploadSize:
+    """ASGI middleware capping request bodies on ``paths`` at ``max_bytes``.
+
+    Declared Content-Length is checked up front; chunked bodies are counted
+    as they arrive and the request fails with 413 once over.
+    """
+
+    def __init__(self, app, paths, max_bytes=MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or \
+                scope["path"].removeprefix(scope.get("root_path", "")) not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Re-raised as-is by FastAPI's body parsing, so it stays a 413
+                    raise HTTPException(status_code=413)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB".encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})